@@ -1,47 +1,253 @@
-from flask import Flask, render_template, request, send_file, jsonify
+from flask import Flask, render_template, request, jsonify, g, Response
 import cv2
 import numpy as np
-from PIL import Image, ImageEnhance
 import os
-import tempfile
+import select
+import socket
+import sys
+import time
+from concurrent.futures import CancelledError
+
+# Enhancement code is shared with the Streamlit apps in src/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+from pipeline import render_enhanced
+from variants import DEFAULT_LAYOUT, LAYOUTS, MAX_VARIANTS, SHEET_TILE_SIDE, multipart_boundary, render_variants
+import encoding
+from backends import DEFAULT_BACKEND, artifact_path, configure_threads, load_backend
+from work_pool import WorkPool, Overloaded, Cancelled
+from result_cache import ResultCache
+from image_store import ImageStore
+import telemetry
+from telemetry import span
 
 app = Flask(__name__)
+# Under `python appp.py`, forkserver/spawn pool workers re-import this script as __mp_main__.
+# Their jobs live in src/ modules, so they skip the model preload and the disk cache below.
+SERVER_PROCESS = __name__ != "__mp_main__"
 UPLOAD_FOLDER = "uploads"
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+# Where the result cache and request profiles are written: the user's cache directory, not
+# the working directory (RESULT_CACHE_DIR and PROFILE_DIR override each one)
+DATA_DIR = os.environ.get("ENHANCER_DATA_DIR", os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"), "lowlight-enhancer"))
+
+# Trained UNet, served through a micro-batching queue shared by all requests. UNET_BACKEND
+# "torchscript" or "onnxruntime" serves the artifact written by src/export.py instead of the
+# .pth (see src/bench_backends.py); the thread counts apply to whichever backend runs it.
+UNET_BACKEND = os.environ.get("UNET_BACKEND", DEFAULT_BACKEND)
+MODEL_PATH = os.environ.get("MODEL_PATH", artifact_path("lowlight_enhancer.pth", UNET_BACKEND))
+UNET_INTRA_OP_THREADS = int(os.environ.get("UNET_INTRA_OP_THREADS", 0)) or None
+UNET_INTER_OP_THREADS = int(os.environ.get("UNET_INTER_OP_THREADS", 0)) or None
+# Images over ModelServer's pixel limit: "tiled" (exact) or "guided" (low-res inference, much faster)
+UNET_LARGE_IMAGES = os.environ.get("UNET_LARGE_IMAGES", "tiled")
+# The torch stack (2-3 s and a few hundred MB to import) is only loaded once a request needs
+# the UNet. With PRELOAD_MODEL=1 it is loaded at import instead, for servers that fork their
+# workers after importing the app (gunicorn --preload): workers then start with torch imported
+# and share the parent's mapped weights copy-on-write (see src/bench_startup.py).
+PRELOAD_MODEL = os.environ.get("PRELOAD_MODEL") == "1"
+model_server = None
+preloaded_model = None
+
+def preload_model():
+    """Import the torch stack and map the eager checkpoint without running it, so forking stays safe.
+
+    Exported backends are left to each worker: their runtimes start
+    thread pools as they load, which don't survive a fork.
+    """
+    global preloaded_model
+    import serving  # not used here; imported for the workers to inherit
+    if UNET_BACKEND == "eager" and os.path.exists(MODEL_PATH):
+        preloaded_model = load_backend(MODEL_PATH, UNET_BACKEND)
+
+def init_model_server():
+    """Load and warm up the model once; later calls return the running server."""
+    global model_server
+    if model_server is None and os.path.exists(MODEL_PATH):
+        from serving import ModelServer
+        options = dict(large_images=UNET_LARGE_IMAGES)
+        if preloaded_model is not None:
+            configure_threads(UNET_INTRA_OP_THREADS, UNET_INTER_OP_THREADS)
+            model_server = ModelServer(preloaded_model, **options).start()
+        else:
+            model_server = ModelServer.from_checkpoint(MODEL_PATH, backend=UNET_BACKEND, intra_op_threads=UNET_INTRA_OP_THREADS,
+                                                       inter_op_threads=UNET_INTER_OP_THREADS, **options).start()
+    return model_server
+
+if PRELOAD_MODEL and SERVER_PROCESS:
+    preload_model()
+
+# CPU-bound /enhance work (adjustments + encode) runs in worker processes. Requests beyond
+# the busy workers plus ENHANCE_QUEUE waiting ones are refused with 503 and Retry-After.
+ENHANCE_WORKERS = int(os.environ.get("ENHANCE_WORKERS", os.cpu_count() or 1))
+ENHANCE_QUEUE = int(os.environ.get("ENHANCE_QUEUE", 2 * ENHANCE_WORKERS))
+# Upper bound in seconds for one request; a smaller "timeout" may be sent with the request
+ENHANCE_TIMEOUT = float(os.environ.get("ENHANCE_TIMEOUT", 60))
+# Threads per worker for PNG compression (see encoding.encode_png_parallel)
+ENCODE_THREADS = int(os.environ.get("ENCODE_THREADS", 1))
+# Threads per /enhance/variants job for the variants' independent stages and encodes
+VARIANT_THREADS = int(os.environ.get("VARIANT_THREADS", min(4, os.cpu_count() or 1)))
+work_pool = None
+
+def init_work_pool():
+    global work_pool
+    if work_pool is None:
+        work_pool = WorkPool(ENHANCE_WORKERS, ENHANCE_QUEUE, ENHANCE_TIMEOUT).start()
+    return work_pool
+
+def client_disconnected():
+    """Whether the client of the current request has closed its connection.
+
+    The request body has been read by then, so a readable socket with
+    nothing to peek at means EOF. Servers that don't expose the socket
+    (or TLS sockets) are reported as connected.
+    """
+    sock = request.environ.get("werkzeug.socket") or request.environ.get("gunicorn.socket")
+    if sock is None:
+        return False
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+        return bool(readable) and sock.recv(1, socket.MSG_PEEK) == b""
+    except ValueError:
+        return False
+    except OSError:
+        return True
+
+# Encoded results keyed by upload content + enhancement settings, so re-posts skip all work
+result_cache = ResultCache(
+    memory_bytes=int(os.environ.get("RESULT_CACHE_MB", 256)) * 1024 * 1024,
+    # Opening the disk tier prunes and evicts its files, which only the server may do
+    disk_dir=os.environ.get("RESULT_CACHE_DIR", os.path.join(DATA_DIR, "results")) if SERVER_PROCESS else None,
+    disk_bytes=int(os.environ.get("RESULT_CACHE_DISK_MB", 2048)) * 1024 * 1024,
+)
+
+# Uploads decoded once and kept in memory with their preview pyramids
+image_store = ImageStore(max_bytes=int(os.environ.get("IMAGE_STORE_MB", 1024)) * 1024 * 1024)
+
+def load_upload(filename):
+    """Decoded upload from the store, falling back to the file on disk after an eviction."""
+    entry = image_store.get(filename)
+    if entry is None:
+        image = cv2.imread(os.path.join(UPLOAD_FOLDER, filename))
+        if image is None:
+            return None
+        entry = image_store.put(filename, image)
+    return entry
+
+# Request-level metrics; stage spans are recorded by the pipeline and the spans below
+REQUESTS = telemetry.counter("http_requests_total", "HTTP requests", ("route", "status"))
+REQUEST_SECONDS = telemetry.histogram("http_request_seconds", "HTTP request latency", ("route",))
+# Per-request sampling profiles (?profile=1) are written here when ENABLE_PROFILING=1
+PROFILE_DIR = os.environ.get("PROFILE_DIR", os.path.join(DATA_DIR, "profiles"))
+PROFILING_ENABLED = os.environ.get("ENABLE_PROFILING") == "1"
+
+def collect_service_metrics():
+    lines = []
+    for tier, stats in (("results", result_cache.stats()), ("images", image_store.stats())):
+        hits = stats.get("hits", stats.get("memory_hits", 0) + stats.get("disk_hits", 0))
+        lines += telemetry.sample_lines(f"enhance_{tier}_cache_hits_total", f"{tier} cache hits", {None: hits}, "counter")
+        lines += telemetry.sample_lines(f"enhance_{tier}_cache_misses_total", f"{tier} cache misses",
+                                        {None: stats["misses"]}, "counter")
+        used = stats.get("bytes", stats.get("memory_bytes", 0))
+        lines += telemetry.sample_lines(f"enhance_{tier}_cache_bytes", f"{tier} cache memory in use", {None: used})
+    if model_server is not None:
+        stats = model_server.stats()
+        lines += telemetry.sample_lines("model_queue_depth", "Requests waiting for a UNet batch", {None: stats["queue_depth"]})
+        lines += telemetry.sample_lines("model_mean_batch_size", "Mean UNet batch size", {None: stats["mean_batch_size"]})
+    if work_pool is not None:
+        stats = work_pool.stats()
+        lines += telemetry.sample_lines("enhance_pool_admitted", "Requests holding a work pool slot", {None: stats["admitted"]})
+        lines += telemetry.sample_lines("enhance_pool_busy_workers", "Work pool workers running a job", {None: stats["busy"]})
+        lines += telemetry.sample_lines("enhance_pool_jobs_total", "Work pool jobs by outcome",
+                                        {(("outcome", k),): stats[k] for k in
+                                         ("completed", "failed", "rejected", "timed_out", "cancelled")}, "counter")
+    return lines
+
+telemetry.COLLECTORS.append(collect_service_metrics)
+
+@app.before_request
+def start_request_trace():
+    g.started = time.perf_counter()
+    g.trace_context = telemetry.trace()
+    g.trace = g.trace_context.__enter__()
+    g.profiler = None
+    if PROFILING_ENABLED and request.args.get("profile") == "1":
+        g.profiler = telemetry.SamplingProfiler().__enter__()
+
+@app.after_request
+def finish_request_trace(response):
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    REQUESTS.inc(route=route, status=str(response.status_code))
+    REQUEST_SECONDS.observe(time.perf_counter() - g.started, route=route)
+    if g.trace.spans:
+        response.headers["Server-Timing"] = g.trace.server_timing()
+    if g.profiler is not None:
+        g.profiler.__exit__(None, None, None)
+        response.headers["X-Profile"] = g.profiler.save(PROFILE_DIR, prefix=route.strip("/") or "index")
+    return response
+
+@app.teardown_request
+def close_request_trace(exc):
+    if "trace_context" in g:
+        g.trace_context.__exit__(None, None, None)
+
+def send_image(data, fmt, cache_status):
+    # The encoded bytes go out as the body directly; nothing touches the disk
+    response = Response(data, mimetype=encoding.mimetype(fmt))
+    response.headers["X-Cache"] = cache_status
+    response.headers["Vary"] = "Accept"
+    return response
+
+def send_variants(data, fmt, layout, cache_status):
+    if layout == "sheet":
+        return send_image(data, fmt, cache_status)
+    response = Response(data, content_type=f'multipart/mixed; boundary="{multipart_boundary(data)}"')
+    response.headers["X-Cache"] = cache_status
+    response.headers["Vary"] = "Accept"
+    return response
+
+def parse_render_options(data, default_max_side=None):
+    """max_side, deadline, format and quality of a render request; ValueError if one is invalid."""
+    # Longest side of the result; previews pass a small value, the final export leaves it out
+    max_side = data.get("max_side", default_max_side)
+    if max_side is not None and (not isinstance(max_side, int) or max_side < 1):
+        raise ValueError("max_side must be a positive integer")
+    timeout = data.get("timeout", ENHANCE_TIMEOUT)
+    if not isinstance(timeout, (int, float)) or timeout <= 0:
+        raise ValueError("timeout must be a positive number of seconds")
+    deadline = time.monotonic() + min(timeout, ENHANCE_TIMEOUT)
+    # Output format: "format"/"quality" in the body, else the Accept header (PNG by default)
+    fmt, quality = encoding.parse_format(data.get("format") or encoding.negotiate(request.accept_mimetypes),
+                                         data.get("quality"))
+    return max_side, deadline, fmt, quality
+
+def model_params():
+    """What UNet output depends on besides the image, for result cache keys."""
+    if not os.path.exists(MODEL_PATH):
+        return {}
+    return {"model": result_cache.file_digest(MODEL_PATH), "large_images": UNET_LARGE_IMAGES, "backend": UNET_BACKEND}
 
-# Enhancement Functions
-def apply_clahe(image, clip_limit=3.0, grid_size=(8,8)):
-    lab = cv2.cvtColor(image, cv2.COLOR_BGR2LAB)
-    l, a, b = cv2.split(lab)
-    clahe = cv2.createCLAHE(clipLimit=clip_limit, tileGridSize=grid_size)
-    l = clahe.apply(l)
-    lab = cv2.merge((l, a, b))
-    return cv2.cvtColor(lab, cv2.COLOR_LAB2BGR)
-
-def gamma_correction(image, gamma=1.5):
-    invGamma = 1.0 / gamma
-    table = np.array([(i / 255.0) ** invGamma * 255 for i in range(256)]).astype("uint8")
-    return cv2.LUT(image, table)
-
-def white_balance(image):
-    wb = cv2.xphoto.createSimpleWB()
-    return wb.balanceWhite(image)
-
-def adjust_brightness_contrast(image, brightness=1.0, contrast=1.0):
-    img = Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
-    enhancer = ImageEnhance.Brightness(img)
-    img = enhancer.enhance(brightness)
-    enhancer = ImageEnhance.Contrast(img)
-    img = enhancer.enhance(contrast)
-    return cv2.cvtColor(np.array(img), cv2.COLOR_RGB2BGR)
-
-def adjust_saturation_sharpness(image, saturation=1.0, sharpness=1.0):
-    img = Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
-    enhancer = ImageEnhance.Color(img)
-    img = enhancer.enhance(saturation)
-    enhancer = ImageEnhance.Sharpness(img)
-    img = enhancer.enhance(sharpness)
-    return cv2.cvtColor(np.array(img), cv2.COLOR_RGB2BGR)
+def run_unet(image, deadline):
+    """The UNet output for `image` through the shared model server; None if there is no checkpoint."""
+    server = init_model_server()
+    if server is None:
+        return None
+    with span("unet", pixels=image.shape[0] * image.shape[1]):
+        return server.enhance(image, timeout=deadline - time.monotonic(), cancelled=client_disconnected)
+
+def pool_error(e):
+    """Response for a failed admission or job: overloaded, out of time, abandoned or bad input."""
+    if isinstance(e, Overloaded):
+        response = jsonify({"error": "Server is busy, try again later"})
+        response.headers["Retry-After"] = str(e.retry_after)
+        return response, 503
+    if isinstance(e, TimeoutError):
+        return jsonify({"error": "Enhancement did not finish in time"}), 504
+    if isinstance(e, (Cancelled, CancelledError)):
+        # Client closed request (nginx's convention); nobody reads this response
+        return jsonify({"error": "Client disconnected"}), 499
+    return jsonify({"error": str(e)}), 500
+
+POOL_ERRORS = (Overloaded, TimeoutError, Cancelled, CancelledError, ValueError)
 
 @app.route("/")
 def index():
@@ -54,15 +260,28 @@ def upload():
         return jsonify({"error": "No file uploaded"}), 400
 
     filepath = os.path.join(UPLOAD_FOLDER, file.filename)
-    file.save(filepath)
-    
-    return jsonify({"filename": file.filename})
+    data = file.read()
+    with open(filepath, "wb") as f:
+        f.write(data)
+
+    # Decode once here; later /enhance calls reuse the array
+    image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        image_store.discard(file.filename)
+        return jsonify({"error": "Failed to decode image"}), 400
+    image_store.put(file.filename, image)
+
+    return jsonify({"filename": file.filename, "width": image.shape[1], "height": image.shape[0]})
 
 @app.route("/enhance", methods=["POST"])
 def enhance():
     data = request.json
     filename = data["filename"]
     enhancements = data["enhancements"]
+    try:
+        max_side, deadline, fmt, quality = parse_render_options(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
     filepath = os.path.join(UPLOAD_FOLDER, filename)
 
@@ -70,29 +289,138 @@ def enhance():
     if not os.path.exists(filepath):
         return jsonify({"error": "File not found"}), 400
 
-    # Read the image
-    image = cv2.imread(filepath)
-    if image is None:
-        return jsonify({"error": "Failed to load image. Check file path and integrity."}), 400
+    # Same file content and settings as an earlier request: return the stored bytes as is
+    params = {"enhancements": enhancements, "max_side": max_side, "format": fmt, "quality": quality}
+    if enhancements.get("unet", False):
+        params.update(model_params())
+    with span("cache_lookup"):
+        cache_key = result_cache.key(filepath, params)
+        cached = result_cache.get(cache_key)
+    if cached is not None:
+        return send_image(cached, fmt, "HIT")
+
+    pool = init_work_pool()
+    try:
+        with pool.admit():
+            with span("decode"):
+                entry = load_upload(filename)
+                if entry is None:
+                    return jsonify({"error": "Failed to load image. Check file path and integrity."}), 400
+                image = entry.preview(max_side)
+
+            # Run the UNet first, then the classical adjustments on its output
+            if enhancements.get("unet", False):
+                image = run_unet(image, deadline)
+                if image is None:
+                    return jsonify({"error": f"Model checkpoint '{MODEL_PATH}' not found"}), 400
+
+            # Adjustments and encode in a worker process; the same bytes are cached and sent
+            data = pool.run(render_enhanced, image, enhancements, fmt, quality, ENCODE_THREADS,
+                            timeout=deadline - time.monotonic(), cancelled=client_disconnected)
+    except POOL_ERRORS as e:
+        return pool_error(e)
+    with span("cache_store"):
+        result_cache.put(cache_key, data)
+
+    return send_image(data, fmt, "MISS")
+
+@app.route("/enhance/variants", methods=["POST"])
+def enhance_variants():
+    """Several looks of one upload in one request, e.g. a few gamma/CLAHE settings to compare.
+
+    Body as for /enhance, with "variants" (a list of enhancements dicts)
+    instead of "enhancements", plus optional "layout" ("sheet" for one
+    contact sheet image, "multipart" for each variant encoded on its own),
+    "labels" for the sheet tiles and "columns". Stages the variants have
+    in common run once (see src/variants.py). Sheet tiles default to
+    SHEET_TILE_SIDE pixels on their longest side.
+    """
+    data = request.json
+    filename = data["filename"]
+    variants = data.get("variants")
+    if (not isinstance(variants, list) or not 1 <= len(variants) <= MAX_VARIANTS
+            or not all(isinstance(v, dict) for v in variants)):
+        return jsonify({"error": f"variants must be a list of 1 to {MAX_VARIANTS} enhancement settings"}), 400
+    layout = data.get("layout", DEFAULT_LAYOUT)
+    if layout not in LAYOUTS:
+        return jsonify({"error": f"layout must be one of {list(LAYOUTS)}"}), 400
+    labels = data.get("labels")
+    if labels is not None and (not isinstance(labels, list) or len(labels) != len(variants)
+                               or not all(isinstance(label, str) for label in labels)):
+        return jsonify({"error": "labels must be a list of strings, one per variant"}), 400
+    columns = data.get("columns")
+    if columns is not None and (not isinstance(columns, int) or columns < 1):
+        return jsonify({"error": "columns must be a positive integer"}), 400
+    try:
+        max_side, deadline, fmt, quality = parse_render_options(data, SHEET_TILE_SIDE if layout == "sheet" else None)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    filepath = os.path.join(UPLOAD_FOLDER, filename)
+    if not os.path.exists(filepath):
+        return jsonify({"error": "File not found"}), 400
+
+    unet = [bool(v.get("unet", False)) for v in variants]
+    params = {"variants": variants, "layout": layout, "labels": labels, "columns": columns, "max_side": max_side,
+              "format": fmt, "quality": quality}
+    if any(unet):
+        params.update(model_params())
+    with span("cache_lookup"):
+        cache_key = result_cache.key(filepath, params)
+        cached = result_cache.get(cache_key)
+    if cached is not None:
+        return send_variants(cached, fmt, layout, "HIT")
+
+    pool = init_work_pool()
+    try:
+        with pool.admit():
+            with span("decode"):
+                entry = load_upload(filename)
+                if entry is None:
+                    return jsonify({"error": "Failed to load image. Check file path and integrity."}), 400
+                image = entry.preview(max_side)
+
+            # The upload and, once for all variants that ask for it, its UNet output
+            starts = sorted(set(unet))
+            sources = []
+            for use_unet in starts:
+                sources.append(run_unet(image, deadline) if use_unet else image)
+                if sources[-1] is None:
+                    return jsonify({"error": f"Model checkpoint '{MODEL_PATH}' not found"}), 400
+            data = pool.run(render_variants, np.stack(sources), variants, [starts.index(u) for u in unet], fmt,
+                            quality, VARIANT_THREADS, layout, columns, labels, ENCODE_THREADS,
+                            timeout=deadline - time.monotonic(), cancelled=client_disconnected)
+    except POOL_ERRORS as e:
+        return pool_error(e)
+    with span("cache_store"):
+        result_cache.put(cache_key, data)
+
+    return send_variants(data, fmt, layout, "MISS")
+
+@app.route("/model/stats")
+def model_stats():
+    if model_server is None:
+        return jsonify({"loaded": False})
+    return jsonify({"loaded": True, **model_server.stats()})
 
-    # Apply enhancements safely
-    if enhancements.get("clahe", False):
-        image = apply_clahe(image, enhancements.get("clip_limit", 3.0), (enhancements.get("grid_size", 8), enhancements.get("grid_size", 8)))
-    if enhancements.get("gamma", False):
-        image = gamma_correction(image, enhancements.get("gamma_value", 1.5))
-    if enhancements.get("white_balance", False):  
-        image = white_balance(image)
-    if enhancements.get("brightness_contrast", False):
-        image = adjust_brightness_contrast(image, enhancements.get("brightness", 1.0), enhancements.get("contrast", 1.0))
-    if enhancements.get("saturation_sharpness", False):
-        image = adjust_saturation_sharpness(image, enhancements.get("saturation", 1.0), enhancements.get("sharpness", 1.0))
+@app.route("/pool/stats")
+def pool_stats():
+    if work_pool is None:
+        return jsonify({"started": False})
+    return jsonify({"started": True, **work_pool.stats()})
 
-    # Save enhanced image
-    temp_filename = tempfile.mktemp(suffix=".png")
-    cv2.imwrite(temp_filename, image)
+@app.route("/cache/stats")
+def cache_stats():
+    return jsonify({"results": result_cache.stats(), "images": image_store.stats()})
 
-    return send_file(temp_filename, mimetype="image/png")
+@app.route("/metrics")
+def metrics():
+    return Response(telemetry.render_prometheus(), mimetype="text/plain; version=0.0.4")
 
 
 if __name__ == "__main__":
+    # With the debug reloader only the child process that serves requests loads the model
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        init_model_server()
+        init_work_pool()
     app.run(debug=True)
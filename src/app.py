@@ -1,7 +1,6 @@
 import streamlit as st
 import cv2
 import numpy as np
-import tempfile
 from PIL import Image
 
 # --- Custom CSS for Background and Styling ---
@@ -78,10 +77,9 @@ if uploaded_file is not None:
         st.image(cv2.cvtColor(enhanced_image, cv2.COLOR_BGR2RGB), caption="✨ Enhanced Image", use_column_width=True)
 
     # --- Download Option ---
-    _, temp_filename = tempfile.mkstemp(suffix=".png")
-    cv2.imwrite(temp_filename, enhanced_image)
-    with open(temp_filename, "rb") as file:
-        st.download_button("📥 Download Enhanced Image", file, file_name="enhanced_image.png", mime="image/png")
+    # Encoded in memory; no temporary file to leak
+    st.download_button("📥 Download Enhanced Image", cv2.imencode(".png", enhanced_image)[1].tobytes(),
+                       file_name="enhanced_image.png", mime="image/png")
 
 # --- Footer ---
 st.markdown("<h4 style='text-align: center;'>🔧 Developed by Your Name</h4>", unsafe_allow_html=True)
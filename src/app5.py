@@ -1,55 +1,57 @@
 import streamlit as st
 import cv2
 import numpy as np
-from PIL import Image, ImageEnhance
-import rawpy
-import imageio
-import tempfile
-import os
-
-def load_image(file):
-    suffix = os.path.splitext(file.name)[-1].lower()
-    raw_formats = ['.dng', '.nef', '.cr2', '.arw', '.orf', '.rw2']
-    if suffix in raw_formats:
-        with rawpy.imread(file) as raw:
-            rgb = raw.postprocess()
-        return cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR)
+from PIL import Image
+from concurrent.futures import ThreadPoolExecutor
+
+from pipeline import EnhancementPipeline
+from stage_cache import StageCache
+from denoise import DENOISERS
+from encoding import FORMATS, QUALITY_RANGE, DEFAULT_QUALITY, encode, mimetype
+from telemetry import start_metrics_server_from_env
+from raw_loader import decode_raw, file_digest, is_raw, tone_map_linear
+
+RAW_QUALITY_LABELS = {"Preview (embedded JPEG / half size)": "preview", "Fast demosaic": "fast",
+                      "Full quality (AHD)": "full"}
+
+@st.cache_data(max_entries=8, show_spinner="Decoding RAW...")
+def decode_raw_cached(digest, _data, quality, linear):
+    # Keyed by the file hash; the bytes themselves are not hashed again on every rerun
+    return decode_raw(_data, quality, linear)
+
+@st.cache_resource
+def get_export_jobs():
+    # Full-quality demosaics run on a background thread while the UI keeps using the preview
+    return ThreadPoolExecutor(max_workers=1), {}
+
+def start_full_decode(data, linear):
+    executor, jobs = get_export_jobs()
+    key = (file_digest(data), linear)
+    if key not in jobs:
+        jobs[key] = executor.submit(decode_raw, data, "full", linear)
+    return jobs[key]
+
+def load_image(file, quality="preview", linear=False):
+    if is_raw(file.name):
+        data = file.getvalue()
+        return decode_raw_cached(file_digest(data), data, quality, linear)
     else:
         image = Image.open(file).convert("RGB")
         return cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
 
-# Enhancement Functions
-def apply_clahe(image, clip_limit=2.0, grid_size=(8, 8)):
-    lab = cv2.cvtColor(image, cv2.COLOR_BGR2LAB)
-    l, a, b = cv2.split(lab)
-    clahe = cv2.createCLAHE(clipLimit=clip_limit, tileGridSize=grid_size)
-    l = clahe.apply(l)
-    lab = cv2.merge((l, a, b))
-    return cv2.cvtColor(lab, cv2.COLOR_LAB2BGR)
-
-def gamma_correction(image, gamma=1.2):
-    invGamma = 1.0 / gamma
-    table = np.array([(i / 255.0) ** invGamma * 255 for i in range(256)]).astype("uint8")
-    return cv2.LUT(image, table)
-
-def white_balance(image):
-    wb = cv2.xphoto.createSimpleWB()
-    return wb.balanceWhite(image)
-
-def denoise_image(image, strength=10):
-    return cv2.fastNlMeansDenoisingColored(image, None, strength, strength, 7, 21)
-
-def adjust_brightness_contrast(image, brightness=1.0, contrast=1.0):
-    img = Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
-    img = ImageEnhance.Brightness(img).enhance(brightness)
-    img = ImageEnhance.Contrast(img).enhance(contrast)
-    return cv2.cvtColor(np.array(img), cv2.COLOR_RGB2BGR)
-
-def adjust_saturation_sharpness(image, saturation=1.0, sharpness=1.0):
-    img = Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
-    img = ImageEnhance.Color(img).enhance(saturation)
-    img = ImageEnhance.Sharpness(img).enhance(sharpness)
-    return cv2.cvtColor(np.array(img), cv2.COLOR_RGB2BGR)
+@st.cache_resource
+def get_stage_cache():
+    # Shared across reruns, so moving one slider only recomputes the stages after it
+    return StageCache()
+
+def show_stage_report(report):
+    st.sidebar.markdown("#### ⚡ Pipeline stages")
+    for r in report:
+        status = "♻️ cached" if r["cached"] else f"⚙️ {r['ms']:.0f} ms"
+        st.sidebar.write(f"{r['stage']}: {status}")
+
+# Stage metrics on http://localhost:$METRICS_PORT/metrics when METRICS_PORT is set
+start_metrics_server_from_env()
 
 # Streamlit App
 st.set_page_config(page_title="Low-Light Image Enhancement", layout="wide")
@@ -61,8 +63,14 @@ option = st.radio("Choose an input method:", ["Upload Image", "Use Webcam"])
 if option == "Upload Image":
     uploaded_file = st.file_uploader("Choose an image...", type=["jpg", "jpeg", "png", "dng", "nef", "cr2", "arw", "orf", "rw2"])
     if uploaded_file:
+        raw_input = is_raw(uploaded_file.name)
+        if raw_input:
+            st.sidebar.header("🎞️ RAW Decoding")
+            raw_quality = RAW_QUALITY_LABELS[st.sidebar.radio("Quality", list(RAW_QUALITY_LABELS))]
+            raw_linear = st.sidebar.checkbox("16-bit linear decode", value=False,
+                                             help="Apply gamma to the 16-bit data so the image is quantized to 8 bits only once")
         try:
-            image = load_image(uploaded_file)
+            image = load_image(uploaded_file, raw_quality, raw_linear) if raw_input else load_image(uploaded_file)
         except Exception as e:
             st.error(f"Failed to load image: {e}")
             image = None
@@ -83,14 +91,23 @@ if 'image' in locals() and image is not None:
     saturation = st.sidebar.slider("Saturation", 0.5, 2.0, 1.0)
     sharpness = st.sidebar.slider("Sharpness", 0.5, 2.0, 1.0)
     denoise_strength = st.sidebar.slider("Denoise Strength", 0, 30, 10)
+    # Tiled NL-means gives the same output as full-frame NL-means, spread over all cores
+    denoise_engine = st.sidebar.selectbox("Denoise Engine", list(DENOISERS), index=list(DENOISERS).index("nlmeans_tiled"),
+                                          help="Ordered from best quality to fastest")
+
+    # 16-bit linear RAW: display curve and gamma go through one table, so the pipeline skips its gamma step
+    linear_input = image.dtype == np.uint16
+    if linear_input:
+        image = tone_map_linear(image, gamma)
 
     # Pipeline
-    enhanced = apply_clahe(image, clahe_clip, (grid_size, grid_size))
-    enhanced = gamma_correction(enhanced, gamma)
-    enhanced = white_balance(enhanced)
-    enhanced = adjust_brightness_contrast(enhanced, brightness, contrast)
-    enhanced = adjust_saturation_sharpness(enhanced, saturation, sharpness)
-    enhanced = denoise_image(enhanced, denoise_strength)
+    pipeline = EnhancementPipeline(clahe=True, clip_limit=clahe_clip, grid_size=grid_size,
+                                   gamma=None if linear_input else gamma,
+                                   white_balance=True, brightness=brightness, contrast=contrast,
+                                   saturation=saturation, sharpness=sharpness, denoise=denoise_strength,
+                                   denoise_engine=denoise_engine)
+    enhanced, report = get_stage_cache().run(image, pipeline.stages())
+    show_stage_report(report)
 
     # Show Results
     col1, col2 = st.columns(2)
@@ -99,10 +116,31 @@ if 'image' in locals() and image is not None:
     with col2:
         st.image(cv2.cvtColor(enhanced, cv2.COLOR_BGR2RGB), caption="✨ Enhanced Image", use_column_width=True)
 
-    _, temp_filename = tempfile.mkstemp(suffix=".png")
-    cv2.imwrite(temp_filename, enhanced)
-    with open(temp_filename, "rb") as f:
-        st.download_button("📥 Download Enhanced Image", f, file_name="enhanced.png", mime="image/png")
+    # Downloads are encoded in memory; no temporary files
+    st.sidebar.header("📥 Download")
+    out_format = st.sidebar.selectbox("Format", list(FORMATS))
+    out_quality = None
+    if out_format != "png":
+        low, high = QUALITY_RANGE[out_format]
+        out_quality = st.sidebar.slider("Quality", low, high, DEFAULT_QUALITY[out_format])
+    extension = FORMATS[out_format][0]
+    st.download_button("📥 Download Enhanced Image", encode(enhanced, out_format, out_quality),
+                       file_name=f"enhanced{extension}", mime=mimetype(out_format))
+
+    # The preview tiers are for interaction; the export gets an AHD demosaic rendered in the background
+    if option == "Upload Image" and raw_input and raw_quality != "full":
+        if st.button("🎞️ Prepare full-quality export") or (file_digest(uploaded_file.getvalue()), raw_linear) in get_export_jobs()[1]:
+            job = start_full_decode(uploaded_file.getvalue(), raw_linear)
+            if not job.done():
+                st.info("Full-quality demosaic is running in the background; interact freely and check back.")
+                st.button("🔄 Check again")
+            else:
+                full = job.result()
+                if full.dtype == np.uint16:
+                    full = tone_map_linear(full, gamma)
+                full_enhanced, _ = get_stage_cache().run(full, pipeline.stages())
+                st.download_button("📥 Download Full-Quality Image", encode(full_enhanced, out_format, out_quality),
+                                   file_name=f"enhanced_full{extension}", mime=mimetype(out_format))
 
 st.sidebar.markdown("---")
 st.sidebar.write("Developed by **Your Name**")
@@ -1,13 +1,31 @@
 import streamlit as st
 import cv2
 import numpy as np
-from PIL import Image, ImageEnhance
-import tempfile
+from PIL import Image
 import os
 
+from pipeline import EnhancementPipeline
+from stage_cache import StageCache
+from encoding import FORMATS, QUALITY_RANGE, DEFAULT_QUALITY, encode, mimetype
+from telemetry import start_metrics_server_from_env
+
 # Page Configuration
 st.set_page_config(page_title="Low-Light Image Enhancement", layout="wide")
 
+# Stage metrics on http://localhost:$METRICS_PORT/metrics when METRICS_PORT is set
+start_metrics_server_from_env()
+
+@st.cache_resource
+def get_stage_cache():
+    # Shared across reruns, so moving one slider only recomputes the stages after it
+    return StageCache()
+
+def show_stage_report(report):
+    st.sidebar.markdown("#### ⚡ Pipeline stages")
+    for r in report:
+        status = "♻️ cached" if r["cached"] else f"⚙️ {r['ms']:.0f} ms"
+        st.sidebar.write(f"{r['stage']}: {status}")
+
 # Custom CSS for Styling
 st.markdown("""
     <style>
@@ -36,36 +54,6 @@ st.markdown("""
     </style>
 """, unsafe_allow_html=True)
 
-# -------------------- Enhancement Functions --------------------
-def apply_clahe(image, clip_limit=3.0, grid_size=(8,8)):
-    lab = cv2.cvtColor(image, cv2.COLOR_BGR2LAB)
-    l, a, b = cv2.split(lab)
-    clahe = cv2.createCLAHE(clipLimit=clip_limit, tileGridSize=grid_size)
-    l = clahe.apply(l)
-    lab = cv2.merge((l, a, b))
-    return cv2.cvtColor(lab, cv2.COLOR_LAB2BGR)
-
-def gamma_correction(image, gamma=1.5):
-    invGamma = 1.0 / gamma
-    table = np.array([(i / 255.0) ** invGamma * 255 for i in range(256)]).astype("uint8")
-    return cv2.LUT(image, table)
-
-def white_balance(image):
-    wb = cv2.xphoto.createSimpleWB()
-    return wb.balanceWhite(image)
-
-def adjust_brightness_contrast(image, brightness=1.0, contrast=1.0):
-    img = Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
-    img = ImageEnhance.Brightness(img).enhance(brightness)
-    img = ImageEnhance.Contrast(img).enhance(contrast)
-    return cv2.cvtColor(np.array(img), cv2.COLOR_RGB2BGR)
-
-def adjust_saturation_sharpness(image, saturation=1.0, sharpness=1.0):
-    img = Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
-    img = ImageEnhance.Color(img).enhance(saturation)
-    img = ImageEnhance.Sharpness(img).enhance(sharpness)
-    return cv2.cvtColor(np.array(img), cv2.COLOR_RGB2BGR)
-
 # -------------------- Navigation Tabs --------------------
 tab1, tab2 = st.tabs(["🏠 Home", "🖼️ Generate"])
 
@@ -120,11 +108,11 @@ with tab2:
         sharpness = st.sidebar.slider("Sharpness", 0.5, 2.0, 1.0)
 
         # Apply enhancements
-        enhanced_image = apply_clahe(image, clip_limit, (grid_size, grid_size))
-        enhanced_image = gamma_correction(enhanced_image, gamma)
-        enhanced_image = white_balance(enhanced_image)
-        enhanced_image = adjust_brightness_contrast(enhanced_image, brightness, contrast)
-        enhanced_image = adjust_saturation_sharpness(enhanced_image, saturation, sharpness)
+        pipeline = EnhancementPipeline(clahe=True, clip_limit=clip_limit, grid_size=grid_size, gamma=gamma,
+                                       white_balance=True, brightness=brightness, contrast=contrast,
+                                       saturation=saturation, sharpness=sharpness)
+        enhanced_image, report = get_stage_cache().run(image, pipeline.stages())
+        show_stage_report(report)
 
         # Display images side by side
         col1, col2 = st.columns(2)
@@ -133,9 +121,12 @@ with tab2:
         with col2:
             st.image(cv2.cvtColor(enhanced_image, cv2.COLOR_BGR2RGB), caption="✨ Enhanced Image", use_container_width=True)
 
-        # Download enhanced image
-        _, tmp = tempfile.mkstemp(suffix=".png")
-        cv2.imwrite(tmp, enhanced_image)
-        with open(tmp, "rb") as file:
-            st.download_button("📥 Download Enhanced Image", file, file_name="enhanced_image.png", mime="image/png")
+        # Download enhanced image, encoded in memory
+        out_format = st.sidebar.selectbox("Download Format", list(FORMATS))
+        out_quality = None
+        if out_format != "png":
+            low, high = QUALITY_RANGE[out_format]
+            out_quality = st.sidebar.slider("Download Quality", low, high, DEFAULT_QUALITY[out_format])
+        st.download_button("📥 Download Enhanced Image", encode(enhanced_image, out_format, out_quality),
+                           file_name=f"enhanced_image{FORMATS[out_format][0]}", mime=mimetype(out_format))
 
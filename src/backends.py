@@ -0,0 +1,112 @@
+import json
+import os
+
+# torch (and inference.py) are imported where a model is loaded, so that importing this
+# module for artifact_path() doesn't pull in the torch stack (appp.py defers it)
+
+# Ways to run UNetEnhancer. "eager" is the nn.Module from a train.py checkpoint; the
+# others run an artifact written by export.py next to it (same name, other extension).
+BACKENDS = ("eager", "torchscript", "onnxruntime")
+DEFAULT_BACKEND = "eager"
+EXTENSIONS = {"eager": ".pth", "torchscript": ".pt", "onnxruntime": ".onnx"}
+
+# Names of the graph input/output in exported artifacts, and of the stored model config
+INPUT_NAME = "low"
+OUTPUT_NAME = "enhanced"
+CONFIG_KEY = "config.json"
+
+
+def artifact_path(checkpoint, backend):
+    """Path of `backend`'s artifact for a train.py checkpoint, e.g. lowlight_enhancer.pt."""
+    if backend not in BACKENDS:
+        raise ValueError(f"backend must be one of {BACKENDS}, got {backend!r}")
+    return os.path.splitext(checkpoint)[0] + EXTENSIONS[backend]
+
+
+def configure_threads(intra_op_threads=None, inter_op_threads=None):
+    """Set PyTorch's thread pools (eager and TorchScript); None keeps the current setting.
+
+    Inter-op threads can only be changed before the first parallel work in
+    the process, so call this at start-up, before the model runs.
+    """
+    import torch
+
+    if intra_op_threads:
+        torch.set_num_threads(intra_op_threads)
+    if inter_op_threads and inter_op_threads != torch.get_num_interop_threads():
+        torch.set_num_interop_threads(inter_op_threads)
+
+
+class ExportedEnhancer:
+    """An exported UNetEnhancer that is called like the module: NCHW float tensor in, out.
+
+    Carries what inference.py and serving.py read from the module
+    (`size_multiple`, `device`, `eval()`), so it can stand in for it there.
+    """
+
+    device = "cpu"
+
+    def __init__(self, backend, forward, config):
+        self.backend = backend
+        self.config = config
+        self.size_multiple = 2 ** config["depth"]
+        self._forward = forward
+
+    def eval(self):
+        return self
+
+    def __call__(self, x):
+        return self._forward(x)
+
+
+def _load_torchscript(path):
+    import torch
+
+    extra_files = {CONFIG_KEY: ""}
+    # Convolutions to oneDNN with the following ReLUs fused in; done here because it can't be saved
+    module = torch.jit.optimize_for_inference(torch.jit.load(path, map_location="cpu", _extra_files=extra_files))
+
+    def forward(x):
+        with torch.no_grad():
+            return module(x)
+    return ExportedEnhancer("torchscript", forward, json.loads(extra_files[CONFIG_KEY]))
+
+
+def _load_onnxruntime(path, intra_op_threads=None, inter_op_threads=None):
+    import onnxruntime as ort  # optional: pip install onnxruntime
+    import torch
+
+    options = ort.SessionOptions()
+    # Constant folding plus Conv+activation and other node fusions on top of the exported graph
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if intra_op_threads:
+        options.intra_op_num_threads = intra_op_threads
+    if inter_op_threads:
+        options.inter_op_num_threads = inter_op_threads
+        if inter_op_threads > 1:
+            options.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+    session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+    config = json.loads(session.get_modelmeta().custom_metadata_map[CONFIG_KEY])
+
+    def forward(x):
+        (out,) = session.run([OUTPUT_NAME], {INPUT_NAME: x.detach().float().cpu().contiguous().numpy()})
+        return torch.from_numpy(out)
+    return ExportedEnhancer("onnxruntime", forward, config)
+
+
+def load_backend(path, backend=DEFAULT_BACKEND, intra_op_threads=None, inter_op_threads=None, device="cpu"):
+    """Load UNetEnhancer for inference on `backend` from its checkpoint or exported artifact.
+
+    Thread counts apply to PyTorch's pools for eager/TorchScript and to the
+    session for ONNX Runtime. Exported backends run on the CPU.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"backend must be one of {BACKENDS}, got {backend!r}")
+    if backend == "onnxruntime":
+        return _load_onnxruntime(path, intra_op_threads, inter_op_threads)
+    configure_threads(intra_op_threads, inter_op_threads)
+    if backend == "torchscript":
+        return _load_torchscript(path)
+    from inference import load_model
+    # Mapped, so server processes loading the same checkpoint share its weights
+    return load_model(path, device, mmap=str(device) == "cpu")
@@ -0,0 +1,221 @@
+import argparse
+import glob
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import cv2
+
+from pipeline import EnhancementPipeline
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff", ".webp"}
+ENCODE_PARAMS = {".png": [cv2.IMWRITE_PNG_COMPRESSION, 3], ".jpg": [cv2.IMWRITE_JPEG_QUALITY, 95],
+                 ".webp": [cv2.IMWRITE_WEBP_QUALITY, 95]}
+
+# Characters that make a path a glob pattern; the input root is the part before the first
+GLOB_CHARS = "*?["
+PARTIAL_SUFFIX = ".partial"
+
+# Per-worker state, set up once by _init_worker
+_pipeline = None
+_model = None
+
+
+def glob_root(pattern):
+    """Directory a glob pattern searches from, e.g. photos for photos/**/*.jpg."""
+    prefix = pattern
+    for char in GLOB_CHARS:
+        prefix = prefix.split(char, 1)[0]
+    return os.path.dirname(prefix) or "."
+
+
+def iter_inputs(source):
+    """Yield (path, relative path) for an input directory (recursive) or a glob pattern, lazily.
+
+    Relative paths are taken from the directory, or from the glob's root,
+    so photos/**/*.jpg keeps the subdirectories under photos.
+    """
+    if os.path.isdir(source):
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            for name in sorted(files):
+                if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS:
+                    path = os.path.join(root, name)
+                    yield path, os.path.relpath(path, source)
+    else:
+        root = glob_root(source)
+        for path in glob.iglob(source, recursive=True):
+            if os.path.splitext(path)[1].lower() in IMAGE_EXTENSIONS:
+                yield path, os.path.relpath(path, root)
+
+
+def output_path(output_dir, relative, extension):
+    return os.path.join(output_dir, os.path.splitext(relative)[0] + extension)
+
+
+def remove_partials(output_dir):
+    """Delete the temporary files interrupted runs left in `output_dir`; returns how many."""
+    removed = 0
+    for root, _, files in os.walk(output_dir):
+        for name in files:
+            if name.endswith(PARTIAL_SUFFIX):
+                os.remove(os.path.join(root, name))
+                removed += 1
+    return removed
+
+
+def _init_worker(settings, checkpoint, model=None):
+    global _pipeline, _model
+    # One process per core already; nested thread pools would only oversubscribe
+    cv2.setNumThreads(1)
+    _pipeline = EnhancementPipeline(**settings)
+    if checkpoint:
+        import torch
+        from inference import load_model
+        torch.set_num_threads(1)
+        _model = model if model is not None else load_model(checkpoint, mmap=True)
+
+
+def preload_model(checkpoint):
+    """The model for the workers to inherit, or None where they don't fork from this process.
+
+    Loaded (mapped, nothing run) before the pool starts, so forked workers
+    begin with torch imported and share these weights copy-on-write. Other
+    start methods would pickle a copy per worker; their workers map the
+    same file instead, which shares it through the page cache.
+    """
+    if not checkpoint or multiprocessing.get_start_method() != "fork":
+        return None
+    from inference import load_model
+    return load_model(checkpoint, mmap=True)
+
+
+def _process(path, destination):
+    """Decode, enhance and encode one image; returns per-stage seconds."""
+    start = time.perf_counter()
+    image = cv2.imread(path, cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError(f"could not decode {path}")
+    decoded = time.perf_counter()
+
+    if _model is not None:
+        from inference import enhance_tiled, image_to_tensor, tensor_to_image
+        image = tensor_to_image(enhance_tiled(_model, image_to_tensor(image)))
+    image = _pipeline(image)
+    enhanced = time.perf_counter()
+
+    extension = os.path.splitext(destination)[1]
+    ok, data = cv2.imencode(extension, image, ENCODE_PARAMS.get(extension, []))
+    if not ok:
+        raise ValueError(f"could not encode {destination}")
+    # Write-then-rename: an interrupted run never leaves a truncated file that resume would skip.
+    # The temporary name is unique to this process, so two writers never share one.
+    os.makedirs(os.path.dirname(destination) or ".", exist_ok=True)
+    partial = f"{destination}.{os.getpid()}{PARTIAL_SUFFIX}"
+    with open(partial, "wb") as f:
+        f.write(data.tobytes())
+    os.replace(partial, destination)
+    return decoded - start, enhanced - decoded, time.perf_counter() - enhanced
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Enhance a directory (or glob) of images in parallel")
+    parser.add_argument("input", help="input directory (searched recursively) or glob pattern")
+    parser.add_argument("output", help="output directory; the input layout is mirrored")
+    parser.add_argument("--format", default=".png", choices=sorted(ENCODE_PARAMS))
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--queue", type=int, default=None, help="max images in flight (default: 2 per worker)")
+    parser.add_argument("--overwrite", action="store_true", help="redo images whose output already exists")
+    parser.add_argument("--report-every", type=float, default=10.0, help="seconds between progress lines")
+    parser.add_argument("--unet", metavar="CHECKPOINT", help="run UNetEnhancer from this checkpoint before the chain")
+    # Classical chain; the defaults are test.py's CLAHE -> gamma 1.8 -> white balance
+    parser.add_argument("--no-clahe", action="store_true")
+    parser.add_argument("--clip-limit", type=float, default=3.0)
+    parser.add_argument("--grid-size", type=int, default=8)
+    parser.add_argument("--gamma", type=float, default=1.8, help="0 disables gamma correction")
+    parser.add_argument("--no-white-balance", action="store_true")
+    parser.add_argument("--brightness", type=float, default=1.0)
+    parser.add_argument("--contrast", type=float, default=1.0)
+    parser.add_argument("--saturation", type=float, default=1.0)
+    parser.add_argument("--sharpness", type=float, default=1.0)
+    parser.add_argument("--denoise", type=float, default=None, help="denoise strength (off by default)")
+    parser.add_argument("--denoise-engine", default="nlmeans")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    settings = dict(clahe=not args.no_clahe, clip_limit=args.clip_limit, grid_size=args.grid_size,
+                    gamma=args.gamma or None, white_balance=not args.no_white_balance,
+                    brightness=args.brightness, contrast=args.contrast, saturation=args.saturation,
+                    sharpness=args.sharpness, denoise=args.denoise, denoise_engine=args.denoise_engine)
+    max_in_flight = args.queue or 2 * args.workers
+
+    removed = remove_partials(args.output)
+    if removed:
+        print(f"removed {removed} unfinished file(s) from an interrupted run", flush=True)
+
+    done = skipped = failed = 0
+    stage_totals = [0.0, 0.0, 0.0]
+    started = last_report = time.perf_counter()
+
+    def report(final=False):
+        elapsed = time.perf_counter() - started
+        stages = "/".join(f"{1000 * t / max(done, 1):.0f}" for t in stage_totals)
+        print(f"{'done' if final else '...'} {done} enhanced, {skipped} skipped, {failed} failed | "
+              f"{done / elapsed:.2f} img/s | decode/enhance/encode {stages} ms per image (worker time)", flush=True)
+
+    # Inputs are enumerated lazily and at most max_in_flight images are queued or
+    # running at once, so memory stays flat however large the backlog is
+    model = preload_model(args.unet)
+    with ProcessPoolExecutor(args.workers, initializer=_init_worker, initargs=(settings, args.unet, model)) as pool:
+        in_flight = {}
+        # Input of each output in the current output directory. Relative paths are unique, so
+        # only a.jpg next to a.png can write the same file, and inputs arrive one directory
+        # at a time: the map is reset per directory and stays as small as the largest one.
+        sources, sources_dir = {}, None
+        inputs = iter_inputs(args.input)
+        exhausted = False
+        while in_flight or not exhausted:
+            while not exhausted and len(in_flight) < max_in_flight:
+                item = next(inputs, None)
+                if item is None:
+                    exhausted = True
+                    break
+                path, relative = item
+                destination = output_path(args.output, relative, args.format)
+                if os.path.dirname(destination) != sources_dir:
+                    sources, sources_dir = {}, os.path.dirname(destination)
+                if destination in sources:
+                    failed += 1
+                    print(f"❌ {path}: same output as {sources[destination]} ({destination})", file=sys.stderr)
+                    continue
+                sources[destination] = path
+                if not args.overwrite and os.path.exists(destination):
+                    skipped += 1
+                    continue
+                in_flight[pool.submit(_process, path, destination)] = path
+
+            finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                path = in_flight.pop(future)
+                try:
+                    for i, seconds in enumerate(future.result()):
+                        stage_totals[i] += seconds
+                    done += 1
+                except Exception as e:
+                    failed += 1
+                    print(f"❌ {path}: {e}", file=sys.stderr)
+
+            if time.perf_counter() - last_report >= args.report_every:
+                report()
+                last_report = time.perf_counter()
+
+    report(final=True)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
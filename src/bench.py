@@ -0,0 +1,216 @@
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+from bench_pipeline import synthetic_image
+from pipeline import DEFAULT_SETTINGS
+
+# Named resolutions as (width, height); the large ones are opt-in because NL-means
+# and the UNet take minutes per iteration there
+SIZES = {"256": (256, 256), "1080p": (1920, 1080), "12mp": (4000, 3000), "24mp": (6000, 4000)}
+DEFAULT_SIZES = ["256", "1080p"]
+
+DEFAULT_REPEAT = 5
+DEFAULT_THRESHOLD = 0.15
+DEFAULT_MEMORY_THRESHOLD = 0.25
+# Differences below these are noise, whatever the relative change
+MIN_REGRESSION_MS = 2.0
+MIN_REGRESSION_MB = 16.0
+
+# The /enhance body used for the request-path case: every classical stage enabled
+ENHANCE_REQUEST = {"clahe": True, "clip_limit": DEFAULT_SETTINGS["clip_limit"],
+                   "grid_size": DEFAULT_SETTINGS["grid_size"], "gamma": True,
+                   "gamma_value": DEFAULT_SETTINGS["gamma"], "white_balance": True, "brightness_contrast": True,
+                   "brightness": DEFAULT_SETTINGS["brightness"], "contrast": DEFAULT_SETTINGS["contrast"],
+                   "saturation_sharpness": True, "saturation": DEFAULT_SETTINGS["saturation"],
+                   "sharpness": DEFAULT_SETTINGS["sharpness"]}
+
+
+def _stage(fn):
+    return lambda image, args: (lambda: fn(image))
+
+
+def _pipeline_case(image, args):
+    from pipeline import EnhancementPipeline
+    pipeline = EnhancementPipeline(clahe=True, white_balance=True, **DEFAULT_SETTINGS)
+    return lambda: pipeline(image)
+
+
+def _request_case(image, args):
+    # The whole Flask route: cache lookup, decoded-image store, UNet off, pipeline, PNG encode.
+    # The result cache is disabled so every iteration does the work.
+    os.chdir(tempfile.mkdtemp(prefix="bench-"))
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    import appp
+    from result_cache import ResultCache
+    appp.result_cache = ResultCache(memory_bytes=0)
+    client = appp.app.test_client()
+    ok, data = cv2.imencode(".png", image)
+    client.post("/upload", data={"image": (io.BytesIO(data.tobytes()), "bench.png")})
+
+    def run():
+        response = client.post("/enhance", json={"filename": "bench.png", "enhancements": ENHANCE_REQUEST})
+        assert response.status_code == 200, response.data
+    return run
+
+
+def _unet_case(image, args):
+    import torch
+    from inference import enhance_tiled, image_to_tensor, load_model, pad_to_multiple
+    from model import UNetEnhancer
+    from serving import DEFAULT_MAX_PIXELS
+    torch.manual_seed(0)
+    # Timing doesn't depend on the weights, so a fresh model works when no checkpoint is given
+    model = load_model(args.checkpoint) if args.checkpoint else UNetEnhancer().eval()
+    x = image_to_tensor(image)
+    if x.shape[-2] * x.shape[-1] > DEFAULT_MAX_PIXELS:
+        # Same path as ModelServer: big images are run tile by tile
+        return lambda: enhance_tiled(model, x)
+    x = pad_to_multiple(x.unsqueeze(0))
+
+    def run():
+        with torch.no_grad():
+            model(x)
+    return run
+
+
+def _cases():
+    from enhance import (apply_clahe, gamma_correction, white_balance, denoise_image,
+                         adjust_brightness_contrast, adjust_saturation_sharpness)
+    s = DEFAULT_SETTINGS
+    return {
+        "clahe": _stage(lambda im: apply_clahe(im, s["clip_limit"], (s["grid_size"], s["grid_size"]))),
+        "gamma": _stage(lambda im: gamma_correction(im, s["gamma"])),
+        "white_balance": _stage(white_balance),
+        "brightness_contrast": _stage(lambda im: adjust_brightness_contrast(im, s["brightness"], s["contrast"])),
+        "saturation_sharpness": _stage(lambda im: adjust_saturation_sharpness(im, s["saturation"], s["sharpness"])),
+        "denoise": _stage(denoise_image),
+        "pipeline": _pipeline_case,
+        "enhance_request": _request_case,
+        "unet": _unet_case,
+    }
+
+
+def _rss_mb():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+
+
+def _run_case(name, size, args, conn):
+    # Runs in a fresh child process, so ru_maxrss is this case's peak alone
+    try:
+        image = synthetic_image(*SIZES[size])
+        fn = _cases()[name](image, args)
+        before = _rss_mb()
+        fn()  # warm-up: lazy imports, allocator growth, kernel selection
+        times = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            fn()
+            times.append((time.perf_counter() - start) * 1000)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        conn.send({
+            "p50_ms": round(float(np.percentile(times, 50)), 3),
+            "p95_ms": round(float(np.percentile(times, 95)), 3),
+            "p99_ms": round(float(np.percentile(times, 99)), 3),
+            "mean_ms": round(float(np.mean(times)), 3),
+            # Peak RSS above what the process held after setup (inputs, model) was done
+            "peak_mb": round(max(0.0, peak - before), 1),
+            "peak_rss_mb": round(peak, 1),
+            "repeat": args.repeat,
+        })
+    except Exception as e:
+        conn.send({"error": f"{type(e).__name__}: {e}"})
+
+
+def run_suite(args):
+    results = {}
+    ctx = multiprocessing.get_context("fork")
+    names = [n for n in _cases() if not args.cases or n in args.cases]
+    for size in args.sizes:
+        for name in names:
+            parent, child = ctx.Pipe(duplex=False)
+            proc = ctx.Process(target=_run_case, args=(name, size, args, child))
+            proc.start()
+            result = parent.recv() if parent.poll(args.timeout) else {"error": "timed out"}
+            if proc.is_alive():
+                proc.kill()
+            proc.join()
+            key = f"{name}@{size}"
+            results[key] = result
+            if "error" in result:
+                print(f"{key:<30} ERROR {result['error']}", flush=True)
+            else:
+                print(f"{key:<30} p50 {result['p50_ms']:>10.1f} ms | p95 {result['p95_ms']:>10.1f} ms | "
+                      f"p99 {result['p99_ms']:>10.1f} ms | peak +{result['peak_mb']:.0f} MB", flush=True)
+    return results
+
+
+def compare(results, baseline, threshold, memory_threshold):
+    """Regressions of `results` against a baseline, as a list of messages."""
+    regressions = []
+    for key, new in results.items():
+        old = baseline.get(key)
+        if old is None or "error" in old or "error" in new:
+            continue
+        if new["p50_ms"] - old["p50_ms"] > max(threshold * old["p50_ms"], MIN_REGRESSION_MS):
+            regressions.append(f"{key}: p50 {old['p50_ms']:.1f} -> {new['p50_ms']:.1f} ms")
+        if new["peak_mb"] - old["peak_mb"] > max(memory_threshold * old["peak_mb"], MIN_REGRESSION_MB):
+            regressions.append(f"{key}: peak {old['peak_mb']:.0f} -> {new['peak_mb']:.0f} MB")
+    return regressions
+
+
+def _environment():
+    import torch
+    return {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count(),
+            "opencv": cv2.__version__, "torch": torch.__version__, "torch_threads": torch.get_num_threads()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark every enhancement stage, the /enhance path and the UNet")
+    parser.add_argument("--sizes", nargs="+", default=DEFAULT_SIZES, choices=list(SIZES))
+    parser.add_argument("--cases", nargs="+", default=None, help=f"subset of: {', '.join(_cases())}")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+    parser.add_argument("--timeout", type=float, default=1800, help="seconds allowed per case")
+    parser.add_argument("--checkpoint", default=None, help="UNet weights (random init if omitted)")
+    parser.add_argument("--save", metavar="JSON", help="write the results as a baseline")
+    parser.add_argument("--baseline", metavar="JSON", help="compare against this baseline and fail on regressions")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="allowed relative p50 slowdown")
+    parser.add_argument("--memory-threshold", type=float, default=DEFAULT_MEMORY_THRESHOLD,
+                        help="allowed relative peak-memory growth")
+    args = parser.parse_args()
+
+    results = run_suite(args)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"environment": _environment(), "results": results}, f, indent=2, sort_keys=True)
+        print(f"✅ Baseline saved as '{args.save}'")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("environment", {}).get("platform") != platform.platform():
+            print("⚠️ Baseline was recorded on a different platform; timings may not be comparable")
+        regressions = compare(results, baseline["results"], args.threshold, args.memory_threshold)
+        for message in regressions:
+            print(f"❌ {message}")
+        if regressions:
+            sys.exit(1)
+        print("✅ No regressions against the baseline")
+
+    if any("error" in r for r in results.values()):
+        sys.exit(2)
+
+
+if __name__ == "__main__":
+    main()
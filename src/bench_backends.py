@@ -0,0 +1,63 @@
+import argparse
+import os
+import tempfile
+
+import torch
+
+from backends import BACKENDS, artifact_path, configure_threads, load_backend
+from bench_pipeline import timed
+from export import EXPORTERS
+from metrics import psnr
+from model import MODEL_PRESETS, build_model
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Eager vs TorchScript vs ONNX Runtime: parity and latency")
+    parser.add_argument("--checkpoint", default=None, help="UNet weights (random init of --preset if omitted)")
+    parser.add_argument("--preset", default="base", choices=list(MODEL_PRESETS))
+    parser.add_argument("--sizes", nargs="+", default=["256x256", "400x600", "720x1280"], help="HxW, multiples of 8")
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--intra-op-threads", type=int, default=None)
+    parser.add_argument("--inter-op-threads", type=int, default=None)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    # One setting for the whole run, so every backend gets the same threads
+    configure_threads(args.intra_op_threads, args.inter_op_threads)
+    torch.manual_seed(0)
+    with tempfile.TemporaryDirectory() as tmp:
+        checkpoint = args.checkpoint
+        if checkpoint is None:
+            checkpoint = os.path.join(tmp, "model.pth")
+            torch.save(build_model(args.preset).state_dict(), checkpoint)
+        models = {"eager": load_backend(checkpoint)}
+        for backend in BACKENDS[1:]:
+            path = os.path.join(tmp, os.path.basename(artifact_path(checkpoint, backend)))
+            try:
+                EXPORTERS[backend](models["eager"], path)
+                models[backend] = load_backend(path, backend, args.intra_op_threads, args.inter_op_threads)
+            except ImportError as e:
+                print(f"{backend} not available: {e}")
+
+        print(f"{torch.get_num_threads()} intra-op / {torch.get_num_interop_threads()} inter-op threads | "
+              f"batch {args.batch_size}")
+        print(f"{'size':>10} {'backend':<12} {'ms':>9} {'speedup':>8} {'max abs diff':>13} {'PSNR vs eager':>14}")
+        for size in args.sizes:
+            height, width = map(int, size.split("x"))
+            x = torch.rand(args.batch_size, 3, height, width)
+            eager_ms = reference = None
+            for backend, model in models.items():
+                with torch.no_grad():
+                    model(x)  # warm-up: TorchScript profiles and ONNX Runtime allocates on the first calls
+                    ms, out = timed(model, x, args.repeat)
+                if reference is None:
+                    eager_ms, reference = ms, out
+                    print(f"{size:>10} {backend:<12} {ms:>9.1f} {'1.00x':>8} {'-':>13} {'-':>14}", flush=True)
+                    continue
+                diff = (out - reference).abs().max().item()
+                p = psnr(out, reference).mean().item()
+                print(f"{'':>10} {backend:<12} {ms:>9.1f} {eager_ms / ms:>7.2f}x {diff:>13.1e} {p:>14.1f}", flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+import argparse
+import os
+import re
+import subprocess
+import sys
+
+TRAIN_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "train.py")
+EPOCH_LINE = re.compile(r"Epoch \[(\d+)/\d+\], Loss: [\d.]+ \| ([\d.]+) img/s")
+
+
+def run(processes, args):
+    """Global img/s of the last epoch of a torchrun launch of train.py with `processes` ranks."""
+    command = [sys.executable, "-m", "torch.distributed.run", "--standalone", f"--nproc_per_node={processes}",
+               TRAIN_SCRIPT, "--data", args.data, "--preset", args.preset, "--epochs", str(args.epochs),
+               "--batch-size", str(args.batch_size), "--output", os.devnull, "--log-every", "1000000"]
+    result = subprocess.run(command, capture_output=True, text=True)
+    epochs = EPOCH_LINE.findall(result.stdout)
+    if result.returncode != 0 or not epochs:
+        if "SIGKILL" in result.stderr:
+            raise RuntimeError("a rank was killed (SIGKILL), most likely out of memory")
+        raise RuntimeError(f"exit code {result.returncode}, no epoch output")
+    # The first epoch pays for process start-up and warm-up, so the last one is reported
+    return float(epochs[-1][1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Data-parallel training throughput and scaling efficiency")
+    parser.add_argument("--data", required=True, help="training folder, as for train.py")
+    parser.add_argument("--processes", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--preset", default="small")
+    parser.add_argument("--epochs", type=int, default=2)
+    parser.add_argument("--batch-size", type=int, default=8, help="per process, so the global batch grows with N")
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} CPUs on this host | preset {args.preset} | batch {args.batch_size} per process")
+    print(f"{'processes':>9} {'img/s':>9} {'speedup':>8} {'efficiency':>11}")
+    base = None
+    for n in args.processes:
+        try:
+            throughput = run(n, args)
+        except RuntimeError as e:
+            # e.g. out of memory with many ranks on a small host; the rest of the table still runs
+            print(f"{n:>9} failed: {e}", flush=True)
+            continue
+        # Weak scaling: ideal throughput is N times one process's (extrapolated from the first row)
+        base = base or throughput / n
+        print(f"{n:>9} {throughput:>9.1f} {throughput / base:>7.2f}x {throughput / (base * n):>10.0%}", flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+import argparse
+import os
+import tempfile
+
+import cv2
+
+from bench_pipeline import SIZES, synthetic_image, timed
+from encoding import encode
+
+
+def _written_bytes():
+    # Bytes passed to write() by this process so far (includes tmpfs, unlike write_bytes)
+    with open("/proc/self/io") as f:
+        return int(next(line for line in f if line.startswith("wchar:")).split()[1])
+
+
+def temp_file_png(image):
+    # The old /enhance path: imwrite to a tempfile.mktemp() name, read it back, never delete it
+    path = tempfile.mktemp(suffix=".png")
+    cv2.imwrite(path, image)
+    with open(path, "rb") as f:
+        data = f.read()
+    os.remove(path)  # the old code leaked it; removed here so repeated runs don't fill /tmp
+    return data
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Encode time, output size and disk writes per output format")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[2, 12], choices=list(SIZES),
+                        help="megapixels")
+    parser.add_argument("--threads", type=int, nargs="+", default=[2, 4], help="parallel PNG thread counts")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    variants = [("temp file png", temp_file_png), ("memory png", lambda im: encode(im, "png"))]
+    variants += [(f"memory png x{n}", lambda im, n=n: encode(im, "png", threads=n)) for n in args.threads]
+    variants += [(f"memory png level {level}", lambda im, level=level: encode(im, "png", level)) for level in (3, 6)]
+    variants += [(f"memory {fmt}", lambda im, fmt=fmt: encode(im, fmt)) for fmt in ("jpeg", "webp")]
+
+    for mp in args.sizes:
+        image = synthetic_image(*SIZES[mp])
+        print(f"\n{mp} MP ({image.shape[1]}x{image.shape[0]}), {os.cpu_count()} CPUs")
+        print(f"{'variant':<20} {'ms':>9} {'MB sent':>9} {'MB to disk':>11}")
+        base_ms = None
+        for name, fn in variants:
+            before = _written_bytes()
+            ms, data = timed(fn, image, args.repeat)
+            disk_mb = (_written_bytes() - before) / args.repeat / 2 ** 20
+            base_ms = base_ms or ms
+            print(f"{name:<20} {ms:>9.1f} {len(data) / 2 ** 20:>9.2f} {disk_mb:>11.2f}   {base_ms / ms:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
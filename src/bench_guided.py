@@ -0,0 +1,54 @@
+import argparse
+import os
+
+import cv2
+import torch
+
+from bench_pipeline import synthetic_image, timed
+from inference import (DEFAULT_GUIDED_EPS, DEFAULT_GUIDED_RADIUS, DEFAULT_GUIDED_SIDE, enhance_guided,
+                       enhance_tiled, image_to_tensor, load_model)
+from metrics import psnr, ssim
+from model import UNetEnhancer
+
+# Named resolutions as (width, height)
+SIZES = {"1080p": (1920, 1080), "12mp": (4000, 3000), "24mp": (6000, 4000)}
+
+
+def load_images(args):
+    if args.data:
+        names = sorted(os.listdir(args.data))[:args.limit]
+        return [(name, cv2.imread(os.path.join(args.data, name))) for name in names]
+    return [(size, synthetic_image(*SIZES[size])) for size in args.sizes]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Guided-upsampling UNet inference vs full-resolution tiled inference")
+    parser.add_argument("--checkpoint", default=None, help="UNet weights (random init if omitted)")
+    parser.add_argument("--data", default=None, help="folder of images to compare on (default: synthetic sizes)")
+    parser.add_argument("--limit", type=int, default=5)
+    parser.add_argument("--sizes", nargs="+", default=["1080p", "12mp"], choices=list(SIZES))
+    parser.add_argument("--side", type=int, nargs="+", default=[256, DEFAULT_GUIDED_SIDE],
+                        help="long side(s) of the low-resolution pass")
+    parser.add_argument("--radius", type=int, default=DEFAULT_GUIDED_RADIUS)
+    parser.add_argument("--eps", type=float, default=DEFAULT_GUIDED_EPS)
+    parser.add_argument("--repeat", type=int, default=1)
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    model = load_model(args.checkpoint) if args.checkpoint else UNetEnhancer().eval()
+
+    print(f"{'image':<20} {'size':>11} {'mode':<12} {'ms':>10} {'speedup':>8} {'PSNR':>7} {'SSIM':>7}")
+    for name, image in load_images(args):
+        x = image_to_tensor(image)
+        size = f"{image.shape[1]}x{image.shape[0]}"
+        full_ms, reference = timed(lambda t: enhance_tiled(model, t), x, args.repeat)
+        print(f"{name:<20} {size:>11} {'full':<12} {full_ms:>10.1f} {'1.0x':>8} {'-':>7} {'-':>7}")
+        for side in args.side:
+            ms, out = timed(lambda t: enhance_guided(model, t, side, args.radius, args.eps), x, args.repeat)
+            p = psnr(out.unsqueeze(0), reference.unsqueeze(0)).item()
+            s = ssim(out.unsqueeze(0), reference.unsqueeze(0)).item()
+            print(f"{'':<20} {'':>11} {f'guided@{side}':<12} {ms:>10.1f} {full_ms / ms:>7.1f}x {p:>7.2f} {s:>7.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+import argparse
+import ctypes
+import multiprocessing
+import resource
+import time
+
+import torch
+import torch.nn as nn
+
+from bench import _rss_mb
+from model import MODEL_PRESETS, build_model
+
+# set_memory_saving() arguments and bf16 autocast per reported configuration
+ALL = dict(checkpoint_levels=True, recompute_attention=True, inplace=True)
+CONFIGS = {
+    "baseline": ({}, False),
+    "inplace": (dict(inplace=True), False),
+    "recompute_attention": (dict(recompute_attention=True), False),
+    "checkpoint_levels": (dict(checkpoint_levels=True), False),
+    "all": (ALL, False),
+    "bf16": ({}, True),
+    "all+bf16": (ALL, True),
+}
+
+# glibc's M_MMAP_THRESHOLD. Left dynamic, glibc serves tensors that fit under it from the
+# heap after the first large free and keeps that memory, so RSS would show old peaks.
+_M_MMAP_THRESHOLD = -3
+
+
+def _exact_allocations():
+    try:
+        ctypes.CDLL("libc.so.6").mallopt(_M_MMAP_THRESHOLD, 1 << 20)
+    except (OSError, AttributeError):
+        pass  # not glibc; RSS is then a looser upper bound
+
+
+def _tensor_peak_mb(step, model, optimizer):
+    # Live tensor bytes tracked per allocation (torch >= 2.5); None where unavailable
+    try:
+        from torch.distributed._tools.mem_tracker import MemTracker
+    except ImportError:
+        return None
+    tracker = MemTracker()
+    tracker.track_external(model, optimizer)
+    with tracker:
+        step()
+    return tracker.get_tracker_snapshot("peak")[torch.device("cpu")]["Total"] / 2 ** 20
+
+
+def _measure(config, args, conn):
+    # Runs in a fresh child process, so ru_maxrss is this configuration's peak alone
+    _exact_allocations()
+    saving, bf16 = CONFIGS[config]
+    torch.manual_seed(0)
+    model = build_model(args.preset).train().set_memory_saving(**saving)
+    optimizer = torch.optim.Adam(model.parameters(), lr=1e-4)
+    criterion = nn.L1Loss()
+    low = torch.rand(args.batch_size, 3, args.patch_size, args.patch_size)
+    high = torch.rand_like(low)
+
+    def step():
+        # Same sequence as train.py
+        with torch.autocast("cpu", dtype=torch.bfloat16, enabled=bf16):
+            enhanced = model(low)
+        criterion(enhanced.float(), high).backward()
+        optimizer.step()
+        optimizer.zero_grad(set_to_none=True)
+
+    before = _rss_mb()
+    times = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        step()
+        times.append(time.perf_counter() - start)
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 - before
+    conn.send({"rss_mb": rss, "tensor_mb": _tensor_peak_mb(step, model, optimizer),
+               "step_ms": 1000 * sorted(times)[len(times) // 2]})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Peak training-step memory of UNetEnhancer per memory-saving mode")
+    parser.add_argument("--preset", default="base", choices=list(MODEL_PRESETS))
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--patch-size", type=int, default=256)
+    parser.add_argument("--repeat", type=int, default=2)
+    parser.add_argument("--configs", nargs="+", default=list(CONFIGS), choices=list(CONFIGS))
+    args = parser.parse_args()
+
+    ctx = multiprocessing.get_context("fork")
+    print(f"{args.preset} | batch {args.batch_size} x {args.patch_size}x{args.patch_size} | "
+          f"forward + backward + Adam step")
+    print(f"{'config':<20} {'peak RSS MB':>12} {'peak tensors MB':>16} {'step ms':>9} {'batch for same memory':>22}")
+    baseline = None
+    for config in args.configs:
+        parent, child = ctx.Pipe(duplex=False)
+        proc = ctx.Process(target=_measure, args=(config, args, child))
+        proc.start()
+        result = parent.recv()
+        proc.join()
+        baseline = baseline or result
+        # How much larger a batch (or patch area) fits in the baseline's peak; the
+        # exact tensor accounting when available, RSS otherwise
+        key = "tensor_mb" if result["tensor_mb"] is not None else "rss_mb"
+        tensors = f"{result['tensor_mb']:.0f}" if result["tensor_mb"] is not None else "-"
+        print(f"{config:<20} {result['rss_mb']:>12.0f} {tensors:>16} {result['step_ms']:>9.0f} "
+              f"{baseline[key] / result[key]:>21.2f}x", flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from enhance import apply_clahe, gamma_correction, white_balance, adjust_brightness_contrast, adjust_saturation_sharpness
+from pipeline import DEFAULT_SETTINGS, EnhancementPipeline
+
+# Megapixel sizes to benchmark, as (width, height)
+SIZES = {2: (1920, 1080), 12: (4000, 3000), 24: (6000, 4000)}
+
+
+def synthetic_image(width, height, seed=0):
+    """Dark, smoothly varying test image with sensor-like noise."""
+    rng = np.random.default_rng(seed)
+    base = rng.integers(0, 90, (height // 32 + 1, width // 32 + 1, 3), dtype=np.uint8)
+    image = cv2.resize(base, (width, height), interpolation=cv2.INTER_CUBIC)
+    return cv2.add(image, rng.integers(0, 12, (height, width, 3), dtype=np.uint8))
+
+
+def per_step(image, s):
+    # The chain as appp.py's /enhance ran it before EnhancementPipeline
+    image = apply_clahe(image, s["clip_limit"], (s["grid_size"], s["grid_size"]))
+    image = gamma_correction(image, s["gamma"])
+    image = white_balance(image)
+    image = adjust_brightness_contrast(image, s["brightness"], s["contrast"])
+    return adjust_saturation_sharpness(image, s["saturation"], s["sharpness"])
+
+
+def timed(fn, image, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = fn(image)
+        times.append(time.perf_counter() - start)
+    return np.median(times) * 1000, out
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-step vs fused-LUT enhancement latency")
+    parser.add_argument("--sizes", type=int, nargs="+", default=sorted(SIZES), help="megapixel sizes to run")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    pipeline = EnhancementPipeline(clahe=True, white_balance=True, **DEFAULT_SETTINGS)
+    pointwise = EnhancementPipeline(white_balance=True, gamma=DEFAULT_SETTINGS["gamma"],
+                                    brightness=DEFAULT_SETTINGS["brightness"], contrast=DEFAULT_SETTINGS["contrast"])
+
+    def pointwise_per_step(image):
+        image = gamma_correction(image, DEFAULT_SETTINGS["gamma"])
+        image = white_balance(image)
+        return adjust_brightness_contrast(image, DEFAULT_SETTINGS["brightness"], DEFAULT_SETTINGS["contrast"])
+
+    print(f"{'MP':>4} {'stages':<10} {'per-step ms':>12} {'fused ms':>10} {'speedup':>8} {'max diff':>9}")
+    for mp in args.sizes:
+        image = synthetic_image(*SIZES[mp])
+        for name, ref_fn, fused_fn in (("pointwise", pointwise_per_step, pointwise),
+                                       ("full", lambda im: per_step(im, DEFAULT_SETTINGS), pipeline)):
+            ref_ms, ref = timed(ref_fn, image, args.repeat)
+            fused_ms, out = timed(fused_fn, image, args.repeat)
+            diff = int(np.abs(ref.astype(np.int16) - out).max())
+            print(f"{mp:>4} {name:<10} {ref_ms:>12.1f} {fused_ms:>10.1f} {ref_ms / fused_ms:>7.1f}x {diff:>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+import argparse
+import threading
+import time
+
+import numpy as np
+
+from model import UNetEnhancer
+from inference import load_model
+from serving import ModelServer
+
+
+def run_load(server, concurrency, duration, size):
+    """Closed-loop load: `concurrency` clients each send the next request as soon as one returns."""
+    rng = np.random.default_rng(0)
+    image = rng.integers(0, 80, (size, size, 3), dtype=np.uint8)
+    done = [0] * concurrency
+    deadline = time.perf_counter() + duration
+
+    def client(i):
+        while time.perf_counter() < deadline:
+            server.enhance(image)
+            done[i] += 1
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return sum(done) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Requests/s of the micro-batching ModelServer vs batch-of-one")
+    parser.add_argument("--checkpoint", help="lowlight_enhancer.pth (random weights if omitted)")
+    parser.add_argument("--size", type=int, default=256, help="side of the square test image")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds per measurement")
+    parser.add_argument("--max-batch-size", type=int, default=8)
+    parser.add_argument("--max-wait-ms", type=float, default=10)
+    args = parser.parse_args()
+
+    model = load_model(args.checkpoint) if args.checkpoint else UNetEnhancer().eval()
+    configs = (("batch-of-one", 1), ("micro-batch", args.max_batch_size))
+
+    print(f"{'clients':>7} " + " ".join(f"{name + ' req/s':>18}" for name, _ in configs) + f" {'mean batch':>10} {'p95 ms':>8}")
+    for concurrency in args.concurrency:
+        row = []
+        for _, max_batch_size in configs:
+            server = ModelServer(model, max_batch_size=max_batch_size, max_wait_ms=args.max_wait_ms).start()
+            row.append(run_load(server, concurrency, args.duration, args.size))
+            stats = server.stats()
+            server.stop()
+        print(f"{concurrency:>7} " + " ".join(f"{rps:>18.1f}" for rps in row)
+              + f" {stats['mean_batch_size']:>10} {stats['latency_ms'].get('p95', 0):>8}")
+
+
+if __name__ == "__main__":
+    main()
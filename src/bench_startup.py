@@ -0,0 +1,119 @@
+import argparse
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# How worker processes get the model:
+#   read      - each worker imports torch and reads the checkpoint (the old batch.py/server setup)
+#   mapped    - each worker imports torch and maps the checkpoint (shared through the page cache)
+#   preloaded - the parent imports torch and maps it once; workers fork with both (copy-on-write)
+MODES = ("read", "mapped", "preloaded")
+
+
+def _memory_kb(pid):
+    # Rss counts shared pages in full, Pss splits them between the processes sharing them,
+    # and the private pages are what each extra worker really adds
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                fields[parts[0].rstrip(":")] = int(parts[1])
+    return fields["Rss"], fields["Pss"], fields["Private_Clean"] + fields["Private_Dirty"]
+
+
+def _worker(checkpoint, mmap, model, conn):
+    import torch
+    from inference import load_model
+
+    torch.set_num_threads(1)
+    if model is None:
+        model = load_model(checkpoint, mmap=mmap)
+    with torch.no_grad():
+        model(torch.zeros(1, 3, 64, 64))  # one forward, so the runtime is as set up as when serving
+    conn.send(time.perf_counter())
+    conn.recv()  # stay alive until measured
+
+
+def run_workers(mode, checkpoint, workers):
+    """Start `workers` model-holding processes in `mode`; time to all ready and their memory."""
+    ctx = multiprocessing.get_context("fork")
+    start = time.perf_counter()
+    model = None
+    if mode == "preloaded":
+        from inference import load_model
+        model = load_model(checkpoint, mmap=True)
+    pipes, processes = [], []
+    for _ in range(workers):
+        parent, child = ctx.Pipe()
+        process = ctx.Process(target=_worker, args=(checkpoint, mode != "read", model, child))
+        process.start()
+        pipes.append(parent)
+        processes.append(process)
+    ready = max(pipe.recv() for pipe in pipes)
+    memory = [_memory_kb(p.pid) for p in processes]
+    parent_pss = _memory_kb(os.getpid())[1]
+    for pipe, process in zip(pipes, processes):
+        pipe.send(None)
+        process.join()
+    return {"seconds": ready - start, "rss_mb": sum(m[0] for m in memory) / workers / 1024,
+            "pss_mb": sum(m[1] for m in memory) / workers / 1024,
+            "private_mb": sum(m[2] for m in memory) / workers / 1024,
+            "total_pss_mb": (sum(m[1] for m in memory) + parent_pss) / 1024}
+
+
+def _in_fresh_process(code, env=None):
+    # A new interpreter per measurement, so nothing is imported or cached from an earlier one
+    result = subprocess.run([sys.executable, "-W", "ignore", "-c", code], capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)), env={**os.environ, **(env or {})})
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def app_import(preload, checkpoint):
+    code = (f"import json, resource, sys, time; sys.path.insert(0, {ROOT!r}); start = time.perf_counter()\n"
+            "import appp\n"
+            "print(json.dumps({'seconds': time.perf_counter() - start, 'torch': 'torch' in sys.modules,"
+            " 'peak_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}))")
+    return _in_fresh_process(code, {"PRELOAD_MODEL": "1" if preload else "0", "MODEL_PATH": checkpoint})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Server start-up time and per-worker memory with shared weights")
+    parser.add_argument("--checkpoint", default=None, help="UNet weights (random init of --preset if omitted)")
+    parser.add_argument("--preset", default="base")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--modes", nargs="+", default=list(MODES), choices=MODES)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        checkpoint = args.checkpoint
+        if checkpoint is None:
+            checkpoint = os.path.join(tmp, "model.pth")
+            _in_fresh_process(f"import json, torch; from model import build_model; "
+                              f"torch.save(build_model({args.preset!r}).state_dict(), {checkpoint!r}); print('{{}}')")
+        print(f"checkpoint {os.path.getsize(checkpoint) / 2 ** 20:.1f} MB")
+
+        print(f"\n{'import appp':<26} {'seconds':>8} {'peak MB':>8} {'torch loaded':>13}")
+        for name, preload in (("torch deferred (default)", False), ("PRELOAD_MODEL=1", True)):
+            r = app_import(preload, checkpoint)
+            print(f"{name:<26} {r['seconds']:>8.2f} {r['peak_mb']:>8.0f} {str(r['torch']):>13}", flush=True)
+
+        print(f"\n{args.workers} workers, each holding the model after one forward pass (MB per worker)")
+        print(f"{'mode':<10} {'ready s':>8} {'RSS':>7} {'PSS':>7} {'private':>8} {'total PSS':>10}")
+        for mode in args.modes:
+            r = _in_fresh_process(f"import json; from bench_startup import run_workers; "
+                                  f"print(json.dumps(run_workers({mode!r}, {checkpoint!r}, {args.workers})))")
+            print(f"{mode:<10} {r['seconds']:>8.2f} {r['rss_mb']:>7.0f} {r['pss_mb']:>7.0f} {r['private_mb']:>8.0f} "
+                  f"{r['total_pss_mb']:>10.0f}", flush=True)
+
+
+if __name__ == "__main__":
+    main()
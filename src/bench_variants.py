@@ -0,0 +1,57 @@
+import argparse
+import os
+
+import cv2
+import numpy as np
+
+from bench_pipeline import SIZES, synthetic_image, timed
+from image_store import DecodedImage
+from pipeline import EnhancementPipeline, render_enhanced
+from variants import SHEET_TILE_SIDE, count_stages, plan, render_variants
+
+# Eight looks to compare: two CLAHE clip limits times four gammas, white balance on
+VARIANTS = [{"clahe": True, "clip_limit": clip, "gamma": True, "gamma_value": gamma, "white_balance": True}
+            for clip in (2.0, 3.0) for gamma in (1.5, 1.8, 2.2, 2.5)]
+
+
+def separate_renders(data, max_side, fmt):
+    # One /enhance call per variant: read the file, take the preview, render and encode
+    outputs = []
+    for variant in VARIANTS:
+        image = DecodedImage(cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)).preview(max_side)
+        outputs.append(render_enhanced(image, variant, fmt))
+    return outputs
+
+
+def variant_render(data, max_side, fmt, layout, threads):
+    image = DecodedImage(cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)).preview(max_side)
+    return render_variants(image[None], VARIANTS, [0] * len(VARIANTS), fmt, None, threads, layout)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="8 separate renders vs one /enhance/variants render")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[2, 12], choices=list(SIZES), help="megapixels")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 4], help="variant threads")
+    parser.add_argument("--format", default="png", choices=["png", "jpeg", "webp"])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    pipelines = [EnhancementPipeline.from_enhancements(v) for v in VARIANTS]
+    print(f"{len(VARIANTS)} variants: {sum(len(p.stages()) for p in pipelines)} stages run separately, "
+          f"{count_stages(plan(pipelines))} in the shared plan | {os.cpu_count()} CPUs")
+    for mp in args.sizes:
+        # The upload as a client sends it
+        data = cv2.imencode(".jpg", synthetic_image(*SIZES[mp]), [cv2.IMWRITE_JPEG_QUALITY, 95])[1].tobytes()
+        print(f"\n{mp} MP upload, {args.format}")
+        print(f"{'render':<34} {'ms':>9} {'speedup':>8}")
+        for layout, max_side in (("multipart", None), ("sheet", SHEET_TILE_SIDE)):
+            size = "full size" if max_side is None else f"{max_side} px tiles"
+            base_ms, _ = timed(lambda d: separate_renders(d, max_side, args.format), data, args.repeat)
+            print(f"{f'8 x /enhance, {size}':<34} {base_ms:>9.1f} {'1.00x':>8}")
+            for threads in args.threads:
+                ms, _ = timed(lambda d: variant_render(d, max_side, args.format, layout, threads), data, args.repeat)
+                print(f"{f'{layout}, {threads} thread(s)':<34} {ms:>9.1f} {base_ms / ms:>7.2f}x", flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+import argparse
+import os
+
+from torch.utils.data import DataLoader
+
+from evaluate import DEFAULT_BATCH_SIZE, EvaluationPairs, collate_by_size, score
+from inference import load_model, median_latency_ms
+from model import MODEL_PRESETS, build_model, count_flops, count_parameters
+
+
+def evaluate(model, dataset):
+    # Same batched engine (and 8-bit rounding) as evaluate.py, so the numbers agree
+    loader = DataLoader(dataset, batch_size=DEFAULT_BATCH_SIZE, collate_fn=collate_by_size)
+    scores = [(p, s) for _, p, s in score(loader, model)]
+    return sum(p for p, _ in scores) / len(scores), sum(s for _, s in scores) / len(scores)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Latency vs quality of the UNetEnhancer presets")
+    parser.add_argument("--data", default=None, help="LOL-style folder with low/ and high/ (e.g. our485 or eval15)")
+    parser.add_argument("--checkpoints", nargs="*", default=[], metavar="PRESET=PATH",
+                        help="trained weights per preset; presets without one get no PSNR/SSIM")
+    parser.add_argument("--limit", type=int, default=None, help="evaluate on the first N pairs only")
+    parser.add_argument("--height", type=int, default=400, help="latency input height (LOL frames are 400x600)")
+    parser.add_argument("--width", type=int, default=600)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    checkpoints = dict(item.split("=", 1) for item in args.checkpoints)
+    dataset = None
+    if args.data:
+        dataset = EvaluationPairs(os.path.join(args.data, "low"), os.path.join(args.data, "high"), limit=args.limit)
+
+    print(f"{'preset':<8} {'params':>10} {'GFLOPs/MP':>10} {f'ms @ {args.height}x{args.width}':>16} "
+          f"{'speedup':>8} {'PSNR':>7} {'SSIM':>7}")
+    base_ms = None
+    for preset in reversed(list(MODEL_PRESETS)):
+        model = load_model(checkpoints[preset]) if preset in checkpoints else build_model(preset).eval()
+        gflops = count_flops(model, 1000, 1000) / 1e9
+        ms = median_latency_ms(model, (1, 3, args.height, args.width), args.repeat)
+        base_ms = base_ms or ms
+        quality = "      -       -"
+        if dataset is not None and preset in checkpoints:
+            p, s = evaluate(model, dataset)
+            quality = f"{p:>7.2f} {s:>7.4f}"
+        print(f"{preset:<8} {count_parameters(model):>10,} {gflops:>10.1f} {ms:>16.1f} {base_ms / ms:>7.1f}x {quality}")
+
+
+if __name__ == "__main__":
+    main()
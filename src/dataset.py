@@ -1,8 +1,23 @@
 import torch
 import os
+import argparse
+import numpy as np
 from torchvision import transforms
 from PIL import Image
 
+# Packed cache layout: shard_XXXXX.bin files of raw HWC uint8 RGB pixels, plus an
+# index.npy with one row per low/high pair giving the shard and byte offsets.
+CACHE_INDEX = "index.npy"
+CACHE_NAMES = "names.txt"
+SHARD_BYTES = 1 << 30  # start a new shard after ~1 GB
+INDEX_DTYPE = np.dtype([
+    ("shard", np.int32),
+    ("low_offset", np.int64),
+    ("high_offset", np.int64),
+    ("height", np.int32),
+    ("width", np.int32),
+])
+
 class LowLightDataset(torch.utils.data.Dataset):
     def __init__(self, low_path, high_path):
 # Filter only image files (JPG, PNG, etc.)
@@ -33,3 +48,105 @@ class LowLightDataset(torch.utils.data.Dataset):
         high_img = self.transform(high_img)
 
         return low_img, high_img
+
+
+def _shard_name(shard):
+    return f"shard_{shard:05d}.bin"
+
+def build_cache(low_path, high_path, cache_dir):
+    """Decode every low/high pair once and pack them into memory-mappable shards."""
+    pairs = LowLightDataset(low_path, high_path)
+    os.makedirs(cache_dir, exist_ok=True)
+    index = np.zeros(len(pairs), dtype=INDEX_DTYPE)
+
+    shard, offset = 0, 0
+    out = open(os.path.join(cache_dir, _shard_name(shard)), "wb")
+    for i, (low_name, high_name) in enumerate(zip(pairs.low_images, pairs.high_images)):
+        low = np.asarray(Image.open(os.path.join(low_path, low_name)).convert("RGB"))
+        high = np.asarray(Image.open(os.path.join(high_path, high_name)).convert("RGB"))
+        if low.shape != high.shape:
+            raise ValueError(f"Size mismatch between {low_name} {low.shape} and {high_name} {high.shape}")
+        if offset and offset + low.nbytes + high.nbytes > SHARD_BYTES:
+            out.close()
+            shard, offset = shard + 1, 0
+            out = open(os.path.join(cache_dir, _shard_name(shard)), "wb")
+        out.write(low.tobytes())
+        out.write(high.tobytes())
+        index[i] = (shard, offset, offset + low.nbytes, low.shape[0], low.shape[1])
+        offset += low.nbytes + high.nbytes
+    out.close()
+
+    np.save(os.path.join(cache_dir, CACHE_INDEX), index)
+    with open(os.path.join(cache_dir, CACHE_NAMES), "w") as f:
+        f.write("\n".join(pairs.low_images))
+    return index
+
+class CachedLowLightDataset(torch.utils.data.Dataset):
+    """Random aligned patches from a cache written by build_cache().
+
+    Items are uint8 HWC numpy views into the memory-mapped shards (no decode,
+    no copy); use collate_uint8 in the DataLoader and batch_to_float on the
+    batch to get float tensors. Each pair is visited `patches_per_image`
+    times per epoch, at a different random crop each time.
+    """
+
+    def __init__(self, cache_dir, patch_size=256, patches_per_image=1):
+        self.cache_dir = cache_dir
+        self.patch_size = patch_size
+        self.patches_per_image = patches_per_image
+        self.index = np.load(os.path.join(cache_dir, CACHE_INDEX))
+
+        smallest = int(min(self.index["height"].min(), self.index["width"].min()))
+        if patch_size > smallest:
+            raise ValueError(f"patch_size {patch_size} is larger than the smallest cached image side ({smallest})")
+
+        # Opened lazily so each DataLoader worker maps the shards itself
+        self._shards = {}
+
+    def __len__(self):
+        return len(self.index) * self.patches_per_image
+
+    def _shard(self, shard):
+        if shard not in self._shards:
+            self._shards[shard] = np.memmap(os.path.join(self.cache_dir, _shard_name(shard)), dtype=np.uint8, mode="r")
+        return self._shards[shard]
+
+    def __getstate__(self):
+        # memmaps are re-opened on the other side of a pickle (spawned workers)
+        state = self.__dict__.copy()
+        state["_shards"] = {}
+        return state
+
+    def __getitem__(self, idx):
+        entry = self.index[idx % len(self.index)]
+        h, w = int(entry["height"]), int(entry["width"])
+        data = self._shard(int(entry["shard"]))
+        low = data[entry["low_offset"]:entry["low_offset"] + h * w * 3].reshape(h, w, 3)
+        high = data[entry["high_offset"]:entry["high_offset"] + h * w * 3].reshape(h, w, 3)
+
+        p = self.patch_size
+        # torch's RNG is seeded per DataLoader worker, so workers draw different crops
+        y = int(torch.randint(0, h - p + 1, (1,)))
+        x = int(torch.randint(0, w - p + 1, (1,)))
+        return low[y:y + p, x:x + p], high[y:y + p, x:x + p]
+
+def collate_uint8(batch):
+    """Stack uint8 patches into NHWC uint8 tensors (the only copy a batch makes)."""
+    lows, highs = zip(*batch)
+    return torch.from_numpy(np.stack(lows)), torch.from_numpy(np.stack(highs))
+
+def batch_to_float(batch, device=None):
+    """NHWC uint8 tensor -> NCHW float32 in [0, 1], matching ToTensor()."""
+    if device is not None:
+        batch = batch.to(device, non_blocking=True)
+    return batch.permute(0, 3, 1, 2).float().div_(255.0)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pack a low/high image pair folder into a training cache")
+    parser.add_argument("low_path")
+    parser.add_argument("high_path")
+    parser.add_argument("cache_dir")
+    args = parser.parse_args()
+    index = build_cache(args.low_path, args.high_path, args.cache_dir)
+    print(f"✅ Cached {len(index)} pairs in '{args.cache_dir}'")
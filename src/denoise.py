@@ -0,0 +1,96 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from enhance import denoise_image
+
+# fastNlMeansDenoisingColored windows used by denoise_image()
+NLM_TEMPLATE_WINDOW = 7
+NLM_SEARCH_WINDOW = 21
+# A pixel's NL-means result depends on pixels up to search/2 + template/2 away,
+# so tiles that overlap by this much reproduce the full-frame output exactly
+NLM_HALO = NLM_SEARCH_WINDOW // 2 + NLM_TEMPLATE_WINDOW // 2
+
+DEFAULT_TILE_ROWS = 256
+DEFAULT_WORKERS = min(8, os.cpu_count() or 1)
+
+_executor = None
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=DEFAULT_WORKERS, thread_name_prefix="denoise")
+    return _executor
+
+
+def _nlmeans(image, strength, search_window=NLM_SEARCH_WINDOW):
+    return cv2.fastNlMeansDenoisingColored(image, None, strength, strength, NLM_TEMPLATE_WINDOW, search_window)
+
+
+def denoise_nlmeans(image, strength=10):
+    """Full-frame NL-means: the reference output (denoise_image). Slowest, best quality."""
+    return denoise_image(image, strength)
+
+
+def denoise_nlmeans_tiled(image, strength=10, tile_rows=DEFAULT_TILE_ROWS, search_window=NLM_SEARCH_WINDOW):
+    """NL-means on horizontal strips run in parallel on a thread pool.
+
+    Strips overlap by the filter's reach, so with the default search window
+    the output is identical to denoise_nlmeans; OpenCV releases the GIL,
+    so the strips run on separate cores. Memory per strip is small, which
+    also keeps huge frames cache-friendly.
+    """
+    height = image.shape[0]
+    halo = search_window // 2 + NLM_TEMPLATE_WINDOW // 2
+    if height <= tile_rows + 2 * halo:
+        return _nlmeans(image, strength, search_window)
+
+    def run(start):
+        stop = min(start + tile_rows, height)
+        top, bottom = max(start - halo, 0), min(stop + halo, height)
+        return start, stop, _nlmeans(image[top:bottom], strength, search_window)[start - top:stop - top]
+
+    output = np.empty_like(image)
+    for start, stop, strip in _get_executor().map(run, range(0, height, tile_rows)):
+        output[start:stop] = strip
+    return output
+
+
+def denoise_nlmeans_fast(image, strength=10):
+    """Tiled NL-means with an 11x11 search window: ~2x faster, slightly weaker on flat noise."""
+    return denoise_nlmeans_tiled(image, strength, search_window=11)
+
+
+def denoise_bilateral(image, strength=10):
+    """Edge-preserving bilateral filter in Lab. Very fast; smooths fine texture more than NL-means."""
+    lab = cv2.cvtColor(image, cv2.COLOR_BGR2LAB)
+    lab = cv2.bilateralFilter(lab, d=9, sigmaColor=2.5 * strength, sigmaSpace=4)
+    return cv2.cvtColor(lab, cv2.COLOR_LAB2BGR)
+
+
+def denoise_guided(image, strength=10):
+    """Self-guided filter (O(1) per pixel box filters). Fastest; leaves a little noise on strong edges."""
+    if strength <= 0:
+        return image.copy()
+    eps = (2.0 * strength) ** 2
+    return cv2.ximgproc.guidedFilter(image, image, 4, eps)
+
+
+# Engines ordered roughly from best quality to fastest
+DENOISERS = {
+    "nlmeans": denoise_nlmeans,
+    "nlmeans_tiled": denoise_nlmeans_tiled,
+    "nlmeans_fast": denoise_nlmeans_fast,
+    "bilateral": denoise_bilateral,
+    "guided": denoise_guided,
+}
+
+
+def denoise(image, strength=10, engine="nlmeans"):
+    """Denoise a BGR uint8 image with one of the DENOISERS engines."""
+    if engine not in DENOISERS:
+        raise ValueError(f"Unknown denoise engine '{engine}', expected one of {list(DENOISERS)}")
+    return DENOISERS[engine](image, strength)
@@ -0,0 +1,37 @@
+import cv2
+import numpy as np
+from PIL import Image, ImageEnhance
+
+# Enhancement Functions
+# Per-step reference implementations shared by appp.py and the Streamlit apps.
+def apply_clahe(image, clip_limit=3.0, grid_size=(8,8)):
+    lab = cv2.cvtColor(image, cv2.COLOR_BGR2LAB)
+    l, a, b = cv2.split(lab)
+    clahe = cv2.createCLAHE(clipLimit=clip_limit, tileGridSize=grid_size)
+    l = clahe.apply(l)
+    lab = cv2.merge((l, a, b))
+    return cv2.cvtColor(lab, cv2.COLOR_LAB2BGR)
+
+def gamma_correction(image, gamma=1.5):
+    invGamma = 1.0 / gamma
+    table = np.array([(i / 255.0) ** invGamma * 255 for i in range(256)]).astype("uint8")
+    return cv2.LUT(image, table)
+
+def white_balance(image):
+    wb = cv2.xphoto.createSimpleWB()
+    return wb.balanceWhite(image)
+
+def denoise_image(image, strength=10):
+    return cv2.fastNlMeansDenoisingColored(image, None, strength, strength, 7, 21)
+
+def adjust_brightness_contrast(image, brightness=1.0, contrast=1.0):
+    img = Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+    img = ImageEnhance.Brightness(img).enhance(brightness)
+    img = ImageEnhance.Contrast(img).enhance(contrast)
+    return cv2.cvtColor(np.array(img), cv2.COLOR_RGB2BGR)
+
+def adjust_saturation_sharpness(image, saturation=1.0, sharpness=1.0):
+    img = Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+    img = ImageEnhance.Color(img).enhance(saturation)
+    img = ImageEnhance.Sharpness(img).enhance(sharpness)
+    return cv2.cvtColor(np.array(img), cv2.COLOR_RGB2BGR)
@@ -0,0 +1,181 @@
+import argparse
+import csv
+import json
+import os
+import time
+
+import cv2
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, Dataset
+
+from inference import load_model, pad_to_multiple
+from metrics import SSIM_C1, SSIM_C2, SSIM_SIGMA, SSIM_WINDOW, psnr, ssim
+from pipeline import DEFAULT_SETTINGS, EnhancementPipeline
+
+VALID_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".tiff")
+DEFAULT_BATCH_SIZE = 16
+# Largest allowed gap between the batched metrics and the float64 reference in --verify
+VERIFY_TOLERANCE = {"psnr": 1e-3, "ssim": 1e-4}
+
+
+class EvaluationPairs(Dataset):
+    """low/high pairs as uint8 RGB (3, H, W) tensors, paired by sorted name like LowLightDataset.
+
+    With a `pipeline`, the low image is replaced by its classical
+    enhancement, so that work runs in the DataLoader workers.
+    """
+
+    def __init__(self, low_path, high_path, pipeline=None, limit=None):
+        self.low_path, self.high_path, self.pipeline = low_path, high_path, pipeline
+        self.low_images = sorted(f for f in os.listdir(low_path) if f.lower().endswith(VALID_EXTENSIONS))[:limit]
+        self.high_images = sorted(f for f in os.listdir(high_path) if f.lower().endswith(VALID_EXTENSIONS))[:limit]
+        if len(self.low_images) != len(self.high_images):
+            raise ValueError(f"{len(self.low_images)} low images but {len(self.high_images)} high images")
+
+    def __len__(self):
+        return len(self.low_images)
+
+    def __getitem__(self, idx):
+        low = cv2.imread(os.path.join(self.low_path, self.low_images[idx]))
+        high = cv2.imread(os.path.join(self.high_path, self.high_images[idx]))
+        if self.pipeline is not None:
+            low = self.pipeline(low)
+
+        def to_tensor(image):
+            return torch.from_numpy(np.ascontiguousarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB).transpose(2, 0, 1)))
+        return self.low_images[idx], to_tensor(low), to_tensor(high)
+
+
+def collate_by_size(items):
+    """Stack pairs into one batch per image size; a DataLoader batch may hold several."""
+    groups = {}
+    for name, low, high in items:
+        groups.setdefault(tuple(low.shape), []).append((name, low, high))
+    return [([g[0] for g in group], torch.stack([g[1] for g in group]), torch.stack([g[2] for g in group]))
+            for group in groups.values()]
+
+
+@torch.no_grad()
+def score(loader, model=None, device="cpu"):
+    """Yield (name, psnr, ssim) for every pair, with batched metrics on 8-bit results.
+
+    With a `model` the low images are run through it as one batch per
+    size; the output is rounded to 8 bits as it would be saved, so the
+    scores match those of the written files.
+    """
+    for groups in loader:
+        for names, low, high in groups:
+            pred = low.to(device)
+            if model is not None:
+                h, w = pred.shape[-2:]
+                x = pad_to_multiple(pred.float() / 255, getattr(model, "size_multiple", 8))
+                pred = (model(x)[..., :h, :w].clamp(0, 1) * 255).round()
+            pred = pred.float() / 255
+            target = high.to(device).float() / 255
+            for name, p, s in zip(names, psnr(pred, target).tolist(), ssim(pred, target).tolist()):
+                yield name, p, s
+
+
+def reference_psnr(pred, target):
+    """Float64 PSNR of two uint8 HWC images."""
+    mse = np.mean((pred.astype(np.float64) - target.astype(np.float64)) ** 2)
+    return 10 * np.log10(255.0 ** 2 / mse)
+
+
+def reference_ssim(pred, target):
+    """Float64 SSIM of two uint8 HWC images, as in Wang et al.'s MATLAB code (and BasicSR's port)."""
+    c1, c2 = SSIM_C1 * 255 ** 2, SSIM_C2 * 255 ** 2
+    kernel = cv2.getGaussianKernel(SSIM_WINDOW, SSIM_SIGMA)
+    window = np.outer(kernel, kernel.transpose())
+    border = SSIM_WINDOW // 2
+    scores = []
+    for c in range(pred.shape[2]):
+        x, y = pred[..., c].astype(np.float64), target[..., c].astype(np.float64)
+        mu_x = cv2.filter2D(x, -1, window)[border:-border, border:-border]
+        mu_y = cv2.filter2D(y, -1, window)[border:-border, border:-border]
+        var_x = cv2.filter2D(x ** 2, -1, window)[border:-border, border:-border] - mu_x ** 2
+        var_y = cv2.filter2D(y ** 2, -1, window)[border:-border, border:-border] - mu_y ** 2
+        cov = cv2.filter2D(x * y, -1, window)[border:-border, border:-border] - mu_x * mu_y
+        ssim_map = ((2 * mu_x * mu_y + c1) * (2 * cov + c2)) / ((mu_x ** 2 + mu_y ** 2 + c1) * (var_x + var_y + c2))
+        scores.append(ssim_map.mean())
+    return float(np.mean(scores))
+
+
+def verify(dataset, count):
+    """Largest difference between the batched metrics and the float64 references on `count` pairs."""
+    loader = DataLoader(dataset, batch_size=count, collate_fn=collate_by_size)
+    batched = {name: (p, s) for name, p, s in score([next(iter(loader))])}
+    worst = {"psnr": 0.0, "ssim": 0.0}
+    for i in range(min(count, len(dataset))):
+        name, low, high = dataset[i]
+        pred, target = low.permute(1, 2, 0).numpy(), high.permute(1, 2, 0).numpy()
+        worst["psnr"] = max(worst["psnr"], abs(batched[name][0] - reference_psnr(pred, target)))
+        worst["ssim"] = max(worst["ssim"], abs(batched[name][1] - reference_ssim(pred, target)))
+    return worst
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PSNR/SSIM of the UNet or the classical chain on low/high pairs")
+    parser.add_argument("data", help="LOL-style folder with low/ and high/ (e.g. eval15)")
+    parser.add_argument("--method", default="unet", choices=["unet", "classical", "identity"],
+                        help="what produces the enhanced image; identity scores the low images as they are")
+    parser.add_argument("--checkpoint", default="lowlight_enhancer.pth", help="UNet weights for --method unet")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1),
+                        help="DataLoader processes decoding pairs (and running the classical chain)")
+    parser.add_argument("--limit", type=int, default=None, help="first N pairs only")
+    parser.add_argument("--csv", default=None, help="write per-image scores here")
+    parser.add_argument("--save", metavar="JSON", help="write the summary, e.g. next to a bench.py baseline")
+    parser.add_argument("--verify", type=int, default=0, metavar="N",
+                        help="first check the batched metrics against float64 references on N pairs")
+    args = parser.parse_args()
+
+    pipeline = None
+    if args.method == "classical":
+        pipeline = EnhancementPipeline(clahe=True, white_balance=True, **DEFAULT_SETTINGS)
+    dataset = EvaluationPairs(os.path.join(args.data, "low"), os.path.join(args.data, "high"), pipeline, args.limit)
+    if args.verify:
+        worst = verify(dataset, args.verify)
+        print(f"Max difference to the float64 references: PSNR {worst['psnr']:.2e} dB, SSIM {worst['ssim']:.2e}")
+        if worst["psnr"] > VERIFY_TOLERANCE["psnr"] or worst["ssim"] > VERIFY_TOLERANCE["ssim"]:
+            raise SystemExit("❌ Batched metrics disagree with the references")
+
+    model = load_model(args.checkpoint) if args.method == "unet" else None
+    loader = DataLoader(dataset, batch_size=args.batch_size, num_workers=args.workers, collate_fn=collate_by_size)
+
+    writer, csv_file = None, None
+    if args.csv:
+        csv_file = open(args.csv, "w", newline="")
+        writer = csv.writer(csv_file)
+        writer.writerow(["image", "psnr", "ssim"])
+    start = time.perf_counter()
+    scores = []
+    try:
+        for name, p, s in score(loader, model):
+            scores.append((p, s))
+            if writer:
+                writer.writerow([name, f"{p:.4f}", f"{s:.6f}"])
+    finally:
+        if csv_file:
+            csv_file.close()
+    elapsed = time.perf_counter() - start
+
+    summary = {
+        "method": args.method,
+        "checkpoint": args.checkpoint if model is not None else None,
+        "images": len(scores),
+        "psnr": round(float(np.mean([p for p, _ in scores])), 4),
+        "ssim": round(float(np.mean([s for _, s in scores])), 6),
+        "seconds": round(elapsed, 2),
+    }
+    print(f"{summary['images']} pairs | PSNR {summary['psnr']:.2f} dB | SSIM {summary['ssim']:.4f} | "
+          f"{elapsed:.1f} s ({len(scores) / elapsed:.1f} pairs/s)")
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(summary, f, indent=2)
+        print(f"✅ Summary saved as '{args.save}'")
+
+
+if __name__ == "__main__":
+    main()
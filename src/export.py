@@ -0,0 +1,91 @@
+import argparse
+import inspect
+import json
+import warnings
+
+import torch
+from torch.ao.quantization import fuse_modules
+
+from backends import CONFIG_KEY, INPUT_NAME, OUTPUT_NAME, artifact_path, load_backend
+from inference import load_model
+from model import UNetEnhancer
+from quantize import fuse_groups
+
+DEFAULT_OPSET = 17
+# Traced at this size; both artifacts accept any batch and any size divisible by size_multiple
+SAMPLE_SIZE = 256
+
+
+def fuse_for_inference(model):
+    """Float copy of `model` in eval mode with each Conv + ReLU pair merged into one module."""
+    fused = UNetEnhancer(**model.config)
+    fused.load_state_dict(model.state_dict())
+    return fuse_modules(fused.eval(), fuse_groups(fused))
+
+
+def _sample():
+    return torch.rand(1, 3, SAMPLE_SIZE, SAMPLE_SIZE)
+
+
+def export_torchscript(model, path):
+    """Trace and freeze `model` and save it as TorchScript, with the model config.
+
+    Freezing inlines the weights and folds constants. The oneDNN rewrite
+    (optimize_for_inference) doesn't survive saving, so backends.py applies
+    it when loading.
+    """
+    with torch.no_grad(), warnings.catch_warnings():
+        # The tracer warns about the Python bool in forward(); it is constant in eval mode
+        warnings.simplefilter("ignore", torch.jit.TracerWarning)
+        traced = torch.jit.trace(fuse_for_inference(model), _sample())
+    torch.jit.save(torch.jit.freeze(traced), path, _extra_files={CONFIG_KEY: json.dumps(model.config)})
+
+
+def export_onnx(model, path, opset=DEFAULT_OPSET):
+    """Export `model` to ONNX with constant folding, dynamic batch and size, and the config as metadata.
+
+    Needs the `onnx` package. ONNX Runtime applies its Conv + activation
+    fusions when the session is created (see backends.py).
+    """
+    import onnx  # optional: pip install onnx
+
+    # Newer PyTorch defaults to the dynamo exporter; the TorchScript-based one handles this model on every version
+    options = {"dynamo": False} if "dynamo" in inspect.signature(torch.onnx.export).parameters else {}
+    axes = {0: "batch", 2: "height", 3: "width"}
+    with torch.no_grad(), warnings.catch_warnings():
+        warnings.simplefilter("ignore", torch.jit.TracerWarning)
+        torch.onnx.export(fuse_for_inference(model), _sample(), path, input_names=[INPUT_NAME],
+                          output_names=[OUTPUT_NAME], dynamic_axes={INPUT_NAME: axes, OUTPUT_NAME: axes},
+                          opset_version=opset, do_constant_folding=True, **options)
+    proto = onnx.load(path)
+    entry = proto.metadata_props.add()
+    entry.key, entry.value = CONFIG_KEY, json.dumps(model.config)
+    onnx.save(proto, path)
+
+
+EXPORTERS = {"torchscript": export_torchscript, "onnxruntime": export_onnx}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export UNetEnhancer to TorchScript and ONNX for backends.py")
+    parser.add_argument("--checkpoint", default="lowlight_enhancer.pth")
+    parser.add_argument("--backends", nargs="+", default=list(EXPORTERS), choices=list(EXPORTERS))
+    args = parser.parse_args()
+
+    model = load_model(args.checkpoint)
+    x = torch.rand(2, 3, 200, 304)  # not the traced shape, to check the dynamic axes
+    with torch.no_grad():
+        reference = model(x)
+    for backend in args.backends:
+        path = artifact_path(args.checkpoint, backend)
+        try:
+            EXPORTERS[backend](model, path)
+            diff = (load_backend(path, backend)(x) - reference).abs().max().item()
+        except ImportError as e:
+            print(f"⚠️ {backend} skipped: {e}")
+            continue
+        print(f"✅ {backend} model saved as '{path}' (max difference to eager {diff:.1e})")
+
+
+if __name__ == "__main__":
+    main()
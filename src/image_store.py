@@ -0,0 +1,120 @@
+import collections
+import threading
+
+import cv2
+
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+# Pyramid levels stop halving once the longest side gets this small
+MIN_LEVEL_SIDE = 64
+
+
+class DecodedImage:
+    """A decoded image plus a lazily built pyramid of half-size copies."""
+
+    def __init__(self, image, on_grow=None):
+        self.levels = [image]
+        self.accounted = image.nbytes  # bytes the owning store has counted for this entry
+        self._lock = threading.Lock()
+        self._on_grow = on_grow
+
+    @property
+    def image(self):
+        return self.levels[0]
+
+    @property
+    def nbytes(self):
+        return sum(level.nbytes for level in self.levels)
+
+    def preview(self, max_side=None):
+        """The image scaled so its longest side is at most `max_side` (full size if None)."""
+        full_side = max(self.image.shape[:2])
+        if not max_side or max_side >= full_side:
+            return self.image
+
+        # Smallest cached level that is still at least max_side, then one INTER_AREA resize
+        with self._lock:
+            while max(self.levels[-1].shape[:2]) // 2 >= max(max_side, MIN_LEVEL_SIDE):
+                last = self.levels[-1]
+                half = cv2.resize(last, (last.shape[1] // 2, last.shape[0] // 2), interpolation=cv2.INTER_AREA)
+                self.levels.append(half)
+                if self._on_grow is not None:
+                    self._on_grow(half.nbytes)
+            level = next(l for l in reversed(self.levels) if max(l.shape[:2]) >= max_side)
+
+        scale = max_side / max(level.shape[:2])
+        if scale >= 1:
+            return level
+        size = (max(1, round(level.shape[1] * scale)), max(1, round(level.shape[0] * scale)))
+        return cv2.resize(level, size, interpolation=cv2.INTER_AREA)
+
+
+class ImageStore:
+    """Decoded uploads kept in memory, evicted LRU-first by total bytes.
+
+    Every interaction with an upload used to re-read and re-decode the
+    file; the store keeps the decoded array (and its preview pyramid) so
+    only the first touch pays for decoding.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = collections.OrderedDict()
+        self._used = 0
+        self._lock = threading.Lock()
+        self._counters = collections.Counter()
+
+    def put(self, name, image):
+        entry = DecodedImage(image, on_grow=lambda nbytes: self._grow(name, entry, nbytes))
+        with self._lock:
+            old = self._entries.pop(name, None)
+            if old is not None:
+                self._used -= old.accounted
+            self._entries[name] = entry
+            self._used += entry.accounted
+            self._evict()
+        return entry
+
+    def get(self, name):
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is None:
+                self._counters["misses"] += 1
+                return None
+            self._entries.move_to_end(name)
+            self._counters["hits"] += 1
+            return entry
+
+    def discard(self, name):
+        with self._lock:
+            entry = self._entries.pop(name, None)
+            if entry is not None:
+                self._used -= entry.accounted
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._used,
+                "max_bytes": self.max_bytes,
+                "hits": self._counters["hits"],
+                "misses": self._counters["misses"],
+                "evictions": self._counters["evictions"],
+            }
+
+    def _grow(self, name, entry, nbytes):
+        # A pyramid level was added to `entry`; count it if the entry is still stored
+        with self._lock:
+            if self._entries.get(name) is entry:
+                entry.accounted += nbytes
+                self._used += nbytes
+                self._evict(keep=entry)
+
+    def _evict(self, keep=None):
+        # Called with the lock held; the newest entry is never evicted, even if it alone is over the limit
+        for name in list(self._entries):
+            if self._used <= self.max_bytes or len(self._entries) == 1:
+                break
+            if self._entries[name] is keep:
+                continue
+            self._used -= self._entries.pop(name).accounted
+            self._counters["evictions"] += 1
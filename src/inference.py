@@ -0,0 +1,263 @@
+import math
+import time
+
+import cv2
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from model import UNetEnhancer, config_from_state_dict
+
+# Peak memory of one forward pass of the base model (64 channels) under no_grad, per input pixel.
+# Measured at 2.0-3.0 KB/px of RSS on CPU depending on tile size (the
+# full-resolution 64-channel skip, attention maps and the 128-channel concat in
+# decoder1 dominate); the upper end is used so memory caps hold.
+ACTIVATION_BYTES_PER_PIXEL = 3072
+# Other widths scale with their full-resolution channels, plus about 8 channels' worth
+# for the input, output and upsampling buffers that don't shrink with the width.
+# Separable convolutions add a depthwise output per conv, measured at about 1.25x
+# (tiny: 0.64-0.67 KB/px, small: 1.2-1.4 KB/px, so these estimates keep a margin).
+BASE_WIDTH = 64
+FIXED_CHANNELS = 8
+SEPARABLE_FACTOR = 1.25
+
+# The encoder pools three times, so the decoder concat needs sides divisible by 8
+SIZE_MULTIPLE = 8
+
+DEFAULT_TILE_SIZE = 512
+DEFAULT_OVERLAP = 32
+MIN_TILE_SIZE = 64
+
+
+def load_model(path, device="cpu", mmap=False):
+    """Load a UNetEnhancer state_dict saved by train.py (any preset), ready for inference.
+
+    mmap=True maps the checkpoint instead of reading it (CPU only): the load
+    is near-instant, and every process that maps the same file shares one
+    copy of the weights in the page cache, as inference never writes them.
+    """
+    state_dict = torch.load(path, map_location=device, mmap=mmap)
+    model = UNetEnhancer(**config_from_state_dict(state_dict))
+    model.load_state_dict(state_dict, assign=mmap)  # keep the mapped tensors rather than copying them
+    return model.to(device).eval()
+
+
+def model_device(model):
+    """Device a model's inputs go to; exported models (backends.py) have no parameters to ask."""
+    device = getattr(model, "device", None)
+    return device if device is not None else next(model.parameters()).device
+
+
+def median_latency_ms(model, shape, repeat=5):
+    """Median forward time of `model` on a random input of `shape`, after one warm-up call."""
+    x = torch.rand(shape)
+    times = []
+    with torch.no_grad():
+        model(x)
+        for _ in range(repeat):
+            start = time.perf_counter()
+            model(x)
+            times.append(time.perf_counter() - start)
+    return 1000 * sorted(times)[len(times) // 2]
+
+
+def image_to_tensor(image):
+    """BGR uint8 image -> (3, H, W) RGB float tensor in [0, 1], as the model was trained on."""
+    rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    return torch.from_numpy(rgb).permute(2, 0, 1).float().div_(255.0)
+
+
+def tensor_to_image(tensor):
+    """(3, H, W) RGB float tensor in [0, 1] -> BGR uint8 image."""
+    rgb = tensor.detach().clamp(0, 1).mul(255.0).round().byte().permute(1, 2, 0).cpu().numpy()
+    return cv2.cvtColor(np.ascontiguousarray(rgb), cv2.COLOR_RGB2BGR)
+
+
+def _round_up(value, multiple):
+    return (value + multiple - 1) // multiple * multiple
+
+
+def pad_to_multiple(x, multiple=SIZE_MULTIPLE):
+    """Pad an NCHW tensor on the bottom/right so both sides divide by `multiple`."""
+    h, w = x.shape[-2:]
+    pad_h, pad_w = _round_up(h, multiple) - h, _round_up(w, multiple) - w
+    if pad_h or pad_w:
+        x = F.pad(x, (0, pad_w, 0, pad_h), mode="replicate")
+    return x
+
+
+def activation_bytes_per_pixel(config=None):
+    """Peak forward-pass memory per input pixel of a UNetEnhancer with `config` (None: base)."""
+    config = config or {}
+    width = config.get("base_width", BASE_WIDTH)
+    bytes_per_pixel = ACTIVATION_BYTES_PER_PIXEL * (width + FIXED_CHANNELS) / (BASE_WIDTH + FIXED_CHANNELS)
+    if config.get("separable"):
+        bytes_per_pixel *= SEPARABLE_FACTOR
+    return round(bytes_per_pixel)
+
+
+def estimate_peak_bytes(tile_size, batch_size=1, bytes_per_pixel=ACTIVATION_BYTES_PER_PIXEL):
+    """Activation memory of one batch of tiles (excludes the output accumulators).
+
+    `bytes_per_pixel` is the model's activation_bytes_per_pixel(); the
+    default is the base model's.
+    """
+    side = _round_up(tile_size, SIZE_MULTIPLE)
+    return batch_size * side * side * bytes_per_pixel
+
+
+def tile_size_for_memory(max_memory_bytes, batch_size=1, overlap=DEFAULT_OVERLAP,
+                         bytes_per_pixel=ACTIVATION_BYTES_PER_PIXEL):
+    """Largest tile side (a multiple of 8) whose batch fits in `max_memory_bytes`."""
+    side = int(math.sqrt(max_memory_bytes / (batch_size * bytes_per_pixel)))
+    side = side // SIZE_MULTIPLE * SIZE_MULTIPLE
+    if side < max(MIN_TILE_SIZE, 2 * overlap + SIZE_MULTIPLE):
+        raise ValueError(f"max_memory_bytes={max_memory_bytes} is too small for batch_size={batch_size}")
+    return side
+
+
+def _tile_starts(length, tile, stride):
+    if length <= tile:
+        return [0]
+    starts = list(range(0, length - tile + 1, stride))
+    if starts[-1] + tile < length:
+        starts.append(length - tile)
+    return starts
+
+
+def _feather(length, overlap, ramp_start, ramp_end):
+    # 1-D blending weights: linear ramps on the sides that overlap a neighbour
+    weights = torch.ones(length)
+    ramp = torch.arange(1, overlap + 1, dtype=torch.float32) / (overlap + 1)
+    if ramp_start:
+        weights[:overlap] = ramp
+    if ramp_end:
+        weights[length - overlap:] = torch.minimum(weights[length - overlap:], ramp.flip(0))
+    return weights
+
+
+@torch.no_grad()
+def enhance_tiled(model, image, tile_size=None, overlap=DEFAULT_OVERLAP, batch_size=1, max_memory_bytes=None):
+    """Run `model` over `image` in overlapping tiles with bounded memory.
+
+    `image` is a (3, H, W) or (1, 3, H, W) float tensor in [0, 1] of any size.
+    Tiles are padded to the x8 size the UNet needs, run `batch_size` at a
+    time and blended back with feathered weights across the `overlap` band.
+    If `max_memory_bytes` is given, the tile size is picked so that one
+    batch of activations stays under it, using the per-pixel cost of the
+    model's config (smaller presets get larger tiles); peak memory is then
+    roughly that plus 16 bytes per output pixel for the blend accumulators.
+    """
+    squeeze = image.dim() == 3
+    if squeeze:
+        image = image.unsqueeze(0)
+    if image.shape[0] != 1:
+        raise ValueError("enhance_tiled expects a single image")
+    if tile_size is None:
+        if max_memory_bytes:
+            bytes_per_pixel = activation_bytes_per_pixel(getattr(model, "config", None))
+            tile_size = tile_size_for_memory(max_memory_bytes, batch_size, overlap, bytes_per_pixel)
+        else:
+            tile_size = DEFAULT_TILE_SIZE
+    if tile_size <= 2 * overlap:
+        raise ValueError("tile_size must be larger than twice the overlap")
+
+    device = model_device(model)
+    multiple = getattr(model, "size_multiple", SIZE_MULTIPLE)
+    _, _, height, width = image.shape
+    tile_h, tile_w = min(tile_size, height), min(tile_size, width)
+    ys = _tile_starts(height, tile_h, tile_size - overlap)
+    xs = _tile_starts(width, tile_w, tile_size - overlap)
+
+    output = torch.zeros(1, 3, height, width)
+    weight_sum = torch.zeros(1, 1, height, width)
+
+    tiles = [(y, x) for y in ys for x in xs]
+    for i in range(0, len(tiles), batch_size):
+        batch_pos = tiles[i:i + batch_size]
+        batch = torch.cat([image[:, :, y:y + tile_h, x:x + tile_w] for y, x in batch_pos])
+        result = model(pad_to_multiple(batch, multiple).to(device))[:, :, :tile_h, :tile_w].float().cpu()
+
+        for (y, x), tile in zip(batch_pos, result):
+            wy = _feather(tile_h, overlap, y > 0, y + tile_h < height)
+            wx = _feather(tile_w, overlap, x > 0, x + tile_w < width)
+            weight = wy[:, None] * wx[None, :]
+            output[0, :, y:y + tile_h, x:x + tile_w] += tile * weight
+            weight_sum[0, 0, y:y + tile_h, x:x + tile_w] += weight
+
+    output /= weight_sum
+    return output[0] if squeeze else output
+
+
+# Guided upsampling: the network runs on a copy with this long side and its
+# effect is transferred to full resolution as a per-pixel affine colour transform
+DEFAULT_GUIDED_SIDE = 512
+DEFAULT_GUIDED_RADIUS = 4
+DEFAULT_GUIDED_EPS = 1e-5  # small: local variance of dark inputs is tiny
+
+
+def _box(x, radius):
+    return cv2.boxFilter(x, -1, (2 * radius + 1, 2 * radius + 1), borderType=cv2.BORDER_REFLECT)
+
+
+def fit_local_affine(guide, target, radius=DEFAULT_GUIDED_RADIUS, eps=DEFAULT_GUIDED_EPS):
+    """Per-pixel affine colour maps with target ~= A @ guide + b in each local window.
+
+    `guide` and `target` are (H, W, 3) float32 images. This is the colour
+    guided filter's regression step (He et al.): a ridge-regularised
+    least-squares fit per (2r+1)^2 window, with the coefficients then
+    averaged over windows. Returns A as (H, W, 3, 3) and b as (H, W, 3).
+    """
+    h, w, _ = guide.shape
+    mean_i = _box(guide, radius)
+    mean_p = _box(target, radius)
+    # 3x3 covariance of the guide and 3x3 cross-covariance target/guide, per pixel
+    ii = (guide[..., :, None] * guide[..., None, :]).reshape(h, w, 9)
+    ip = (target[..., :, None] * guide[..., None, :]).reshape(h, w, 9)
+    cov_ii = (_box(ii, radius) - (mean_i[..., :, None] * mean_i[..., None, :]).reshape(h, w, 9)).reshape(h, w, 3, 3)
+    cov_ip = (_box(ip, radius) - (mean_p[..., :, None] * mean_i[..., None, :]).reshape(h, w, 9)).reshape(h, w, 3, 3)
+
+    a = cov_ip @ np.linalg.inv(cov_ii + eps * np.eye(3, dtype=np.float32))
+    b = mean_p - np.einsum("hwcj,hwj->hwc", a, mean_i)
+    a = _box(np.ascontiguousarray(a.reshape(h, w, 9), dtype=np.float32), radius).reshape(h, w, 3, 3)
+    return a, _box(np.ascontiguousarray(b, dtype=np.float32), radius)
+
+
+def apply_local_affine(image, a, b):
+    """Upsample affine maps from fit_local_affine to `image`'s size and apply them."""
+    h, w, _ = image.shape
+    out = np.empty_like(image)
+    # One coefficient map at a time, so peak memory stays at a few full-size planes
+    for c in range(3):
+        acc = cv2.resize(b[..., c], (w, h), interpolation=cv2.INTER_LINEAR)
+        for j in range(3):
+            acc += cv2.resize(np.ascontiguousarray(a[..., c, j]), (w, h), interpolation=cv2.INTER_LINEAR) * image[..., j]
+        out[..., c] = acc
+    return np.clip(out, 0.0, 1.0, out=out)
+
+
+@torch.no_grad()
+def enhance_guided(model, image, side=DEFAULT_GUIDED_SIDE, radius=DEFAULT_GUIDED_RADIUS, eps=DEFAULT_GUIDED_EPS):
+    """Run `model` on a downscaled copy and transfer the result to full resolution.
+
+    `image` is a (3, H, W) float tensor in [0, 1]. The network sees a copy
+    whose long side is `side`, so its cost does not grow with the input;
+    the full-resolution work is a per-pixel 3x3 affine colour transform
+    fitted between the small input and the small output. Fine detail comes
+    from the original pixels, which suits the smooth tone and colour
+    mappings the enhancer learns; sharp local effects are softened.
+    """
+    full = np.ascontiguousarray(image.permute(1, 2, 0).cpu().numpy(), dtype=np.float32)
+    h, w, _ = full.shape
+    scale = side / max(h, w)
+    if scale >= 1:
+        return enhance_tiled(model, image)
+
+    small = cv2.resize(full, (max(1, round(w * scale)), max(1, round(h * scale))), interpolation=cv2.INTER_AREA)
+    device = model_device(model)
+    x = torch.from_numpy(small).permute(2, 0, 1).unsqueeze(0)
+    multiple = getattr(model, "size_multiple", SIZE_MULTIPLE)
+    y = model(pad_to_multiple(x, multiple).to(device))[0, :, :small.shape[0], :small.shape[1]].float().cpu()
+
+    a, b = fit_local_affine(small, np.ascontiguousarray(y.permute(1, 2, 0).numpy()), radius, eps)
+    return torch.from_numpy(apply_local_affine(full, a, b)).permute(2, 0, 1)
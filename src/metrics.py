@@ -0,0 +1,42 @@
+import torch
+import torch.nn.functional as F
+
+# SSIM constants from Wang et al. 2004 for images in [0, 1]
+SSIM_WINDOW = 11
+SSIM_SIGMA = 1.5
+SSIM_C1 = 0.01 ** 2
+SSIM_C2 = 0.03 ** 2
+
+
+def psnr(pred, target, data_range=1.0):
+    """Per-image PSNR in dB for (N, C, H, W) tensors."""
+    mse = (pred.float() - target.float()).pow(2).flatten(1).mean(dim=1)
+    return 10 * torch.log10(data_range ** 2 / mse.clamp_min(1e-12))
+
+
+def _gaussian_kernel(window, sigma, device):
+    coords = torch.arange(window, dtype=torch.float64, device=device) - (window - 1) / 2
+    kernel = torch.exp(-coords ** 2 / (2 * sigma ** 2))
+    return (kernel / kernel.sum()).float()
+
+
+def _gaussian_blur(x, kernel):
+    # Separable "valid" Gaussian filter applied to every channel independently
+    channels = x.shape[1]
+    x = F.conv2d(x, kernel.view(1, 1, 1, -1).expand(channels, 1, 1, -1), groups=channels)
+    return F.conv2d(x, kernel.view(1, 1, -1, 1).expand(channels, 1, -1, 1), groups=channels)
+
+
+def ssim(pred, target, data_range=1.0, window=SSIM_WINDOW, sigma=SSIM_SIGMA):
+    """Per-image mean SSIM (Gaussian window, averaged over channels) for (N, C, H, W) tensors."""
+    pred, target = pred.float() / data_range, target.float() / data_range
+    kernel = _gaussian_kernel(window, sigma, pred.device)
+
+    # All five local statistics in one batched filter pass
+    stats = _gaussian_blur(torch.cat([pred, target, pred * pred, target * target, pred * target], dim=1), kernel)
+    mu_x, mu_y, xx, yy, xy = stats.chunk(5, dim=1)
+    var_x, var_y, cov = xx - mu_x ** 2, yy - mu_y ** 2, xy - mu_x * mu_y
+
+    ssim_map = ((2 * mu_x * mu_y + SSIM_C1) * (2 * cov + SSIM_C2)) / \
+               ((mu_x ** 2 + mu_y ** 2 + SSIM_C1) * (var_x + var_y + SSIM_C2))
+    return ssim_map.flatten(1).mean(dim=1)
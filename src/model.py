@@ -1,21 +1,53 @@
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
+from torch.utils.checkpoint import checkpoint
+from torch.ao.nn.quantized import FloatFunctional
+from torch.ao.quantization import QuantStub, DeQuantStub
+
+# cat/add/mul go through FloatFunctional so that static INT8 quantization can
+# observe and replace them (see quantize.py); in float mode they are plain ops.
+# None of these helpers hold parameters, so existing checkpoints still load.
+
+# Named model sizes. "base" is the original network; the smaller ones trade
+# quality for CPU speed (compare_models.py reports latency and PSNR).
+#            params   GFLOPs per megapixel
+#   tiny      25.8K      4.8
+#   small     94.1K     16.2
+#   base      2.38M    293.0
+MODEL_PRESETS = {
+    "tiny": dict(base_width=16, depth=3, separable=True),
+    "small": dict(base_width=32, depth=3, separable=True),
+    "base": dict(base_width=64, depth=3, separable=False),
+}
+
+# 3x3 convolution, optionally depthwise-separable (3x3 per channel, then 1x1 across channels)
+def conv3x3(in_channels, out_channels, separable=False):
+    if not separable:
+        return nn.Conv2d(in_channels, out_channels, kernel_size=3, padding=1)
+    return nn.Sequential(
+        nn.Conv2d(in_channels, in_channels, kernel_size=3, padding=1, groups=in_channels),
+        nn.Conv2d(in_channels, out_channels, kernel_size=1),
+    )
 
 # Residual Block for feature refinement
 class ResidualBlock(nn.Module):
-    def __init__(self, channels):
+    def __init__(self, channels, separable=False):
         super(ResidualBlock, self).__init__()
-        self.conv1 = nn.Conv2d(channels, channels, kernel_size=3, padding=1)
+        self.conv1 = conv3x3(channels, channels, separable)
         self.relu = nn.ReLU(inplace=True)
-        self.conv2 = nn.Conv2d(channels, channels, kernel_size=3, padding=1)
+        self.conv2 = conv3x3(channels, channels, separable)
+        self.skip_add = FloatFunctional()
+        self.inplace = False  # set by UNetEnhancer.set_memory_saving
 
     def forward(self, x):
         residual = x
         x = self.conv1(x)
         x = self.relu(x)
         x = self.conv2(x)
-        return x + residual  # Skip connection
+        if self.inplace:
+            return x.add_(residual)  # conv2 doesn't keep its output for backward
+        return self.skip_add.add(x, residual)  # Skip connection
 
 # Attention Mechanism for focus
 class AttentionBlock(nn.Module):
@@ -23,17 +55,19 @@ class AttentionBlock(nn.Module):
         super(AttentionBlock, self).__init__()
         self.conv = nn.Conv2d(channels, channels, kernel_size=1)
         self.sigmoid = nn.Sigmoid()
+        self.mul = FloatFunctional()
+        self.inplace = False  # set by UNetEnhancer.set_memory_saving
 
     def forward(self, x):
         attention = self.conv(x)
-        attention = self.sigmoid(attention)
-        return x * attention  # Element-wise multiplication
+        attention = attention.sigmoid_() if self.inplace else self.sigmoid(attention)
+        return self.mul.mul(x, attention)  # Element-wise multiplication
 
 # UNet Encoder
 class Encoder(nn.Module):
-    def __init__(self, in_channels, out_channels):
+    def __init__(self, in_channels, out_channels, separable=False):
         super(Encoder, self).__init__()
-        self.conv = nn.Conv2d(in_channels, out_channels, kernel_size=3, padding=1)
+        self.conv = conv3x3(in_channels, out_channels, separable)
         self.relu = nn.ReLU(inplace=True)
         self.pool = nn.MaxPool2d(2)
 
@@ -45,44 +79,119 @@ class Encoder(nn.Module):
 
 # UNet Decoder
 class Decoder(nn.Module):
-    def __init__(self, in_channels, out_channels):
+    def __init__(self, in_channels, out_channels, separable=False):
         super(Decoder, self).__init__()
-        self.conv = nn.Conv2d(in_channels, out_channels, kernel_size=3, padding=1)
+        self.conv = conv3x3(in_channels, out_channels, separable)
         self.relu = nn.ReLU(inplace=True)
+        self.cat = FloatFunctional()
 
     def forward(self, x, skip):
         x = F.interpolate(x, scale_factor=2, mode="bilinear", align_corners=False)  # Upsampling
-        x = torch.cat([x, skip], dim=1)  # Skip connection
+        x = self.cat.cat([x, skip], dim=1)  # Skip connection
         x = self.conv(x)
         return self.relu(x)
 
 # Full UNet Model with Residual Blocks & Attention
+# Level i (1..depth) has base_width * 2**(i-1) channels; the defaults are the
+# original 64/128/256 network, with the same module names and checkpoint keys.
 class UNetEnhancer(nn.Module):
-    def __init__(self):
+    def __init__(self, base_width=64, depth=3, separable=False):
         super(UNetEnhancer, self).__init__()
-        self.encoder1 = Encoder(3, 64)
-        self.encoder2 = Encoder(64, 128)
-        self.encoder3 = Encoder(128, 256)
+        self.config = dict(base_width=base_width, depth=depth, separable=separable)
+        self.depth = depth
+        self.size_multiple = 2 ** depth  # each level pools by 2
+        widths = [3] + [base_width * 2 ** i for i in range(depth)]
 
-        self.bottleneck = ResidualBlock(256)  # Middle block
+        for i in range(1, depth + 1):
+            setattr(self, f"encoder{i}", Encoder(widths[i - 1], widths[i], separable))
+            setattr(self, f"attention{i}", AttentionBlock(widths[i]))
+            setattr(self, f"decoder{i}", Decoder(2 * widths[i], widths[i - 1], separable))
 
-        self.decoder3 = Decoder(256 + 256, 128)
-        self.decoder2 = Decoder(128 + 128, 64)
-        self.decoder1 = Decoder(64 + 64, 3)
+        self.bottleneck = ResidualBlock(widths[depth], separable)  # Middle block
 
-        self.attention1 = AttentionBlock(64)
-        self.attention2 = AttentionBlock(128)
-        self.attention3 = AttentionBlock(256)
+        self.sigmoid = nn.Sigmoid()
+        self.quant = QuantStub()  # Identity until the model is quantized
+        self.dequant = DeQuantStub()
+        self.checkpoint_levels = False
+        self.recompute_attention = False
+
+    def set_memory_saving(self, checkpoint_levels=False, recompute_attention=False, inplace=False):
+        """Trade compute for training memory; none of this changes the weights or the output.
+
+        checkpoint_levels: keep only each encoder/decoder level's inputs for
+        backward and rerun the level then (about one extra forward pass).
+        recompute_attention: don't store the attention gates (a full-size
+        map per level); rerun their 1x1 conv and sigmoid during backward.
+        inplace: sigmoid and residual add overwrite their input where
+        autograd doesn't need it, saving one temporary each. Float
+        training only; the quantization flow needs these off.
+        """
+        self.checkpoint_levels = checkpoint_levels
+        self.recompute_attention = recompute_attention
+        for module in self.modules():
+            if isinstance(module, (AttentionBlock, ResidualBlock)):
+                module.inplace = inplace
+        return self
+
+    def _decode_level(self, i, x, skip, recompute_attention=False):
+        attention = getattr(self, f"attention{i}")
+        gated = checkpoint(attention, skip, use_reentrant=False) if recompute_attention else attention(skip)
+        return getattr(self, f"decoder{i}")(x, gated)
 
     def forward(self, x):
-        x1, skip1 = self.encoder1(x)
-        x2, skip2 = self.encoder2(x1)
-        x3, skip3 = self.encoder3(x2)
-
-        x_b = self.bottleneck(x3)
-
-        x = self.decoder3(x_b, self.attention3(skip3))
-        x = self.decoder2(x, self.attention2(skip2))
-        x = self.decoder1(x, self.attention1(skip1))
-
-        return torch.sigmoid(x)  # Output image in [0,1] range
+        x = self.quant(x)
+        # Recomputation only pays off when a backward pass will follow
+        saving = self.training and torch.is_grad_enabled()
+        checkpointed = saving and self.checkpoint_levels
+        skips = []
+        for i in range(1, self.depth + 1):
+            encoder = getattr(self, f"encoder{i}")
+            x, skip = checkpoint(encoder, x, use_reentrant=False) if checkpointed else encoder(x)
+            skips.append(skip)
+
+        x = self.bottleneck(x)
+
+        for i in range(self.depth, 0, -1):
+            if checkpointed:
+                # The whole level is rerun in backward, attention included
+                x = checkpoint(self._decode_level, i, x, skips[i - 1], use_reentrant=False)
+            else:
+                x = self._decode_level(i, x, skips[i - 1], saving and self.recompute_attention)
+
+        return self.dequant(self.sigmoid(x))  # Output image in [0,1] range
+
+
+def build_model(preset="base"):
+    if preset not in MODEL_PRESETS:
+        raise ValueError(f"Unknown preset '{preset}', expected one of {list(MODEL_PRESETS)}")
+    return UNetEnhancer(**MODEL_PRESETS[preset])
+
+
+def config_from_state_dict(state_dict):
+    """UNetEnhancer arguments that match a saved state_dict, so any preset's checkpoint loads."""
+    depth = sum(1 for k in state_dict if k.startswith("attention") and k.endswith(".conv.weight"))
+    separable = "encoder1.conv.0.weight" in state_dict
+    first = state_dict["encoder1.conv.1.weight" if separable else "encoder1.conv.weight"]
+    return dict(base_width=first.shape[0], depth=depth, separable=separable)
+
+
+def count_parameters(model):
+    return sum(p.numel() for p in model.parameters())
+
+
+def count_flops(model, height=256, width=256):
+    """Multiply-accumulates of the convolutions for one (1, 3, height, width) forward pass, times 2."""
+    macs = [0]
+
+    def hook(module, inputs, output):
+        in_per_group = module.in_channels // module.groups
+        macs[0] += output.numel() * in_per_group * module.kernel_size[0] * module.kernel_size[1]
+
+    handles = [m.register_forward_hook(hook) for m in model.modules() if isinstance(m, nn.Conv2d)]
+    try:
+        with torch.no_grad():
+            model(torch.zeros(1, 3, height, width))
+    finally:
+        for h in handles:
+            h.remove()
+    return 2 * macs[0]
@@ -0,0 +1,239 @@
+import cv2
+import numpy as np
+from PIL import Image
+
+from enhance import apply_clahe
+from denoise import denoise
+from encoding import encode
+from telemetry import span
+
+# PIL "L" conversion weights (ITU-R 601-2, 16-bit fixed point) for R, G, B
+_L_WEIGHTS = (19595 / 65536.0, 38470 / 65536.0, 7471 / 65536.0)
+
+# PIL ImageFilter.SMOOTH kernel, used as the degenerate image of ImageEnhance.Sharpness
+_SMOOTH_KERNEL = np.array([[1, 1, 1], [1, 5, 1], [1, 1, 1]], dtype=np.float32) / 13.0
+
+# cv2.addWeighted rounds to nearest; PIL's Image.blend truncates. Shifting by just
+# under half an LSB makes the rounding land where PIL's truncation does.
+_TRUNCATE_BIAS = -0.499
+
+# How close the estimated gray mean may come to a .5 boundary before it is computed exactly
+_MEAN_TIE_MARGIN = 0.01
+
+_IDENTITY = np.arange(256, dtype=np.uint8)
+
+
+def _gamma_table(gamma):
+    # Same table as gamma_correction()
+    invGamma = 1.0 / gamma
+    return np.array([(i / 255.0) ** invGamma * 255 for i in range(256)]).astype("uint8")
+
+
+def _blend_table(degenerate, factor):
+    # Image.blend(degenerate, image, factor) for a constant degenerate, as a LUT
+    values = np.float32(degenerate) + np.float32(factor) * (np.arange(256, dtype=np.float32) - np.float32(degenerate))
+    return np.clip(np.floor(values), 0, 255).astype(np.uint8)
+
+
+def _simple_wb_range(hist, p=2.0):
+    """Input range [low, high] chosen by cv2.xphoto SimpleWB for one 8-bit channel histogram."""
+    # SimpleWB clips p percent of the pixels at each end of the histogram
+    total = hist.sum()
+    below = np.cumsum(hist)
+    low = int(np.argmax(below >= np.float32(p * total / 100.0)))
+    high = int(np.nonzero(np.concatenate(([0], below[:-1])) <= np.float32((100.0 - p) * total / 100.0))[0][-1]) + 1
+    return low, high
+
+
+def _white_balance_table(hist):
+    # SimpleWB is a per-channel linear stretch of [low, high] onto [0, 255]
+    low, high = _simple_wb_range(hist)
+    # OpenCV applies it as a float32 fused multiply-add; emulating that keeps the .5 cases identical
+    scale = np.float32(255.0 / (high - low))
+    offset = np.float32(-255.0 * low / (high - low))
+    values = np.rint((np.arange(256, dtype=np.float64) * scale + offset).astype(np.float32))
+    return np.clip(values, 0, 255).astype(np.uint8)
+
+
+def _remap_hist(hist, table):
+    # Histogram of table[x] given the histogram of x
+    return np.bincount(table, weights=hist, minlength=256)
+
+
+def _cv_lut(lut):
+    # (3, 256) BGR table -> the (256, 1, 3) layout cv2.LUT expects for a 3-channel image
+    return np.ascontiguousarray(lut.T).reshape(256, 1, 3)
+
+
+def apply_channel_lut(image, lut):
+    """Map each channel of a BGR uint8 image through its row of a (3, 256) table."""
+    return cv2.LUT(image, _cv_lut(lut))
+
+
+def _pil_gray(image):
+    # PIL's "L" conversion of a BGR image; cv2's BGR2GRAY rounds differently
+    return np.asarray(Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB)).convert("L"))
+
+
+def _gray_mean(image, lut, hists):
+    """Rounded mean of the "L" image of cv2.LUT(image, lut), as ImageEnhance.Contrast computes it."""
+    total = hists[0].sum()
+    b, g, r = (np.dot(_remap_hist(hists[c], lut[c]), np.arange(256)) / total for c in range(3))
+    mean = _L_WEIGHTS[0] * r + _L_WEIGHTS[1] * g + _L_WEIGHTS[2] * b
+    # The channel means give the gray mean up to per-pixel rounding, which is
+    # tiny; only when it could flip the final rounding is the exact mean computed.
+    if abs(mean - np.floor(mean) - 0.5) < _MEAN_TIE_MARGIN:
+        mean = _pil_gray(cv2.LUT(image, _cv_lut(lut))).mean()
+    return int(mean + 0.5)
+
+# Default look of the classical chain, with CLAHE and white balance on (evaluate.py, benchmarks)
+DEFAULT_SETTINGS = dict(clip_limit=3.0, grid_size=8, gamma=1.8, brightness=1.2, contrast=1.1, saturation=1.2,
+                        sharpness=1.3)
+
+
+class EnhancementPipeline:
+    """Classical enhancement chain with its pointwise stages fused into one LUT.
+
+    Stage order matches the per-step functions: CLAHE, then gamma, white
+    balance, brightness, contrast and any extra per-channel curves (compiled
+    into a single 256-entry LUT per channel and applied with one cv2.LUT
+    pass), then saturation, sharpness and denoising. Results match the
+    per-step implementations within 1 LSB.
+    """
+
+    def __init__(self, clahe=False, clip_limit=3.0, grid_size=8, gamma=None, white_balance=False,
+                 brightness=1.0, contrast=1.0, saturation=1.0, sharpness=1.0, denoise=None, curves=None,
+                 denoise_engine="nlmeans"):
+        self.clahe = clahe
+        self.clip_limit = clip_limit
+        self.grid_size = grid_size
+        self.gamma = gamma
+        self.white_balance = white_balance
+        self.brightness = brightness
+        self.contrast = contrast
+        self.saturation = saturation
+        self.sharpness = sharpness
+        self.denoise = denoise
+        self.denoise_engine = denoise_engine
+
+        # Optional extra tone curves: a (256,) table for all channels or a (3, 256) BGR table
+        if curves is not None:
+            curves = np.asarray(curves, dtype=np.uint8)
+            if curves.ndim == 1:
+                curves = np.tile(curves, (3, 1))
+            if curves.shape != (3, 256):
+                raise ValueError("curves must have shape (256,) or (3, 256)")
+        self.curves = curves
+
+        # Gamma, brightness and curves don't depend on the image, so build them once
+        self._gamma_table = _gamma_table(gamma) if gamma else None
+        self._brightness_table = _blend_table(0, brightness) if brightness != 1.0 else None
+
+    @classmethod
+    def from_enhancements(cls, enhancements):
+        """Build a pipeline from the `enhancements` dict posted to appp.py's /enhance."""
+        kwargs = {
+            "clahe": enhancements.get("clahe", False),
+            "clip_limit": enhancements.get("clip_limit", 3.0),
+            "grid_size": enhancements.get("grid_size", 8),
+            "white_balance": enhancements.get("white_balance", False),
+        }
+        if enhancements.get("gamma", False):
+            kwargs["gamma"] = enhancements.get("gamma_value", 1.5)
+        if enhancements.get("brightness_contrast", False):
+            kwargs["brightness"] = enhancements.get("brightness", 1.0)
+            kwargs["contrast"] = enhancements.get("contrast", 1.0)
+        if enhancements.get("saturation_sharpness", False):
+            kwargs["saturation"] = enhancements.get("saturation", 1.0)
+            kwargs["sharpness"] = enhancements.get("sharpness", 1.0)
+        return cls(**kwargs)
+
+    def has_pointwise_stages(self):
+        return bool(self.gamma or self.white_balance or self.brightness != 1.0
+                    or self.contrast != 1.0 or self.curves is not None)
+
+    def compile_lut(self, image):
+        """Compile the pointwise stages for `image` into a (3, 256) BGR table, or None if it is the identity."""
+        if not self.has_pointwise_stages():
+            return None
+        lut = np.tile(_IDENTITY, (3, 1))
+
+        # White balance and contrast depend on image statistics; both can be
+        # derived from the input histograms pushed through the LUT built so far.
+        hists = None
+        if self.white_balance or self.contrast != 1.0:
+            hists = [cv2.calcHist([image], [c], None, [256], [0, 256]).ravel() for c in range(3)]
+
+        if self._gamma_table is not None:
+            lut = self._gamma_table[lut]
+        if self.white_balance:
+            for c in range(3):
+                lut[c] = _white_balance_table(_remap_hist(hists[c], lut[c]))[lut[c]]
+        if self._brightness_table is not None:
+            lut = self._brightness_table[lut]
+        if self.contrast != 1.0:
+            lut = _blend_table(_gray_mean(image, lut, hists), self.contrast)[lut]
+        if self.curves is not None:
+            lut = np.stack([self.curves[c][lut[c]] for c in range(3)])
+        return lut
+
+    def apply_lut(self, image):
+        lut = self.compile_lut(image)
+        if lut is None:
+            return image
+        return apply_channel_lut(image, lut)
+
+    def apply_saturation(self, image):
+        # ImageEnhance.Color: blend towards the grayscale image. Done in PIL with a
+        # single RGB round trip, because a following sharpness stage amplifies any
+        # rounding difference in the blend.
+        img = Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+        img = Image.blend(img.convert("L").convert("RGB"), img, self.saturation)
+        return cv2.cvtColor(np.asarray(img), cv2.COLOR_RGB2BGR)
+
+    def apply_sharpness(self, image):
+        # ImageEnhance.Sharpness: blend towards ImageFilter.SMOOTH, whose border pixels are left unfiltered
+        smooth = cv2.filter2D(image, -1, _SMOOTH_KERNEL, borderType=cv2.BORDER_REPLICATE)
+        smooth[0], smooth[-1] = image[0], image[-1]
+        smooth[:, 0], smooth[:, -1] = image[:, 0], image[:, -1]
+        return cv2.addWeighted(image, self.sharpness, smooth, 1.0 - self.sharpness, _TRUNCATE_BIAS)
+
+    def apply_clahe(self, image):
+        return apply_clahe(image, self.clip_limit, (self.grid_size, self.grid_size))
+
+    def apply_denoise(self, image):
+        return denoise(image, self.denoise, self.denoise_engine)
+
+    def stages(self):
+        """The enabled stages in order, as (name, params, function) triples.
+
+        `params` is a hashable summary of everything the stage's output
+        depends on besides its input, so StageCache can memoize each step.
+        """
+        stages = []
+        if self.clahe:
+            stages.append(("clahe", (self.clip_limit, self.grid_size), self.apply_clahe))
+        if self.has_pointwise_stages():
+            curves = self.curves.tobytes() if self.curves is not None else None
+            params = (self.gamma, self.white_balance, self.brightness, self.contrast, curves)
+            stages.append(("tone", params, self.apply_lut))
+        if self.saturation != 1.0:
+            stages.append(("saturation", (self.saturation,), self.apply_saturation))
+        if self.sharpness != 1.0:
+            stages.append(("sharpness", (self.sharpness,), self.apply_sharpness))
+        if self.denoise is not None:
+            stages.append(("denoise", (self.denoise, self.denoise_engine), self.apply_denoise))
+        return stages
+
+    def __call__(self, image):
+        for name, _, stage in self.stages():
+            with span(name, pixels=image.shape[0] * image.shape[1]):
+                image = stage(image)
+        return image
+
+
+def render_enhanced(image, enhancements, fmt="png", quality=None, threads=1):
+    """The /enhance settings applied to `image`, encoded in memory; run in appp's worker pool."""
+    image = EnhancementPipeline.from_enhancements(enhancements)(image)
+    with span("encode", pixels=image.shape[0] * image.shape[1]):
+        return encode(image, fmt, quality, threads)
@@ -0,0 +1,104 @@
+import argparse
+import io
+import os
+
+import torch
+from torch.ao.quantization import convert, fuse_modules, get_default_qconfig, prepare
+
+from dataset import LowLightDataset
+from inference import load_model, median_latency_ms, pad_to_multiple
+from metrics import psnr, ssim
+from model import UNetEnhancer, config_from_state_dict
+
+DEFAULT_BACKEND = "x86" if "x86" in torch.backends.quantized.supported_engines else "qnnpack"
+
+
+def fuse_groups(model):
+    """Conv + ReLU pairs that run back to back and can become single quantized kernels."""
+    # In separable models the ReLU follows the pointwise half of the conv
+    conv = ".1" if model.config["separable"] else ""
+    groups = [[f"bottleneck.conv1{conv}", "bottleneck.relu"]]
+    for i in range(1, model.depth + 1):
+        groups.append([f"encoder{i}.conv{conv}", f"encoder{i}.relu"])
+        groups.append([f"decoder{i}.conv{conv}", f"decoder{i}.relu"])
+    return groups
+
+
+def prepare_quantization(model, backend=DEFAULT_BACKEND):
+    """Fuse a float UNetEnhancer in place and insert observers for static quantization."""
+    torch.backends.quantized.engine = backend
+    model.eval()
+    fuse_modules(model, fuse_groups(model), inplace=True)
+    model.qconfig = get_default_qconfig(backend)
+    return prepare(model, inplace=True)
+
+
+def quantize(model, calibration_images, backend=DEFAULT_BACKEND):
+    """Return an INT8 copy of `model` calibrated on an iterable of (1, 3, H, W) tensors."""
+    qmodel = UNetEnhancer(**model.config)
+    qmodel.load_state_dict(model.state_dict())
+    prepare_quantization(qmodel, backend)
+    with torch.no_grad():
+        for image in calibration_images:
+            qmodel(pad_to_multiple(image))
+    return convert(qmodel, inplace=True)
+
+
+def load_quantized(path, backend=DEFAULT_BACKEND):
+    """Load a checkpoint written by this tool into an INT8 UNetEnhancer."""
+    state_dict = torch.load(path)
+    qmodel = convert(prepare_quantization(UNetEnhancer(**config_from_state_dict(state_dict)), backend), inplace=True)
+    qmodel.load_state_dict(state_dict)
+    return qmodel
+
+
+def model_size_mb(model):
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell() / 2 ** 20
+
+
+def main():
+    parser = argparse.ArgumentParser(description="INT8 post-training quantization of UNetEnhancer")
+    parser.add_argument("--checkpoint", default="lowlight_enhancer.pth")
+    parser.add_argument("--data", required=True, help="folder with low/ and high/ (e.g. our485)")
+    parser.add_argument("--out", default="lowlight_enhancer_int8.pth")
+    parser.add_argument("--calib", type=int, default=32, help="pairs used for calibration")
+    parser.add_argument("--eval", type=int, default=16, help="held-out pairs used for the quality report")
+    parser.add_argument("--backend", default=DEFAULT_BACKEND, choices=torch.backends.quantized.supported_engines)
+    args = parser.parse_args()
+
+    dataset = LowLightDataset(os.path.join(args.data, "low"), os.path.join(args.data, "high"))
+    order = torch.randperm(len(dataset), generator=torch.Generator().manual_seed(0)).tolist()
+    calib_idx, eval_idx = order[:args.calib], order[args.calib:args.calib + args.eval]
+
+    model = load_model(args.checkpoint)
+    qmodel = quantize(model, (dataset[i][0].unsqueeze(0) for i in calib_idx), args.backend)
+    torch.save(qmodel.state_dict(), args.out)
+
+    scores = {"psnr_vs_float": [], "ssim_vs_float": [], "psnr_float_vs_gt": [], "psnr_int8_vs_gt": []}
+    with torch.no_grad():
+        for i in eval_idx:
+            low, high = dataset[i]
+            h, w = low.shape[-2:]
+            low = pad_to_multiple(low.unsqueeze(0))
+            ref = model(low)[..., :h, :w]
+            out = qmodel(low)[..., :h, :w]
+            scores["psnr_vs_float"].append(psnr(out, ref).item())
+            scores["ssim_vs_float"].append(ssim(out, ref).item())
+            scores["psnr_float_vs_gt"].append(psnr(ref, high.unsqueeze(0)).item())
+            scores["psnr_int8_vs_gt"].append(psnr(out, high.unsqueeze(0)).item())
+
+    h, w = pad_to_multiple(dataset[eval_idx[0]][0].unsqueeze(0)).shape[-2:]
+    float_ms = median_latency_ms(model, (1, 3, h, w))
+    int8_ms = median_latency_ms(qmodel, (1, 3, h, w))
+
+    print(f"✅ INT8 model saved as '{args.out}' ({args.backend}, calibrated on {len(calib_idx)} pairs)")
+    for name, values in scores.items():
+        print(f"  {name:<18} {sum(values) / len(values):.4f}")
+    print(f"  latency {h}x{w}     float {float_ms:.1f} ms | int8 {int8_ms:.1f} ms | {float_ms / int8_ms:.2f}x")
+    print(f"  model size         float {model_size_mb(model):.2f} MB | int8 {model_size_mb(qmodel):.2f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+import hashlib
+import io
+import os
+
+import cv2
+import numpy as np
+
+# rawpy is imported by the functions that decode, so apps only load LibRaw once a RAW file arrives
+RAW_FORMATS = ['.dng', '.nef', '.cr2', '.arw', '.orf', '.rw2']
+
+# Quality tiers, cheapest first:
+#   preview - embedded JPEG thumbnail, or a half-size decode if the file has none
+#   fast    - full resolution with bilinear demosaicing
+#   full    - full resolution with AHD demosaicing (rawpy's default)
+QUALITIES = ("preview", "fast", "full")
+
+# LibRaw's default output curve is BT.709: power 1/2.222 with a linear toe of slope 4.5
+BT709_POWER = 2.222
+BT709_SLOPE = 4.5
+
+
+def is_raw(filename):
+    return os.path.splitext(filename)[-1].lower() in RAW_FORMATS
+
+
+def file_digest(data):
+    """Content hash of the uploaded bytes, used as the decode cache key."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def _postprocess_options(quality, linear):
+    import rawpy
+
+    # Same defaults as a plain raw.postprocess() apart from the tier settings
+    options = {}
+    if quality == "preview":
+        # half_size merges each 2x2 Bayer block into one pixel, so there is no demosaic step at all
+        options["half_size"] = True
+    elif quality == "fast":
+        options["demosaic_algorithm"] = rawpy.DemosaicAlgorithm.LINEAR
+    if linear:
+        options.update(output_bps=16, gamma=(1, 1))
+    return options
+
+
+def _decode_thumbnail(raw):
+    import rawpy
+
+    try:
+        thumb = raw.extract_thumb()
+    except (rawpy.LibRawNoThumbnailError, rawpy.LibRawUnsupportedThumbnailError):
+        return None
+    if thumb.format == rawpy.ThumbFormat.JPEG:
+        return cv2.imdecode(np.frombuffer(thumb.data, np.uint8), cv2.IMREAD_COLOR)
+    return cv2.cvtColor(thumb.data, cv2.COLOR_RGB2BGR)
+
+
+def decode_raw(data, quality="full", linear=False):
+    """Decode RAW file bytes into a BGR image.
+
+    Returns uint8 with the camera's display curve, or with `linear=True`
+    uint16 linear sensor values (for tone_map_linear). The embedded
+    thumbnail only exists in display-referred 8-bit, so a linear preview
+    is a half-size decode instead.
+    """
+    import rawpy
+
+    if quality not in QUALITIES:
+        raise ValueError(f"quality must be one of {QUALITIES}")
+    with rawpy.imread(io.BytesIO(data)) as raw:
+        if quality == "preview" and not linear:
+            image = _decode_thumbnail(raw)
+            if image is not None:
+                return image
+        rgb = raw.postprocess(**_postprocess_options(quality, linear))
+    return cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR)
+
+
+def _bt709_encode(x):
+    return np.where(x < 0.018, BT709_SLOPE * x, 1.099 * np.power(x, 1.0 / BT709_POWER) - 0.099)
+
+
+def tone_map_linear(image, gamma=None):
+    """uint16 linear image -> uint8 with the display curve and an optional gamma correction.
+
+    Applies LibRaw's output curve followed by the same power law as
+    gamma_correction(), through one 65536-entry table. The result only
+    gets quantized to 8 bits once instead of twice.
+    """
+    x = np.arange(65536, dtype=np.float64) / 65535.0
+    encoded = _bt709_encode(x)
+    if gamma:
+        encoded = np.power(encoded, 1.0 / gamma)
+    table = np.clip(encoded * 255, 0, 255).astype(np.uint8)
+    return table[image]
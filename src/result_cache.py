@@ -0,0 +1,190 @@
+import collections
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+DEFAULT_MEMORY_BYTES = 256 * 1024 * 1024
+DEFAULT_DISK_BYTES = 2 * 1024 * 1024 * 1024
+# Bump when the processing code changes in a way that alters outputs, so old entries stop matching
+CACHE_VERSION = 1
+HASH_CHUNK = 1024 * 1024
+
+
+def params_key(params):
+    """Canonical text form of a parameter dict: key order and whitespace don't matter."""
+    return json.dumps(params, sort_keys=True, separators=(",", ":"), default=str)
+
+
+class ResultCache:
+    """Two-tier (memory LRU + disk) store of encoded results, keyed by content.
+
+    Keys combine the SHA-256 of the source file with the canonical
+    parameters, so re-posting the same upload and settings finds the
+    stored bytes no matter what the file is called. Both tiers are
+    bounded in bytes and evict least recently used entries first; a disk
+    hit is promoted back into memory.
+    """
+
+    def __init__(self, memory_bytes=DEFAULT_MEMORY_BYTES, disk_dir=None, disk_bytes=DEFAULT_DISK_BYTES):
+        self.memory_bytes = memory_bytes
+        self.disk_dir = disk_dir
+        self.disk_bytes = disk_bytes
+
+        self._lock = threading.Lock()
+        self._memory = collections.OrderedDict()
+        self._memory_used = 0
+        self._disk = collections.OrderedDict()
+        self._disk_used = 0
+        # (path, size, mtime) -> digest, so an unchanged upload is hashed only once
+        self._digests = collections.OrderedDict()
+        self._counters = collections.Counter()
+
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._load_disk_index()
+
+    def key(self, path, params):
+        digest = self.file_digest(path)
+        text = f"{CACHE_VERSION}:{digest}:{params_key(params)}"
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def file_digest(self, path):
+        st = os.stat(path)
+        stamp = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+        with self._lock:
+            if stamp in self._digests:
+                self._digests.move_to_end(stamp)
+                return self._digests[stamp]
+
+        sha = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+                sha.update(chunk)
+        digest = sha.hexdigest()
+
+        with self._lock:
+            self._digests[stamp] = digest
+            while len(self._digests) > 4096:
+                self._digests.popitem(last=False)
+        return digest
+
+    def get(self, key):
+        """Stored bytes for `key`, or None on a miss."""
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self._counters["memory_hits"] += 1
+                return data
+            on_disk = key in self._disk
+            if on_disk:
+                self._disk.move_to_end(key)
+
+        data = self._read_disk(key) if on_disk else None
+        with self._lock:
+            if data is None:
+                self._counters["misses"] += 1
+                return None
+            self._counters["disk_hits"] += 1
+            self._put_memory(key, data)
+        return data
+
+    def put(self, key, data):
+        with self._lock:
+            self._put_memory(key, data)
+        if self.disk_dir and len(data) <= self.disk_bytes:
+            self._write_disk(key, data)
+
+    def stats(self):
+        with self._lock:
+            counters = self._counters
+            lookups = counters["memory_hits"] + counters["disk_hits"] + counters["misses"]
+            return {
+                "memory_hits": counters["memory_hits"],
+                "disk_hits": counters["disk_hits"],
+                "misses": counters["misses"],
+                "hit_rate": round((lookups - counters["misses"]) / lookups, 4) if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_used,
+                "disk_entries": len(self._disk),
+                "disk_bytes": self._disk_used,
+                "evictions": counters["evictions"],
+            }
+
+    def _put_memory(self, key, data):
+        # Called with the lock held
+        if len(data) > self.memory_bytes:
+            return
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_used -= len(old)
+        self._memory[key] = data
+        self._memory_used += len(data)
+        while self._memory_used > self.memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_used -= len(evicted)
+            self._counters["evictions"] += 1
+
+    def _path(self, key):
+        return os.path.join(self.disk_dir, key)
+
+    def _read_disk(self, key):
+        try:
+            with open(self._path(key), "rb") as f:
+                data = f.read()
+            os.utime(self._path(key))
+            return data
+        except FileNotFoundError:
+            with self._lock:
+                size = self._disk.pop(key, None)
+                if size is not None:
+                    self._disk_used -= size
+            return None
+
+    def _write_disk(self, key, data):
+        # Write to a temp file and rename, so readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.disk_dir, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, self._path(key))
+
+        with self._lock:
+            self._disk_used -= self._disk.pop(key, 0)
+            self._disk[key] = len(data)
+            self._disk_used += len(data)
+            evicted = self._evict_disk()
+        self._remove_files(evicted)
+
+    def _evict_disk(self):
+        # Called with the lock held; returns the keys whose files should be removed
+        evicted = []
+        while self._disk_used > self.disk_bytes:
+            old_key, size = self._disk.popitem(last=False)
+            self._disk_used -= size
+            self._counters["evictions"] += 1
+            evicted.append(old_key)
+        return evicted
+
+    def _remove_files(self, keys):
+        for key in keys:
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+
+    def _load_disk_index(self):
+        # Rebuild the LRU order left by an earlier process; hits refresh a file's mtime
+        entries = []
+        for name in os.listdir(self.disk_dir):
+            path = os.path.join(self.disk_dir, name)
+            if name.endswith(".tmp"):
+                os.remove(path)
+                continue
+            st = os.stat(path)
+            entries.append((st.st_mtime, name, st.st_size))
+        for _, name, size in sorted(entries):
+            self._disk[name] = size
+            self._disk_used += size
+        self._remove_files(self._evict_disk())
@@ -0,0 +1,241 @@
+import atexit
+import collections
+import threading
+import time
+from concurrent.futures import CancelledError, Future, TimeoutError as FutureTimeout
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from backends import DEFAULT_BACKEND, load_backend
+from inference import model_device, image_to_tensor, tensor_to_image, enhance_tiled, enhance_guided
+
+DEFAULT_MAX_BATCH_SIZE = 8
+DEFAULT_MAX_WAIT_MS = 10
+# Requests are padded up to a multiple of this so nearby sizes share a batch
+DEFAULT_BUCKET_SIZE = 64
+# Larger images skip batching and go through tiled or guided inference instead
+DEFAULT_MAX_PIXELS = 1024 * 1024
+# Queue key of the large images; they run one at a time on the worker thread, like batches
+LARGE_KEY = "large"
+# "tiled": full-resolution inference, exact but linear in pixels;
+# "guided": low-resolution inference plus guided upsampling, near-constant time
+LARGE_IMAGE_MODES = ("tiled", "guided")
+# How many recent requests the latency percentiles are computed over
+LATENCY_WINDOW = 1000
+# How often enhance() checks its deadline and cancellation callback while waiting
+POLL_INTERVAL = 0.05
+
+
+class _Request:
+    __slots__ = ("tensor", "future", "enqueued")
+
+    def __init__(self, tensor):
+        self.tensor = tensor
+        self.future = Future()
+        self.enqueued = time.perf_counter()
+
+
+class ModelServer:
+    """Micro-batching front end for a UNetEnhancer.
+
+    Requests are queued per size bucket. A single worker thread runs a
+    bucket as soon as it holds `max_batch_size` requests, or when its
+    oldest request has waited `max_wait_ms`, so concurrent callers share
+    forward passes instead of each running a batch of one. Images over
+    `max_pixels` are queued too and run alone, tiled or guided.
+    """
+
+    def __init__(self, model, max_batch_size=DEFAULT_MAX_BATCH_SIZE, max_wait_ms=DEFAULT_MAX_WAIT_MS,
+                 bucket_size=DEFAULT_BUCKET_SIZE, max_pixels=DEFAULT_MAX_PIXELS, large_images="tiled"):
+        if large_images not in LARGE_IMAGE_MODES:
+            raise ValueError(f"large_images must be one of {LARGE_IMAGE_MODES}, got {large_images!r}")
+        self.model = model.eval()
+        self.device = model_device(model)
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.bucket_size = bucket_size
+        self.max_pixels = max_pixels
+        self.large_images = large_images
+
+        self._buckets = collections.OrderedDict()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._running = False
+
+        self._requests = 0
+        self._batches = 0
+        self._batch_sizes = collections.Counter()
+        self._latencies = collections.deque(maxlen=LATENCY_WINDOW)
+        self._queue_waits = collections.deque(maxlen=LATENCY_WINDOW)
+
+    @classmethod
+    def from_checkpoint(cls, path, device="cpu", backend=DEFAULT_BACKEND, intra_op_threads=None,
+                        inter_op_threads=None, **kwargs):
+        """Serve a train.py checkpoint ("eager") or its export.py artifact on another backend."""
+        return cls(load_backend(path, backend, intra_op_threads, inter_op_threads, device), **kwargs)
+
+    def warmup(self, sizes=((256, 256),)):
+        # First calls pay for allocator growth and kernel selection; do that before taking traffic
+        with torch.no_grad():
+            for height, width in sizes:
+                for batch in sorted({1, self.max_batch_size}):
+                    self.model(torch.zeros(batch, 3, height, width, device=self.device))
+
+    def start(self, warmup=True):
+        if warmup:
+            self.warmup()
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="model-server", daemon=True)
+        self._thread.start()
+        # Finish queued work and join the thread before the interpreter tears down torch
+        atexit.register(self.stop)
+        return self
+
+    def stop(self):
+        """Run what is still queued, then stop the worker thread; submit() raises afterwards."""
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        atexit.unregister(self.stop)
+
+    def submit(self, tensor):
+        """Queue a (3, H, W) float tensor; returns a Future for the enhanced tensor."""
+        request = _Request(tensor)
+        height, width = tensor.shape[-2:]
+        if height * width > self.max_pixels:
+            key = LARGE_KEY
+        else:
+            key = (-(-height // self.bucket_size) * self.bucket_size, -(-width // self.bucket_size) * self.bucket_size)
+        with self._cond:
+            if not self._running:
+                raise RuntimeError("ModelServer is not running")
+            self._buckets.setdefault(key, collections.deque()).append(request)
+            self._cond.notify()
+        return request.future
+
+    def enhance(self, image, timeout=None, cancelled=None):
+        """Enhance a BGR uint8 image, blocking until its batch has run.
+
+        Raises TimeoutError after `timeout` seconds and CancelledError once
+        `cancelled()` returns true while the request is still queued; it is
+        then dropped without running.
+        """
+        future = self.submit(image_to_tensor(image))
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            try:
+                return tensor_to_image(future.result(POLL_INTERVAL))
+            except FutureTimeout:
+                if deadline is not None and time.monotonic() > deadline:
+                    future.cancel()
+                    raise TimeoutError("UNet request did not finish before its deadline") from None
+                # A request whose batch is already running can't be dropped; it is waited for
+                if cancelled is not None and cancelled() and future.cancel():
+                    raise CancelledError()
+
+    def stats(self):
+        with self._cond:
+            queue_depth = sum(len(q) for q in self._buckets.values())
+            latencies = np.array(self._latencies) * 1000
+            waits = np.array(self._queue_waits) * 1000
+            batch_sizes = dict(sorted(self._batch_sizes.items()))
+            requests, batches = self._requests, self._batches
+
+        def percentiles(values):
+            if not len(values):
+                return {}
+            return {f"p{p}": round(float(np.percentile(values, p)), 2) for p in (50, 95, 99)}
+
+        return {
+            "queue_depth": queue_depth,
+            "requests": requests,
+            "batches": batches,
+            "mean_batch_size": round(requests / batches, 2) if batches else 0.0,
+            "batch_sizes": batch_sizes,
+            "latency_ms": percentiles(latencies),
+            "queue_wait_ms": percentiles(waits),
+        }
+
+    def _next_batch(self):
+        # Called with the lock held. Returns (key, None) for a bucket that is due now,
+        # or (None, seconds) until the oldest bucket becomes due (None: queue empty).
+        now = time.perf_counter()
+        oldest_key, oldest_time = None, None
+        for key, queue in self._buckets.items():
+            # A large image is a batch of its own, so it never waits for company
+            if key == LARGE_KEY or len(queue) >= self.max_batch_size:
+                return key, None
+            if oldest_time is None or queue[0].enqueued < oldest_time:
+                oldest_key, oldest_time = key, queue[0].enqueued
+        if oldest_key is None:
+            return None, None
+        remaining = oldest_time + self.max_wait - now
+        return (oldest_key, None) if remaining <= 0 else (None, remaining)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if not self._running and not self._buckets:
+                        return
+                    key, timeout = self._next_batch()
+                    if key is not None or not self._running:
+                        break
+                    self._cond.wait(timeout)
+                if key is None:
+                    # Stopping: drain whatever is left without waiting
+                    key = next(iter(self._buckets))
+                queue = self._buckets[key]
+                limit = 1 if key == LARGE_KEY else self.max_batch_size
+                batch = [queue.popleft() for _ in range(min(len(queue), limit))]
+                if not queue:
+                    del self._buckets[key]
+            # Requests cancelled while queued are dropped here; the rest can no longer be cancelled
+            batch = [r for r in batch if r.future.set_running_or_notify_cancel()]
+            if batch and key == LARGE_KEY:
+                self._run_large(batch[0])
+            elif batch:
+                self._run_batch(key, batch)
+
+    def _run_batch(self, key, batch):
+        started = time.perf_counter()
+        height, width = key
+        try:
+            inputs = torch.stack([
+                F.pad(r.tensor, (0, width - r.tensor.shape[-1], 0, height - r.tensor.shape[-2]), mode="replicate")
+                for r in batch
+            ]).to(self.device)
+            with torch.no_grad():
+                outputs = self.model(inputs).cpu()
+        except Exception as e:
+            for r in batch:
+                r.future.set_exception(e)
+            return
+        for r, out in zip(batch, outputs):
+            r.future.set_result(out[:, :r.tensor.shape[-2], :r.tensor.shape[-1]])
+        self._record(batch, started)
+
+    def _run_large(self, request):
+        started = time.perf_counter()
+        run = enhance_guided if self.large_images == "guided" else enhance_tiled
+        try:
+            request.future.set_result(run(self.model, request.tensor))
+        except Exception as e:
+            request.future.set_exception(e)
+            return
+        self._record([request], started)
+
+    def _record(self, batch, started):
+        done = time.perf_counter()
+        with self._cond:
+            self._requests += len(batch)
+            self._batches += 1
+            self._batch_sizes[len(batch)] += 1
+            for r in batch:
+                self._latencies.append(done - r.enqueued)
+                self._queue_waits.append(started - r.enqueued)
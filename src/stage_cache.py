@@ -0,0 +1,92 @@
+import collections
+import hashlib
+import threading
+import time
+
+from telemetry import span
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+
+def image_fingerprint(image):
+    """Content hash of an array (shape and dtype included)."""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"{image.shape}{image.dtype}".encode())
+    h.update(image.data if image.flags.c_contiguous else image.tobytes())
+    return h.hexdigest()
+
+
+def _stage_key(input_key, name, params):
+    return hashlib.blake2b(f"{input_key}|{name}|{params!r}".encode(), digest_size=16).hexdigest()
+
+
+class StageCache:
+    """Memoizes the intermediate outputs of a stage chain.
+
+    Each stage's output is keyed by the key of its input plus the stage's
+    own name and parameters, so keys are derived without hashing pixels
+    after the source image. When one slider moves, every stage before it
+    keeps its key and the chain resumes from the deepest cached output;
+    only that stage and the ones after it run. Outputs are held in an LRU
+    bounded by total bytes and are returned read-only, since later runs
+    share them.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = collections.OrderedDict()
+        self._used = 0
+        self._lock = threading.Lock()
+
+    def run(self, image, stages, fingerprint=None):
+        """Run `stages` (see EnhancementPipeline.stages) over `image`.
+
+        Returns the output and a report with one {"stage", "cached", "ms"}
+        dict per stage.
+        """
+        keys, key = [], fingerprint or image_fingerprint(image)
+        for name, params, _ in stages:
+            key = _stage_key(key, name, params)
+            keys.append(key)
+
+        # Resume after the deepest stage whose output is already stored
+        start, output = 0, image
+        with self._lock:
+            for i in range(len(keys) - 1, -1, -1):
+                if keys[i] in self._entries:
+                    self._entries.move_to_end(keys[i])
+                    start, output = i + 1, self._entries[keys[i]]
+                    break
+
+        report = [{"stage": name, "cached": True, "ms": 0.0} for name, _, _ in stages[:start]]
+        for (name, _, stage), key in zip(stages[start:], keys[start:]):
+            started = time.perf_counter()
+            with span(name, pixels=output.shape[0] * output.shape[1]):
+                output = stage(output)
+            report.append({"stage": name, "cached": False, "ms": 1000 * (time.perf_counter() - started)})
+            output = self._store(key, output)
+        return output, report
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._used = 0
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._used, "max_bytes": self.max_bytes}
+
+    def _store(self, key, output):
+        if output.nbytes > self.max_bytes:
+            return output
+        output.flags.writeable = False
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._used -= old.nbytes
+            self._entries[key] = output
+            self._used += output.nbytes
+            while self._used > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._used -= evicted.nbytes
+        return output
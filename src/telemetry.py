@@ -0,0 +1,284 @@
+import collections
+import contextlib
+import contextvars
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+# Histogram buckets: latency in seconds, allocation peaks in bytes
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+BYTES_BUCKETS = tuple(2 ** n for n in range(16, 34, 2))  # 64 KB .. 4 GB
+
+# Sampling interval of the stack profiler
+PROFILE_INTERVAL = 0.002
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.labels = name, help, labels
+        self._values = collections.defaultdict(float)
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1.0, **labels):
+        key = tuple(labels.get(l, "") for l in self.labels)
+        with self._lock:
+            self._values[key] += amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labels, key)} {value:g}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=SECONDS_BUCKETS):
+        self.name, self.help, self.labels, self.buckets = name, help, labels, buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(l, "") for l in self.labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._series.items()):
+                for bound, n in zip(self.buckets, counts):
+                    lines.append(f"{self.name}_bucket{_labels(self.labels + ('le',), key + (f'{bound:g}',))} {n}")
+                lines.append(f"{self.name}_bucket{_labels(self.labels + ('le',), key + ('+Inf',))} {count}")
+                lines.append(f"{self.name}_sum{_labels(self.labels, key)} {total:g}")
+                lines.append(f"{self.name}_count{_labels(self.labels, key)} {count}")
+        return lines
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{v}"' for n, v in zip(names, values)) + "}"
+
+
+REGISTRY = []
+# Extra metric lines computed at scrape time (e.g. cache stats owned by another module)
+COLLECTORS = []
+
+
+def counter(name, help, labels=()):
+    metric = Counter(name, help, labels)
+    REGISTRY.append(metric)
+    return metric
+
+
+def histogram(name, help, labels=(), buckets=SECONDS_BUCKETS):
+    metric = Histogram(name, help, labels, buckets)
+    REGISTRY.append(metric)
+    return metric
+
+
+STAGE_SECONDS = histogram("enhance_stage_seconds", "Duration of one enhancement stage", ("stage",))
+STAGE_PEAK_BYTES = histogram("enhance_stage_peak_bytes", "Peak traced allocation during one stage", ("stage",),
+                             BYTES_BUCKETS)
+STAGE_PIXELS = counter("enhance_stage_pixels_total", "Pixels processed per stage", ("stage",))
+
+
+def render_prometheus():
+    """All registered metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    for collect in COLLECTORS:
+        lines.extend(collect())
+    return "\n".join(lines) + "\n"
+
+
+def sample_lines(name, help, values, kind="gauge"):
+    """Render {labels tuple or None: value} as one metric family, for COLLECTORS."""
+    lines = [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+    for labels, value in values.items():
+        suffix = "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}" if labels else ""
+        lines.append(f"{name}{suffix} {value:g}")
+    return lines
+
+
+class Trace:
+    """The spans recorded while it is active, in the order they finished."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans = []
+
+    def summary(self):
+        return [{"stage": s["stage"], "ms": round(1000 * s["seconds"], 2), "peak_bytes": s["peak_bytes"]}
+                for s in self.spans]
+
+    def server_timing(self):
+        """Value for a Server-Timing response header (shown by browser dev tools)."""
+        return ", ".join(f"{s['stage']};dur={1000 * s['seconds']:.1f}" for s in self.spans)
+
+
+_current_trace = contextvars.ContextVar("telemetry_trace", default=None)
+_memory_stack = threading.local()
+# Peak allocation tracking uses tracemalloc, which slows allocation-heavy
+# code noticeably; it is on only when asked for. Numpy (and so OpenCV)
+# buffers are traced, PIL's image memory is not.
+TRACK_MEMORY = os.environ.get("TELEMETRY_TRACK_MEMORY") == "1"
+
+
+@contextlib.contextmanager
+def trace():
+    """Collect the spans of everything run inside the block (one request, one Streamlit rerun)."""
+    t = Trace()
+    token = _current_trace.set(t)
+    try:
+        yield t
+    finally:
+        _current_trace.reset(token)
+
+
+@contextlib.contextmanager
+def span(stage, pixels=None):
+    """Time a stage and record it in the metrics and in the active trace, if any."""
+    tracking = TRACK_MEMORY and tracemalloc.is_tracing()
+    if tracking:
+        stack = _memory_stack.__dict__.setdefault("frames", [])
+        current, peak = tracemalloc.get_traced_memory()
+        if stack:
+            # Keep the enclosing span's peak before resetting the counter for this one
+            stack[-1][1] = max(stack[-1][1], peak)
+        stack.append([current, 0])
+        tracemalloc.reset_peak()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        peak_bytes = None
+        if tracking:
+            start_bytes, child_peak = stack.pop()
+            peak = max(tracemalloc.get_traced_memory()[1], child_peak)
+            peak_bytes = max(0, peak - start_bytes)
+            if stack:
+                stack[-1][1] = max(stack[-1][1], peak)
+            STAGE_PEAK_BYTES.observe(peak_bytes, stage=stage)
+        STAGE_SECONDS.observe(seconds, stage=stage)
+        if pixels:
+            STAGE_PIXELS.inc(pixels, stage=stage)
+        t = _current_trace.get()
+        if t is not None:
+            t.spans.append({"stage": stage, "start": start - t.started, "seconds": seconds, "peak_bytes": peak_bytes})
+
+
+def replay(spans):
+    """Record spans finished in another process (a pool worker) as if they had run here."""
+    t = _current_trace.get()
+    for s in spans:
+        STAGE_SECONDS.observe(s["seconds"], stage=s["stage"])
+        if s["peak_bytes"] is not None:
+            STAGE_PEAK_BYTES.observe(s["peak_bytes"], stage=s["stage"])
+        if t is not None:
+            t.spans.append(s)
+
+
+def enable_memory_tracking():
+    global TRACK_MEMORY
+    TRACK_MEMORY = True
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+if TRACK_MEMORY:
+    enable_memory_tracking()
+
+
+class SamplingProfiler:
+    """Samples one thread's Python stack on a timer and counts folded stacks.
+
+    The output of `folded()` is the "collapsed stack" format read by
+    flamegraph.pl, speedscope and inferno: one `frame;frame;frame count`
+    line per distinct stack.
+    """
+
+    def __init__(self, thread_id=None, interval=PROFILE_INTERVAL):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval
+        self.samples = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+
+    def folded(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+    def save(self, directory, prefix="profile"):
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{prefix}-{time.strftime('%Y%m%d-%H%M%S')}-{self.thread_id}.folded")
+        with open(path, "w") as f:
+            f.write(self.folded())
+        return path
+
+
+def start_metrics_server(port):
+    """Serve /metrics from a background thread, for processes without a web app (Streamlit, batch)."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = render_prometheus().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("0.0.0.0", port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
+
+
+_env_server = None
+
+
+def start_metrics_server_from_env():
+    """Start the exporter once per process if METRICS_PORT is set; safe to call on every Streamlit rerun."""
+    global _env_server
+    port = os.environ.get("METRICS_PORT")
+    if port and _env_server is None:
+        _env_server = start_metrics_server(int(port))
+    return _env_server
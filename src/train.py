@@ -1,55 +1,194 @@
 import torch
+import torch.distributed as dist
 import torch.nn as nn
 import torch.optim as optim
+from torch.nn.parallel import DistributedDataParallel
 from torch.utils.data import DataLoader
-from dataset import LowLightDataset
-from model import UNetEnhancer
+from torch.utils.data.distributed import DistributedSampler
+from dataset import LowLightDataset, CachedLowLightDataset, collate_uint8, batch_to_float
+from model import MODEL_PRESETS, build_model
+import argparse
+import contextlib
+import math
 import os
+import time
 
 # Set device (Use GPU if available)
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
 # Dataset paths
 DATASET_PATH = r"D:\LowLight-Enhancement\dataset\our485"
-LOW_IMG_PATH = os.path.join(DATASET_PATH, "low")
-HIGH_IMG_PATH = os.path.join(DATASET_PATH, "high")
 
 # Hyperparameters
 BATCH_SIZE = 8
 EPOCHS = 50
 LEARNING_RATE = 1e-4
+PATCH_SIZE = 256  # random crop size when training from the cache
 
-# Load dataset
-dataset = LowLightDataset(LOW_IMG_PATH, HIGH_IMG_PATH)
-dataloader = DataLoader(dataset, batch_size=BATCH_SIZE, shuffle=True)
+# Training engine options; the defaults reproduce the plain single-process float32 loop.
+# Data-parallel training runs one process per rank, launched by torchrun, e.g. on one host
+#   torchrun --standalone --nproc_per_node 4 train.py --data ...
+# or across CPU hosts (once per host, --node_rank 0..nnodes-1; GLOO_SOCKET_IFNAME picks the NIC)
+#   torchrun --nnodes 2 --node_rank 0 --master_addr HOST0 --master_port 29500 --nproc_per_node 4 train.py ...
+parser = argparse.ArgumentParser(description="Train UNetEnhancer")
+parser.add_argument("--data", default=DATASET_PATH, help="folder with low/, high/ and optionally cache/")
+parser.add_argument("--preset", default="base", choices=list(MODEL_PRESETS), help="model size (see model.py)")
+parser.add_argument("--output", default=None, help="checkpoint path (default: lowlight_enhancer[_<preset>].pth)")
+parser.add_argument("--epochs", type=int, default=EPOCHS)
+parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+parser.add_argument("--fast", action="store_true", help="CPU engine preset: loader workers + channels_last")
+parser.add_argument("--workers", type=int, default=None, help="DataLoader worker processes")
+parser.add_argument("--prefetch", type=int, default=4, help="batches prefetched per worker")
+parser.add_argument("--channels-last", action="store_true", help="NHWC memory layout for model and inputs")
+parser.add_argument("--bf16", action="store_true", help="bfloat16 autocast (fast on CPUs with AVX512-BF16/AMX)")
+parser.add_argument("--compile", action="store_true", help="torch.compile the model")
+parser.add_argument("--accum-steps", type=int, default=1, help="micro-batches per optimizer step")
+parser.add_argument("--log-every", type=int, default=50, help="steps between loss/throughput reports")
+parser.add_argument("--lr-scaling", default="linear", choices=["linear", "sqrt", "none"],
+                    help="learning rate scaling with the number of processes (global batch size)")
+parser.add_argument("--warmup-epochs", type=int, default=None,
+                    help="epochs to ramp up to the scaled learning rate (default: 2 when distributed)")
+parser.add_argument("--threads", type=int, default=None,
+                    help="intra-op threads per process (default: this host's cores / processes on it)")
+parser.add_argument("--memory-saving", nargs="+", default=[],
+                    choices=["checkpoint_levels", "recompute_attention", "inplace", "all"],
+                    help="recompute activations in backward to fit larger batches/patches (see bench_memory.py)")
+args = parser.parse_args()
 
-# Initialize model, loss, and optimizer
-model = UNetEnhancer().to(device)
+# torchrun sets these; a plain `python train.py` is a world of one
+world_size = int(os.environ.get("WORLD_SIZE", 1))
+rank = int(os.environ.get("RANK", 0))
+distributed = world_size > 1
+is_main = rank == 0
+if distributed:
+    dist.init_process_group("gloo")
+    if device.type == "cuda":
+        device = torch.device("cuda", int(os.environ.get("LOCAL_RANK", 0)))
+    # torchrun defaults OMP_NUM_THREADS to 1; split the host's cores between its processes instead
+    local_processes = int(os.environ.get("LOCAL_WORLD_SIZE", 1))
+    torch.set_num_threads(args.threads or max(1, (os.cpu_count() or 1) // local_processes))
+elif args.threads:
+    torch.set_num_threads(args.threads)
+log = print if is_main else (lambda *a, **k: None)
+
+workers = args.workers if args.workers is not None else (min(8, os.cpu_count() or 1) if args.fast else 0)
+channels_last = args.channels_last or args.fast
+memory_format = torch.channels_last if channels_last else torch.contiguous_format
+
+LOW_IMG_PATH = os.path.join(args.data, "low")
+HIGH_IMG_PATH = os.path.join(args.data, "high")
+# Pre-decoded cache built with: python dataset.py <low> <high> <cache>
+CACHE_PATH = os.path.join(args.data, "cache")
+
+# Load dataset: the packed cache serves uint8 patches that are converted per batch
+use_cache = os.path.exists(CACHE_PATH)
+# --batch-size is per process; each rank reads its own 1/world_size shard of every epoch
+loader_options = dict(batch_size=args.batch_size, num_workers=workers, pin_memory=device.type == "cuda")
+if workers > 0:
+    loader_options.update(prefetch_factor=args.prefetch, persistent_workers=True)
+if use_cache:
+    dataset = CachedLowLightDataset(CACHE_PATH, patch_size=PATCH_SIZE)
+    loader_options["collate_fn"] = collate_uint8
+else:
+    dataset = LowLightDataset(LOW_IMG_PATH, HIGH_IMG_PATH)
+sampler = DistributedSampler(dataset, num_replicas=world_size, rank=rank, shuffle=True) if distributed else None
+dataloader = DataLoader(dataset, shuffle=sampler is None, sampler=sampler, **loader_options)
+
+# Initialize model, loss, and optimizer. DDP starts every rank from rank 0's weights
+# and all-reduces (averages) gradients during backward.
+net = build_model(args.preset).to(device, memory_format=memory_format)
+saving = {"checkpoint_levels", "recompute_attention", "inplace"} if "all" in args.memory_saving else set(args.memory_saving)
+net.set_memory_saving(**{option: True for option in saving})
+ddp = DistributedDataParallel(net) if distributed else None
+model = ddp or net
+model = torch.compile(model) if args.compile else model
 criterion = nn.L1Loss()  # L1 Loss for image restoration
-optimizer = optim.Adam(model.parameters(), lr=LEARNING_RATE)
+
+# The global batch is world_size times larger, so the learning rate grows with it
+# (linear rule; sqrt is gentler for Adam), reached over a few warm-up epochs. The
+# StepLR schedule stays in epochs: an epoch is still one pass over the dataset.
+lr_scale = {"linear": world_size, "sqrt": math.sqrt(world_size), "none": 1}[args.lr_scaling]
+warmup_epochs = args.warmup_epochs if args.warmup_epochs is not None else (2 if distributed else 0)
+optimizer = optim.Adam(net.parameters(), lr=LEARNING_RATE * lr_scale)
 scheduler = optim.lr_scheduler.StepLR(optimizer, step_size=10, gamma=0.5)
+if warmup_epochs > 0 and lr_scale != 1:
+    warmup = optim.lr_scheduler.LinearLR(optimizer, start_factor=1 / lr_scale, total_iters=warmup_epochs)
+    scheduler = optim.lr_scheduler.ChainedScheduler([warmup, scheduler])
+log(f"{world_size} process(es) x batch {args.batch_size} | lr {LEARNING_RATE * lr_scale:g} "
+    f"({args.lr_scaling} scaling, {warmup_epochs} warm-up epochs) | {torch.get_num_threads()} threads per process")
 
 # Training loop
-for epoch in range(EPOCHS):
+for epoch in range(args.epochs):
     model.train()
-    epoch_loss = 0
+    if sampler is not None:
+        sampler.set_epoch(epoch)  # a different shuffle each epoch, the same on every rank
+    epoch_start = time.perf_counter()
+    # Losses stay on the device and are only read back at report time, so steps don't sync
+    epoch_loss = torch.zeros((), device=device)
+    window_loss = torch.zeros((), device=device)
+    window_images, window_steps, data_time, compute_time = 0, 0, 0.0, 0.0
+    window_start = step_end = time.perf_counter()
 
-    for low_img, high_img in dataloader:
-        low_img, high_img = low_img.to(device), high_img.to(device)
+    optimizer.zero_grad(set_to_none=True)
+    for step, (low_img, high_img) in enumerate(dataloader):
+        step_start = time.perf_counter()
+        data_time += step_start - step_end
 
-        optimizer.zero_grad()
-        enhanced_img = model(low_img)
-        loss = criterion(enhanced_img, high_img)
+        if use_cache:
+            low_img, high_img = batch_to_float(low_img, device), batch_to_float(high_img, device)
+        else:
+            low_img, high_img = low_img.to(device, non_blocking=True), high_img.to(device, non_blocking=True)
+        low_img = low_img.contiguous(memory_format=memory_format)
+        high_img = high_img.contiguous(memory_format=memory_format)
 
-        loss.backward()
-        optimizer.step()
+        with torch.autocast(device.type, dtype=torch.bfloat16, enabled=args.bf16):
+            enhanced_img = model(low_img)
+        loss = criterion(enhanced_img.float(), high_img)
 
-        epoch_loss += loss.item()
+        # Gradient accumulation: average over the micro-batches of each optimizer step (the last
+        # one of the epoch may have fewer than accum_steps); under DDP gradients are only
+        # all-reduced on the micro-batch that steps
+        accum_first = step - step % args.accum_steps
+        accum_length = min(args.accum_steps, len(dataloader) - accum_first)
+        stepping = (step + 1) % args.accum_steps == 0 or step + 1 == len(dataloader)
+        with ddp.no_sync() if ddp is not None and not stepping else contextlib.nullcontext():
+            (loss / accum_length).backward()
+        if stepping:
+            optimizer.step()
+            optimizer.zero_grad(set_to_none=True)
 
-    scheduler.step()
-    print(f"Epoch [{epoch+1}/{EPOCHS}], Loss: {epoch_loss / len(dataloader):.4f}")
+        epoch_loss += loss.detach()
+        window_loss += loss.detach()
+        window_images += low_img.shape[0]
+        window_steps += 1
+        step_end = time.perf_counter()
+        compute_time += step_end - step_start
 
-# Save final model
-torch.save(model.state_dict(), "lowlight_enhancer.pth")
-print("✅ Model saved as 'lowlight_enhancer.pth'!")
+        if window_steps == args.log_every:
+            elapsed = step_end - window_start
+            log(f"  step {step + 1}/{len(dataloader)} | loss {window_loss.item() / window_steps:.4f} | "
+                f"{window_images / elapsed:.1f} img/s | data {1000 * data_time / window_steps:.1f} ms/step, "
+                f"compute {1000 * compute_time / window_steps:.1f} ms/step")
+            window_loss.zero_()
+            window_images, window_steps, data_time, compute_time = 0, 0, 0.0, 0.0
+            window_start = time.perf_counter()
+
+    scheduler.step()
+    # Loss averaged over all ranks' steps; throughput is the global images per second
+    totals = torch.tensor([epoch_loss.item(), len(dataloader), len(dataloader.sampler if sampler else dataset)],
+                          dtype=torch.float64)
+    if distributed:
+        dist.all_reduce(totals)
+    epoch_time = time.perf_counter() - epoch_start
+    log(f"Epoch [{epoch+1}/{args.epochs}], Loss: {totals[0].item() / totals[1].item():.4f} | "
+        f"{totals[2].item() / epoch_time:.1f} img/s")
 
+# Save final model (the uncompiled module, so the keys load into a plain UNetEnhancer).
+# The weights are identical on every rank, so only rank 0 writes them.
+output = args.output or ("lowlight_enhancer.pth" if args.preset == "base" else f"lowlight_enhancer_{args.preset}.pth")
+if is_main:
+    torch.save(net.state_dict(), output)
+    log(f"✅ Model saved as '{output}'!")
+if distributed:
+    dist.barrier()
+    dist.destroy_process_group()
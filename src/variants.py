@@ -0,0 +1,172 @@
+import contextlib
+import contextvars
+import math
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from encoding import FORMATS, encode, mimetype
+from pipeline import EnhancementPipeline
+from telemetry import span
+
+# How several looks of one image come back from /enhance/variants: one encoded grid
+# image, or every variant encoded on its own in a multipart/mixed body
+LAYOUTS = ("sheet", "multipart")
+DEFAULT_LAYOUT = "sheet"
+MAX_VARIANTS = 16
+# Longest side of each contact sheet tile unless the request sets max_side; the variants are
+# rendered at this size, which is what makes a sheet of many looks cheap
+SHEET_TILE_SIDE = 640
+
+SHEET_GAP = 8  # pixels around and between the tiles
+SHEET_BACKGROUND = (32, 32, 32)
+
+
+class _Node:
+    """One stage, run once for every variant whose chain starts with the same stages."""
+
+    def __init__(self, name=None, params=None, fn=None):
+        self.name, self.params, self.fn = name, params, fn
+        self.children = {}  # (name, params) of the next stage -> _Node
+        self.variants = []  # indices of the variants whose chain ends here
+
+
+def plan(pipelines):
+    """Merge the pipelines' stage chains into a tree with one node per distinct stage prefix.
+
+    Stages are matched by (name, params) as in StageCache, so two variants
+    share a node exactly when every stage up to it has the same settings.
+    The returned root stands for the input image and has no stage.
+    """
+    root = _Node()
+    for i, pipeline in enumerate(pipelines):
+        node = root
+        for name, params, fn in pipeline.stages():
+            node = node.children.setdefault((name, params), _Node(name, params, fn))
+        node.variants.append(i)
+    return root
+
+
+def count_stages(node):
+    """Stage runs in a plan (the root itself runs nothing)."""
+    return sum(1 + count_stages(child) for child in node.children.values())
+
+
+def _parallel(executor, fn, items):
+    # Each task runs in a copy of the caller's context, so its spans land in the caller's trace
+    if executor is None:
+        return [fn(*item) for item in items]
+    futures = [executor.submit(contextvars.copy_context().run, fn, *item) for item in items]
+    return [f.result() for f in futures]
+
+
+def _run_node(node, image):
+    with span(node.name, pixels=image.shape[0] * image.shape[1]):
+        return node.fn(image)
+
+
+def _run_plan(image, root, outputs, executor):
+    # Breadth first: the nodes of one tree level run side by side, and an
+    # intermediate image is dropped once the level below it has run
+    for i in root.variants:
+        outputs[i] = image
+    level = [(child, image) for child in root.children.values()]
+    while level:
+        results = _parallel(executor, _run_node, level)
+        next_level = []
+        for (node, _), result in zip(level, results):
+            for i in node.variants:
+                outputs[i] = result
+            next_level += [(child, result) for child in node.children.values()]
+        level = next_level
+
+
+def run_variants(image, pipelines, executor=None):
+    """Every pipeline applied to `image`, shared stage prefixes run once; outputs in order.
+
+    Sibling branches run on `executor`'s threads if one is given (the OpenCV
+    and numpy stages release the GIL). Outputs may share memory with each
+    other or with `image`, so treat them as read-only.
+    """
+    outputs = [None] * len(pipelines)
+    _run_plan(image, plan(pipelines), outputs, executor)
+    return outputs
+
+
+def contact_sheet(images, labels=None, columns=None, gap=SHEET_GAP):
+    """Same-size images in a grid, left to right and top to bottom, each with an optional label."""
+    columns = columns or math.ceil(math.sqrt(len(images)))
+    rows = math.ceil(len(images) / columns)
+    height, width = images[0].shape[:2]
+    sheet = np.empty((rows * (height + gap) + gap, columns * (width + gap) + gap, 3), np.uint8)
+    sheet[:] = SHEET_BACKGROUND
+    # Text scales with the tiles: about 1/25 of the tile height, and never unreadably small
+    scale = max(0.4, height / 750)
+    thickness = max(1, round(2 * scale))
+    for i, image in enumerate(images):
+        row, column = divmod(i, columns)
+        y, x = gap + row * (height + gap), gap + column * (width + gap)
+        sheet[y:y + height, x:x + width] = image
+        if labels and labels[i]:
+            origin = (x + round(10 * scale), y + round(30 * scale))
+            # Dark outline under light text stays readable on bright and dark tiles alike
+            cv2.putText(sheet, labels[i], origin, cv2.FONT_HERSHEY_SIMPLEX, scale, (0, 0, 0), 3 * thickness, cv2.LINE_AA)
+            cv2.putText(sheet, labels[i], origin, cv2.FONT_HERSHEY_SIMPLEX, scale, (255, 255, 255), thickness, cv2.LINE_AA)
+    return sheet
+
+
+def multipart_body(parts, names, fmt):
+    """multipart/mixed body with one encoded image per part, named after `names`."""
+    boundary = uuid.uuid4().hex
+    extension = FORMATS[fmt][0]
+    chunks = []
+    for name, data in zip(names, parts):
+        chunks.append(f"--{boundary}\r\nContent-Type: {mimetype(fmt)}\r\n"
+                      f"Content-Disposition: inline; name=\"{name}\"; filename=\"{name}{extension}\"\r\n"
+                      f"Content-Length: {len(data)}\r\n\r\n".encode())
+        chunks += [data, b"\r\n"]
+    chunks.append(f"--{boundary}--\r\n".encode())
+    return b"".join(chunks)
+
+
+def multipart_boundary(body):
+    """The boundary of a multipart_body(), for its Content-Type (the body starts with it)."""
+    return body[2:body.index(b"\r\n")].decode()
+
+
+def render_variants(sources, variants, source_of, fmt="png", quality=None, threads=1, layout=DEFAULT_LAYOUT,
+                    columns=None, labels=None, encode_threads=1):
+    """The /enhance/variants settings applied and encoded in memory; run in appp's worker pool.
+
+    `sources` stacks the images the variants start from (the upload, and its
+    UNet output if any variant asks for it); variant i starts from
+    sources[source_of[i]]. Returns the encoded contact sheet, or a
+    multipart_body() with one part per variant. Each part is encoded with
+    `encode_threads` as /enhance encodes, so it has the same bytes as that
+    variant's /enhance output.
+    """
+    if layout not in LAYOUTS:
+        raise ValueError(f"layout must be one of {LAYOUTS}, got {layout!r}")
+    pipelines = [EnhancementPipeline.from_enhancements(v) for v in variants]
+    outputs = [None] * len(variants)
+    with ThreadPoolExecutor(threads) if threads > 1 else contextlib.nullcontext() as executor:
+        for s in sorted(set(source_of)):
+            # One tree per source; its outputs are placed back at the variants' positions
+            members = [i for i in range(len(variants)) if source_of[i] == s]
+            results = run_variants(sources[s], [pipelines[i] for i in members], executor)
+            for i, result in zip(members, results):
+                outputs[i] = result
+
+        if layout == "sheet":
+            sheet = contact_sheet(outputs, labels, columns)
+            with span("encode", pixels=sheet.shape[0] * sheet.shape[1]):
+                return encode(sheet, fmt, quality, threads)
+
+        def encode_one(image):
+            with span("encode", pixels=image.shape[0] * image.shape[1]):
+                return encode(image, fmt, quality, encode_threads)
+        parts = _parallel(executor, encode_one, [(image,) for image in outputs])
+    names = [f"variant-{i + 1}" for i in range(len(variants))]
+    return multipart_body(parts, names, fmt)
@@ -0,0 +1,229 @@
+import math
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import telemetry
+
+DEFAULT_WORKERS = os.cpu_count() or 1
+# Admitted requests beyond the busy workers; everything past that is turned away
+DEFAULT_MAX_QUEUE = 2 * DEFAULT_WORKERS
+DEFAULT_TIMEOUT = 60.0
+# How often a waiting caller checks its deadline and whether it was cancelled
+POLL_INTERVAL = 0.05
+# Weight of the latest job in the running mean duration used for Retry-After
+DURATION_SMOOTHING = 0.2
+
+
+class Overloaded(Exception):
+    """Raised by WorkPool.admit() when every worker and queue slot is taken."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Work pool is full, retry in {retry_after} s")
+        self.retry_after = retry_after
+
+
+class Cancelled(Exception):
+    """The caller gave up on a job (e.g. its client disconnected); the worker was stopped."""
+
+
+def _worker_main(conn):
+    # Jobs arrive as (fn, shared memory name, shape, dtype, args); the image is
+    # read from shared memory so large frames are not pickled through the pipe
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            return
+        fn, name, shape, dtype, args = job
+        block = shared_memory.SharedMemory(name=name)
+        try:
+            image = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+            with telemetry.trace() as t:
+                result = fn(image, *args)
+            reply = ("ok", result, t.spans)
+        except Exception as e:
+            reply = ("error", e, [])
+        finally:
+            image = None
+            block.close()
+        try:
+            conn.send(reply)
+        except Exception as e:
+            # Result or exception that can't be pickled
+            conn.send(("error", RuntimeError(f"{type(e).__name__}: {e}"), []))
+
+
+class _Worker:
+    def __init__(self, ctx):
+        self.conn, child = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_main, args=(child,), name="enhance-worker", daemon=True)
+        self.process.start()
+        child.close()
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+class WorkPool:
+    """Bounded process pool for CPU-bound request work, with admission control.
+
+    At most `workers + max_queue` requests are admitted at a time; admit()
+    raises Overloaded beyond that, so excess load is turned away at once
+    instead of queueing without bound. run() executes a job in a worker
+    process and waits for it, up to a timeout and for as long as the
+    caller's `cancelled()` stays false. A job that times out or is
+    cancelled has its worker killed and replaced, so abandoned work stops
+    using CPU.
+    """
+
+    def __init__(self, workers=DEFAULT_WORKERS, max_queue=DEFAULT_MAX_QUEUE, timeout=DEFAULT_TIMEOUT):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        # Not plain fork: the parent runs request threads and torch's thread pools. Workers are
+        # forked from a clean server process instead, so replacing a killed one is cheap.
+        # Windows has no forkserver; spawn starts each worker from a fresh interpreter.
+        if "forkserver" in multiprocessing.get_all_start_methods():
+            self._ctx = multiprocessing.get_context("forkserver")
+            self._ctx.set_forkserver_preload(["work_pool", "pipeline", "variants"])
+        else:
+            self._ctx = multiprocessing.get_context("spawn")
+        self._idle = queue.Queue()
+        self._slots = threading.BoundedSemaphore(workers + max_queue)
+        self._lock = threading.Lock()
+        self._admitted = 0
+        self._busy = 0
+        self._mean_seconds = None
+        self._counts = {"completed": 0, "failed": 0, "rejected": 0, "timed_out": 0, "cancelled": 0}
+
+    def start(self):
+        for _ in range(self.workers):
+            self._idle.put(_Worker(self._ctx))
+        return self
+
+    def stop(self):
+        for _ in range(self.workers):
+            self._idle.get().kill()
+
+    def retry_after(self):
+        """Seconds until a slot is likely to free up, for a Retry-After header."""
+        with self._lock:
+            mean, admitted = self._mean_seconds or 1.0, self._admitted
+        return max(1, math.ceil(mean * admitted / self.workers))
+
+    def admit(self):
+        """Reserve a slot for one request; use as `with pool.admit(): ...`."""
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._counts["rejected"] += 1
+            raise Overloaded(self.retry_after())
+        with self._lock:
+            self._admitted += 1
+        return _Admission(self)
+
+    def _release(self):
+        with self._lock:
+            self._admitted -= 1
+        self._slots.release()
+
+    def run(self, fn, image, *args, timeout=None, cancelled=None):
+        """Run `fn(image, *args)` in a worker and return its result.
+
+        `fn` must be a module-level function (it is pickled by name) and
+        `image` a numpy array. Raises TimeoutError after `timeout` seconds
+        (the pool default if None) and Cancelled once `cancelled()` returns
+        true; either way the job's worker is killed and replaced. Stage
+        spans recorded in the worker are added to the caller's trace.
+        """
+        deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+        block = shared_memory.SharedMemory(create=True, size=max(1, image.nbytes))
+        try:
+            np.ndarray(image.shape, dtype=image.dtype, buffer=block.buf)[...] = image
+            worker = self._take_worker(deadline, cancelled)
+            started = time.monotonic()
+            try:
+                worker.conn.send((fn, block.name, image.shape, image.dtype.str, args))
+                while not worker.conn.poll(POLL_INTERVAL):
+                    self._check(deadline, cancelled)
+                status, value, spans = worker.conn.recv()
+            except BaseException as e:
+                worker.kill()
+                worker = _Worker(self._ctx)
+                if isinstance(e, EOFError):
+                    self._count("failed")
+                    raise RuntimeError("Worker process exited while running a job") from None
+                raise
+            finally:
+                self._give_back(worker)
+        finally:
+            block.close()
+            block.unlink()
+
+        if status != "ok":
+            self._count("failed")
+            raise value
+        telemetry.replay(spans)
+        with self._lock:
+            seconds = time.monotonic() - started
+            self._mean_seconds = seconds if self._mean_seconds is None else \
+                DURATION_SMOOTHING * seconds + (1 - DURATION_SMOOTHING) * self._mean_seconds
+            self._counts["completed"] += 1
+        return value
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "admitted": self._admitted,
+                "busy": self._busy,
+                "mean_job_ms": round(1000 * self._mean_seconds, 1) if self._mean_seconds else None,
+                **self._counts,
+            }
+
+    def _check(self, deadline, cancelled):
+        if time.monotonic() > deadline:
+            self._count("timed_out")
+            raise TimeoutError("Job did not finish before its deadline")
+        if cancelled is not None and cancelled():
+            self._count("cancelled")
+            raise Cancelled()
+
+    def _take_worker(self, deadline, cancelled):
+        while True:
+            try:
+                worker = self._idle.get(timeout=POLL_INTERVAL)
+                break
+            except queue.Empty:
+                self._check(deadline, cancelled)
+        with self._lock:
+            self._busy += 1
+        return worker
+
+    def _give_back(self, worker):
+        with self._lock:
+            self._busy -= 1
+        self._idle.put(worker)
+
+    def _count(self, name):
+        with self._lock:
+            self._counts[name] += 1
+
+
+class _Admission:
+    def __init__(self, pool):
+        self._pool = pool
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._pool._release()